@@ -0,0 +1,62 @@
+"""Latency per AnkiConnect request: probe socket + urlopen vs the keep-alive client.
+
+Usage: python benchmarks/bench_anki.py [--requests N] [--latency SECONDS]
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.fake_anki import FakeAnki  # noqa: E402
+from utils import anki  # noqa: E402
+
+
+def legacy_invoke(port: int, action, **params):
+    """What utils.anki.invoke used to do for every call"""
+    request_json = json.dumps(anki.request(action, **params)).encode("utf-8")
+    a_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if a_socket.connect_ex(("127.0.0.1", port)) != 0:
+        raise anki.AnkiError(anki.NOT_RUNNING, [])
+    response = json.load(
+        urllib.request.urlopen(
+            urllib.request.Request(f"http://127.0.0.1:{port}", request_json)
+        )
+    )
+    return response["result"]
+
+
+def per_request(fn, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn("version")
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--requests", type=int, default=500)
+    arg_parser.add_argument("--latency", type=float, default=0.0)
+    args = arg_parser.parse_args()
+
+    with FakeAnki(latency=args.latency) as fake:
+        anki.configure(host="127.0.0.1", port=fake.port)
+
+        before = per_request(lambda a: legacy_invoke(fake.port, a), args.requests)
+        after = per_request(anki.invoke, args.requests)
+
+    print(f"requests: {args.requests}, server latency: {args.latency * 1000:.1f} ms")
+    print(f"probe socket + urlopen: {before * 1000:8.3f} ms/request")
+    print(f"keep-alive AnkiClient:  {after * 1000:8.3f} ms/request")
+    print(f"speedup: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Syncs a synthetic vault into the fake AnkiConnect, end to end.
+
+Reports notes/sec, the requests made and the bytes sent for a first sync of the
+vault, then for a second sync where nothing changed, and the peak RSS of the
+process (the fake AnkiConnect and the notes it stores included). Options the benchmark does not
+know are passed on to md-to-anki, e.g. ``--pipeline`` or ``--batch-notes 50``.
+
+Usage: python benchmarks/bench_e2e.py [--files N] [--latency SECONDS] [md-to-anki options]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# ahead of ROOT, whose main.py is the old single-file script
+sys.path.insert(0, str(ROOT / "src"))
+
+# keep the hashes of the generated images out of the user's cache
+os.environ["MD_TO_ANKI_CACHE_DIR"] = tempfile.mkdtemp(prefix="md-to-anki-bench-")
+
+from rich.console import Console  # noqa: E402
+
+import main as md_to_anki  # noqa: E402
+import sync_index  # noqa: E402
+from benchmarks import vault  # noqa: E402
+from benchmarks.fake_anki import FakeAnki  # noqa: E402
+from utils import anki  # noqa: E402
+
+DECK = "bench::deck"
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        # not on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure(fake: FakeAnki, sync) -> dict:
+    notes, requests = len(fake.notes), fake.requests
+    sent, received = fake.bytes_received, fake.bytes_sent
+    actions = fake.actions.copy()
+
+    error = None
+    start = time.perf_counter()
+    try:
+        sync()
+    except anki.AnkiError as e:
+        # injected failures outside the batched notes end the run
+        error = str(e.e)
+    seconds = time.perf_counter() - start
+
+    added = len(fake.notes) - notes
+    return {
+        "seconds": round(seconds, 3),
+        "notes": added,
+        "notes_per_second": round(added / seconds, 1),
+        "requests": fake.requests - requests,
+        "bytes_sent": fake.bytes_received - sent,
+        "bytes_received": fake.bytes_sent - received,
+        "actions": dict(fake.actions - actions),
+        "error": error,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    vault.add_arguments(arg_parser)
+    arg_parser.add_argument("--latency", type=float, default=0.002)
+    arg_parser.add_argument("--note-latency", type=float, default=0.0)
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0)
+    arg_parser.add_argument("--drop-rate", type=float, default=0.0)
+    arg_parser.add_argument("--output", type=Path, help="write the report as JSON")
+    arg_parser.add_argument(
+        "--verbose", action="store_true", help="show md-to-anki's output"
+    )
+    args, rest = arg_parser.parse_known_args()
+    sync_args = md_to_anki.parse_args(rest)
+
+    spec = vault.spec_from_args(args)
+    console = Console(quiet=not args.verbose)
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp) / "vault"
+        vault.make_vault(directory, spec)
+        decks = {DECK: str(directory)}
+
+        fake = FakeAnki(
+            latency=args.latency,
+            note_latency=args.note_latency,
+            fail_rate=args.fail_rate,
+            drop_rate=args.drop_rate,
+        )
+        index = sync_index.SyncIndex(Path(tmp) / "index.sqlite3")
+        with fake:
+            anki.configure(
+                host="127.0.0.1",
+                port=fake.port,
+                connect_timeout=sync_args.connect_timeout,
+                read_timeout=sync_args.read_timeout,
+                retries=sync_args.retries,
+            )
+
+            def sync():
+                md_to_anki.sync(console, sync_args, index, decks, "discussion")
+
+            try:
+                first = measure(fake, sync)
+                unchanged = measure(fake, sync)
+            finally:
+                index.close()
+
+    report = {
+        "vault": spec.as_dict(),
+        "fake_anki": {
+            "latency": args.latency,
+            "note_latency": args.note_latency,
+            "fail_rate": args.fail_rate,
+            "drop_rate": args.drop_rate,
+        },
+        "options": rest,
+        "first_sync": first,
+        "unchanged": unchanged,
+        "connections": fake.connections,
+        "media_files": len(fake.media),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
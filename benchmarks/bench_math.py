@@ -0,0 +1,118 @@
+"""Fields/sec on math-heavy cards with the single-pass math tokenizer of md_mathjax vs
+the regex inline pattern it replaced, and how both scale with the number of math
+spans in one paragraph.
+
+Both run in the same Markdown pipeline; outputs are checked to match first, on
+cards without the ``$$...$$`` display math the regex pattern did not know.
+
+Usage: python benchmarks/bench_math.py [--cards N] [--repeat N]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# ahead of ROOT, whose main.py is the old single-file script
+sys.path.insert(0, str(ROOT / "src"))
+
+import markdown  # noqa: E402
+from markdown.extensions import Extension, codehilite, fenced_code  # noqa: E402
+from markdown.inlinepatterns import InlineProcessor  # noqa: E402
+
+from benchmarks import vault  # noqa: E402
+from md_mathjax import Md4MathjaxExtension  # noqa: E402
+
+DISPLAY = r"$$\int_{0}^{1} x^{2} \, dx = \frac{1}{3}$$"
+
+
+class RegexMathPattern(InlineProcessor):
+    """The inline pattern md_mathjax used before its tokenizer"""
+
+    def handleMatch(self, m, data):
+        text = m.group("math").replace("}", "} ")
+        return "\\(" + text + "\\)", m.start(0), m.end(0)
+
+
+class RegexMathExtension(Extension):
+    def extendMarkdown(self, md):
+        pattern = r"(?<!\$)\$(?!\$)(?P<math>.+?)(?<!\$)\$(?!\$)"
+        md.inlinePatterns.register(RegexMathPattern(pattern), "mathjax_inlined1", 190)
+
+
+def pipeline(math: Extension) -> markdown.Markdown:
+    return markdown.Markdown(
+        extensions=[
+            codehilite.CodeHiliteExtension(),
+            fenced_code.FencedCodeExtension(),
+            math,
+            "nl2br",
+        ]
+    )
+
+
+def math_cards(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    spec = vault.VaultSpec(math=1.0, code=0.05, images=0.0, seed=seed)
+    cards = []
+    for _ in range(count):
+        text = vault.card(rng, spec)
+        # a derivation: several formulas in one paragraph
+        text += "\n" + " and ".join(rng.choices(vault.MATH, k=rng.randint(2, 6)))
+        cards.append(text)
+    return cards
+
+
+def fields_per_second(md: markdown.Markdown, fields: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for field in fields:
+            md.reset()
+            md.convert(field)
+        best = min(best, time.perf_counter() - start)
+    return len(fields) / best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--cards", type=int, default=500)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    regex = pipeline(RegexMathExtension())
+    tokenizer = pipeline(Md4MathjaxExtension())
+    cards = math_cards(args.cards, args.seed)
+    for card in cards:
+        regex.reset()
+        tokenizer.reset()
+        assert regex.convert(card) == tokenizer.convert(card), card
+
+    # display math only the tokenizer renders, timed for the record
+    with_display = [f"{card}\n\n{DISPLAY}" for card in cards]
+    before = fields_per_second(regex, cards, args.repeat)
+    after = fields_per_second(tokenizer, cards, args.repeat)
+    display = fields_per_second(tokenizer, with_display, args.repeat)
+
+    print(f"cards: {len(cards)}, best of {args.repeat}")
+    print(f"regex inline pattern:  {before:10.0f} fields/sec")
+    print(f"single-pass tokenizer: {after:10.0f} fields/sec")
+    print(f"  with $$display$$:    {display:10.0f} fields/sec")
+    print(f"speedup: {after / before:.2f}x")
+
+    print("\nmath spans in one paragraph: ms per field, regex / tokenizer")
+    for spans in [10, 100, 1000]:
+        paragraph = [
+            " then ".join(vault.MATH[i % len(vault.MATH)] for i in range(spans))
+        ]
+        ms_before = 1000 / fields_per_second(regex, paragraph, args.repeat)
+        ms_after = 1000 / fields_per_second(tokenizer, paragraph, args.repeat)
+        print(f"{spans:6}: {ms_before:9.2f} / {ms_after:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
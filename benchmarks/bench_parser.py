@@ -0,0 +1,168 @@
+"""Times each stage of parsing on a synthetic vault and compares with a baseline.
+
+``parse_markdown`` splits and renders whole notes, ``md_to_html``, ``process_field``
+and ``process_fields`` work on the fields of every card and ``process_file`` reads
+notes from disk up to the Anki payload. Each is timed separately (best of
+``--repeat`` runs) and reported in units/sec as JSON.
+
+Throughput below ``--threshold`` of the baseline's is a regression, and the script
+exits with status 1. Baselines are only comparable on the same machine and vault
+parameters; record a new one with ``--save-baseline``.
+
+Usage: python benchmarks/bench_parser.py [--files N] [--repeat N] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# ahead of ROOT, whose main.py is the old single-file script
+sys.path.insert(0, str(ROOT / "src"))
+
+# keep the hashes of the generated images out of the user's cache
+os.environ["MD_TO_ANKI_CACHE_DIR"] = tempfile.mkdtemp(prefix="md-to-anki-bench-")
+
+import field_cache  # noqa: E402
+import main as md_to_anki  # noqa: E402
+import parser  # noqa: E402
+from benchmarks import vault  # noqa: E402
+
+BASELINE = ROOT / "benchmarks" / "baselines" / "parser.json"
+DECK = "bench::deck"
+
+
+def best_of(repeat: int, fn: Callable[[], object]) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(directory: Path, paths: list[Path], repeat: int) -> dict[str, dict]:
+    notes = [(path.parent, path.read_text(encoding="utf-8")) for path in paths]
+    cards = [
+        (root, fields) for root, text in notes for fields in parser.split_cards(text)
+    ]
+    fields = [
+        (root, field) for root, (text, extra, _) in cards for field in (text, extra)
+    ]
+
+    stages: dict[str, tuple[int, Callable[[], object]]] = {
+        "parse_markdown": (
+            len(notes),
+            lambda: [list(parser.parse_markdown(text, root)) for root, text in notes],
+        ),
+        "md_to_html": (
+            len(fields),
+            lambda: [parser.md_to_html(field) for _, field in fields],
+        ),
+        "process_field": (
+            len(fields),
+            lambda: [parser.process_field(field, root) for root, field in fields],
+        ),
+        "process_fields": (
+            len(cards),
+            lambda: [parser.process_fields(t, e, root) for root, (t, e, _) in cards],
+        ),
+        "process_file": (
+            len(paths),
+            lambda: [
+                md_to_anki.process_file(path.parent, DECK, str(directory), str(path))
+                for path in paths
+            ],
+        ),
+    }
+
+    results = {}
+    for name, (count, fn) in stages.items():
+        # the first call builds the renderer and hashes the images
+        fn()
+        seconds = best_of(repeat, fn)
+        results[name] = {
+            "count": count,
+            "seconds": round(seconds, 6),
+            "per_second": round(count / seconds, 1),
+        }
+    return results
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """Names of the stages slower than ``threshold`` times the baseline's throughput"""
+    if report["vault"] != baseline["vault"]:
+        print("Baseline was recorded on a different vault, not comparing")
+        return []
+
+    regressions = []
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        ratio = result["per_second"] / before["per_second"]
+        flag = ""
+        if ratio < threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:15} {ratio:6.2f}x baseline{flag}")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    vault.add_arguments(arg_parser)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--output", type=Path, help="write the report as JSON")
+    arg_parser.add_argument("--baseline", type=Path, default=BASELINE)
+    arg_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.7,
+        help="least throughput relative to the baseline before failing",
+    )
+    arg_parser.add_argument(
+        "--save-baseline", action="store_true", help="replace the baseline"
+    )
+    args = arg_parser.parse_args()
+
+    # every repeat would be served from the cache filled by the first
+    field_cache.disable()
+
+    spec = vault.spec_from_args(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        paths = vault.make_vault(directory, spec)
+        results = run(directory, paths, args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "vault": spec.as_dict(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(text + "\n", encoding="utf-8")
+        print(f"Saved baseline to {args.baseline}")
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
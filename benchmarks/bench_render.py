@@ -0,0 +1,87 @@
+"""Fields/sec of a fresh ``markdown.markdown`` call per field vs the reused renderer,
+and of the Python-Markdown backend vs the markdown-it-py one for card fields.
+
+Usage: python benchmarks/bench_render.py [--repeat N]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import markdown  # noqa: E402
+from markdown.extensions import codehilite, fenced_code  # noqa: E402
+
+from md_mathjax import Md4MathjaxExtension  # noqa: E402
+import render  # noqa: E402
+import render_markdown_it  # noqa: E402
+
+MEDIA_ROOT = ROOT / "tests" / "fixtures" / "full"
+
+
+def sample_fields() -> list[str]:
+    fields = []
+    for path in sorted((ROOT / "tests" / "fixtures").glob("*/input.md")):
+        for block in path.read_text(encoding="utf-8").split("\n\n"):
+            if block.strip():
+                fields.append(block)
+    return fields
+
+
+def fresh(raw_string: str) -> str:
+    return markdown.markdown(
+        raw_string.strip(),
+        extensions=[
+            codehilite.CodeHiliteExtension(),
+            fenced_code.FencedCodeExtension(),
+            Md4MathjaxExtension(),
+            "nl2br",
+        ],
+    ).strip("\n")
+
+
+def fields_per_second(fn, fields: list[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for field in fields:
+            fn(field)
+    return len(fields) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--repeat", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    fields = sample_fields()
+    renderer = render.MarkdownRenderer()
+    for field in fields:
+        assert fresh(field) == renderer.render(field)
+
+    before = fields_per_second(fresh, fields, args.repeat)
+    after = fields_per_second(renderer.render, fields, args.repeat)
+
+    print(f"fields: {len(fields)} x {args.repeat}")
+    print(f"markdown.markdown per field: {before:10.0f} fields/sec")
+    print(f"reused MarkdownRenderer:     {after:10.0f} fields/sec")
+    print(f"speedup: {after / before:.2f}x")
+
+    # fields as cards send them, highlighted code cached after the first pass
+    markdown_it = render_markdown_it.MarkdownItRenderer()
+    backends = {}
+    for backend in [renderer, markdown_it]:
+        backends[backend.name] = fields_per_second(
+            lambda field: backend.render_field(field, MEDIA_ROOT), fields, args.repeat
+        )
+        print(
+            f"{backend.name + ' fields:':28}{backends[backend.name]:10.0f} fields/sec"
+        )
+    speedup = backends["markdown-it"] / backends["python-markdown"]
+    print(f"markdown-it speedup: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
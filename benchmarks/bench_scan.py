@@ -0,0 +1,82 @@
+"""Time to find the changed notes of a vault where nothing changed.
+
+Compares the old per-file loop (os.walk, then read every note to look for the
+``***`` marker) with the scandir scanner checked against the sync index.
+
+Usage: python benchmarks/bench_scan.py [--files N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT))
+
+import scanner  # noqa: E402
+import sync_index  # noqa: E402
+
+CARD = "A **vector-valued** function consists of a **domain** and a **rule**.\n\n"
+
+
+def make_vault(directory: Path, count: int) -> None:
+    for i in range(count):
+        folder = directory / f"chapter{i // 100}"
+        folder.mkdir(exist_ok=True)
+        (folder / f"note{i}.md").write_text(CARD * 20 + "\n***\n", encoding="utf-8")
+    ignored = directory / "discussion"
+    ignored.mkdir()
+    for i in range(count // 10):
+        (ignored / f"thread{i}.md").write_text(CARD, encoding="utf-8")
+
+
+def legacy_scan(directory: str) -> int:
+    changed = 0
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if root.split(os.sep)[-1] in "discussion":
+                continue
+            if file.startswith("_") or not file.endswith(".md"):
+                continue
+            with open(os.path.join(root, file), "r", encoding="utf-8") as f:
+                if not f.read().rstrip("\n ").endswith("***"):
+                    changed += 1
+    return changed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--files", type=int, default=10_000)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vault = Path(tmp) / "vault"
+        vault.mkdir()
+        make_vault(vault, args.files)
+
+        index = sync_index.SyncIndex(Path(tmp) / "index.sqlite3")
+        for scanned in scanner.scan({"deck": str(vault)}, "discussion"):
+            index.plan(scanned.path, scanned.stat, [])
+            index.done(scanned.path, [])
+
+        start = time.perf_counter()
+        legacy_changed = legacy_scan(str(vault))
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        files = scanner.scan({"deck": str(vault)}, "discussion")
+        changed = scanner.changed(files, index.stats())
+        current = time.perf_counter() - start
+        index.close()
+
+    print(f"{args.files} notes, nothing changed")
+    print(f"  walk + read:     {legacy:.3f}s ({legacy_changed} changed)")
+    print(f"  scandir + index: {current:.3f}s ({len(changed)} changed)")
+
+
+if __name__ == "__main__":
+    main()
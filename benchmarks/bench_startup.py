@@ -0,0 +1,143 @@
+"""Startup cost of a sync that finds nothing to do, guarding the startup budget.
+
+Syncs a synthetic vault into a fresh sync index, then runs md-to-anki again in a new
+interpreter, the way scheduled runs do, and reports its wall time next to an empty
+interpreter's. A second run under ``python -X importtime`` lists the slowest
+imports and any module of the rendering stack that was loaded.
+
+Exits with status 1 when a heavy module is imported or the run takes more than
+``--budget`` milliseconds on top of interpreter startup.
+
+Usage: python benchmarks/bench_startup.py [--files N] [--repeat N] [--budget MS]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+sys.path.insert(0, str(ROOT))
+# ahead of ROOT, whose main.py is the old single-file script
+sys.path.insert(0, str(SRC))
+
+import scanner  # noqa: E402
+import sync_index  # noqa: E402
+from benchmarks import vault  # noqa: E402
+
+DECK = "bench::deck"
+# modules a run with nothing to sync must not load
+HEAVY = ["rich", "markdown", "bs4", "pygments", "asyncio", "http.client"]
+
+# the temporary directory goes first, for its deckConsts.py
+RUN = f"import sys; sys.path.insert(1, {str(SRC)!r}); import main; main.main()"
+
+
+def wall_times(args: list[str], cwd: Path, env: dict, repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=cwd, env=env, check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return sorted(times)
+
+
+def import_times(stderr: str) -> dict[str, tuple[int, int]]:
+    """(self, cumulative) microseconds of every module in ``-X importtime`` output"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    vault.add_arguments(arg_parser)
+    arg_parser.add_argument("--repeat", type=int, default=10)
+    arg_parser.add_argument(
+        "--budget",
+        type=float,
+        default=100.0,
+        help="most milliseconds on top of interpreter startup",
+    )
+    arg_parser.add_argument("--output", type=Path, help="write the report as JSON")
+    args = arg_parser.parse_args()
+
+    spec = vault.spec_from_args(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        vault.make_vault(directory / "vault", spec)
+        decks = {DECK: str(directory / "vault")}
+        (directory / "deckConsts.py").write_text(
+            f"DECKS = {decks!r}\nIGNORE_KEYWORDS = 'discussion'\n", encoding="utf-8"
+        )
+
+        env = dict(
+            os.environ,
+            MD_TO_ANKI_DATA_DIR=str(directory / "data"),
+            MD_TO_ANKI_CACHE_DIR=str(directory / "cache"),
+        )
+        (directory / "data").mkdir()
+        index = sync_index.SyncIndex(directory / "data" / "sync-index.sqlite3")
+        files = scanner.scan(decks, "discussion")
+        for scanned in files:
+            index.plan(scanned.path, scanned.stat, [])
+            index.done(scanned.path, [])
+        index.close()
+
+        python = wall_times([sys.executable, "-c", "pass"], directory, env, args.repeat)
+        noop = wall_times([sys.executable, "-c", RUN], directory, env, args.repeat)
+        traced = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", RUN],
+            cwd=directory,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+
+    expected = f"0 of {len(files)} notes changed since the last sync"
+    if traced.stdout.strip() != expected:
+        sys.exit(f"Expected {expected!r}, md-to-anki printed {traced.stdout!r}")
+
+    imports = import_times(traced.stderr)
+    heavy = [name for name in HEAVY if name in imports]
+    slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)
+    overhead = (noop[0] - python[0]) * 1000
+
+    report = {
+        "vault": spec.as_dict(),
+        "repeat": args.repeat,
+        "python_ms": round(python[0] * 1000, 1),
+        "nothing_to_do_ms": round(noop[0] * 1000, 1),
+        "nothing_to_do_median_ms": round(noop[len(noop) // 2] * 1000, 1),
+        "overhead_ms": round(overhead, 1),
+        "import_main_ms": round(imports["main"][1] / 1000, 1),
+        "modules": len(imports),
+        "slowest_imports": {name: own for name, (own, _) in slowest[:10]},
+        "heavy_imports": heavy,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+
+    if heavy:
+        print(f"Imported with nothing to sync: {', '.join(heavy)}")
+    if overhead > args.budget:
+        print(f"{overhead:.0f} ms over interpreter startup, budget {args.budget:.0f}")
+    if heavy or overhead > args.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""In-process stand-in for AnkiConnect, for benchmarks and tests that need no Anki GUI.
+
+    with FakeAnki(latency=0.002) as fake:
+        anki.configure(port=fake.port)
+        ...
+
+It speaks version 6 of the protocol for the actions md-to-anki uses, rejects
+duplicate notes the way Anki does (same first field and note type, within the deck
+with ``duplicateScope: deck``) and can be slowed down or made to fail. Like
+AnkiConnect, it answers unversioned actions inside ``multi`` with their bare result
+and a refused note in addNotes with a null result:
+
+- ``latency`` seconds per request and ``note_latency`` per note added or updated
+- ``errors`` maps an action to the error it always answers with
+- ``fail_rate`` of requests answer with an error, ``drop_rate`` of connections
+  are closed without an answer (before the request is applied)
+
+Run as a script to serve on AnkiConnect's port for a real sync:
+
+Usage: python benchmarks/fake_anki.py [--port 8765] [--latency SECONDS]
+"""
+
+import argparse
+import collections
+import fnmatch
+import json
+import random
+import shlex
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+DUPLICATE = "cannot create note because it is a duplicate"
+
+
+class FakeAnkiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "FakeAnkiServer"
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.fake.lock:
+            self.server.fake.connections += 1
+
+    def do_POST(self) -> None:
+        fake = self.server.fake
+        length = int(self.headers["Content-Length"])
+        body = self.rfile.read(length)
+        fake.record(len(body))
+
+        if fake.chance(fake.drop_rate):
+            self.close_connection = True
+            return
+
+        payload = json.loads(body)
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.chance(fake.fail_rate):
+            response = {"result": None, "error": "injected failure"}
+        else:
+            response = fake.dispatch(payload)
+        data = json.dumps(response).encode("utf-8")
+        with fake.lock:
+            fake.bytes_sent += len(data)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class FakeAnkiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fake: "FakeAnki", port: int = 0):
+        super().__init__(("127.0.0.1", port), FakeAnkiHandler)
+        self.fake = fake
+
+
+class FakeAnki:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        note_latency: float = 0.0,
+        errors: Optional[dict[str, str]] = None,
+        fail_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: int = 0,
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.note_latency = note_latency
+        self.errors = errors or {}
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.requested_port = port
+
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        # actions run, counting those inside multi
+        self.actions: collections.Counter[str] = collections.Counter()
+        self.notes: dict[int, dict] = {}
+        # duplicate key of every note, and the notes with that key
+        self.first_fields: dict[tuple, set[int]] = {}
+        self.media: dict[str, str] = {}
+        self.next_note_id = 1
+        self.server: Optional[FakeAnkiServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        assert self.server is not None
+        return self.server.server_address[1]
+
+    def record(self, size: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += size
+
+    def chance(self, rate: float) -> bool:
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def dispatch(self, payload: dict) -> Any:
+        with self.lock:
+            return self.run(payload)
+
+    def run(self, payload: dict) -> Any:
+        """The answer to one action: ``{"result", "error"}`` from version 5 on, only
+        the result for older versions unless the action failed, as AnkiConnect does
+        for requests and the actions of multi alike"""
+        action = payload.get("action", "")
+        self.actions[action] += 1
+        handler = getattr(self, "action_" + action, None)
+        if handler is None:
+            return {"result": None, "error": f"unsupported action: {action}"}
+        if action in self.errors:
+            return {"result": None, "error": self.errors[action]}
+        try:
+            result = handler(**payload.get("params", {}))
+        except ValueError as e:
+            return {"result": None, "error": str(e)}
+        if payload.get("version", 4) <= 4:
+            return result
+        return {"result": result, "error": None}
+
+    def work(self, notes: int) -> None:
+        """Time Anki spends on the collection, holding it like Anki's main thread"""
+        if self.note_latency:
+            time.sleep(self.note_latency * notes)
+
+    @staticmethod
+    def duplicate_key(note: dict) -> Optional[tuple]:
+        fields = note.get("fields") or {}
+        if not fields or "modelName" not in note:
+            # shorthand notes in tests, which Anki itself would refuse
+            return None
+        first = next(iter(fields.values())).strip()
+        options = note.get("options") or {}
+        model = None if options.get("checkAllModels") else note.get("modelName")
+        deck = note.get("deckName") if options.get("duplicateScope") == "deck" else None
+        return (model, deck, first)
+
+    def duplicate(self, note: dict) -> bool:
+        if (note.get("options") or {}).get("allowDuplicate"):
+            return False
+        key = self.duplicate_key(note)
+        return key is not None and bool(self.first_fields.get(key))
+
+    def index(self, note_id: int, note: dict) -> None:
+        key = self.duplicate_key(note)
+        if key is not None:
+            self.first_fields.setdefault(key, set()).add(note_id)
+
+    def unindex(self, note_id: int, note: dict) -> None:
+        key = self.duplicate_key(note)
+        if key is not None:
+            self.first_fields.get(key, set()).discard(note_id)
+
+    def action_version(self) -> int:
+        return 6
+
+    def action_addNote(self, note: dict) -> int:
+        self.work(1)
+        return self.add(note)
+
+    def action_addNotes(self, notes: list[dict]) -> list[int]:
+        """Adds every note it can; if one is refused the answer is only the errors"""
+        self.work(len(notes))
+        result: list[int] = []
+        errors: list[str] = []
+        for note in notes:
+            try:
+                result.append(self.add(note))
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            raise ValueError(str(errors))
+        return result
+
+    def add(self, note: dict) -> int:
+        if self.duplicate(note):
+            raise ValueError(DUPLICATE)
+        note_id = self.next_note_id
+        self.next_note_id += 1
+        self.notes[note_id] = note
+        self.index(note_id, note)
+        return note_id
+
+    def action_canAddNotes(self, notes: list[dict]) -> list[bool]:
+        return [not self.duplicate(note) for note in notes]
+
+    def action_canAddNotesWithErrorDetail(self, notes: list[dict]) -> list[dict]:
+        return [
+            (
+                {"canAdd": False, "error": DUPLICATE}
+                if self.duplicate(note)
+                else {"canAdd": True}
+            )
+            for note in notes
+        ]
+
+    def action_updateNoteFields(self, note: dict) -> None:
+        if note["id"] not in self.notes:
+            raise ValueError(f"Note was not found: {note['id']}")
+        self.work(1)
+        stored = self.notes[note["id"]]
+        self.unindex(note["id"], stored)
+        stored["fields"].update(note["fields"])
+        self.index(note["id"], stored)
+
+    def action_deleteNotes(self, notes: list[int]) -> None:
+        for note_id in notes:
+            stored = self.notes.pop(note_id, None)
+            if stored is not None:
+                self.unindex(note_id, stored)
+
+    def action_findNotes(self, query: str) -> list[int]:
+        """Notes matching every ``deck:``, ``tag:``, ``note:`` and ``nid:`` term"""
+        terms = shlex.split(query)
+        return [
+            note_id
+            for note_id, note in self.notes.items()
+            if all(self.matches(note_id, note, term) for term in terms)
+        ]
+
+    @staticmethod
+    def matches(note_id: int, note: dict, term: str) -> bool:
+        if term == "*":
+            return True
+        field, _, value = term.partition(":")
+        value = value.lower()
+        if field == "nid":
+            return str(note_id) in value.split(",")
+        if field == "deck":
+            deck = note.get("deckName", "").lower()
+            # a deck includes its subdecks
+            return fnmatch.fnmatchcase(deck, value) or deck.startswith(value + "::")
+        if field == "tag":
+            return any(
+                fnmatch.fnmatchcase(tag.lower(), value)
+                or tag.lower().startswith(value + "::")
+                for tag in note.get("tags", [])
+            )
+        if field == "note":
+            return fnmatch.fnmatchcase(note.get("modelName", "").lower(), value)
+        raise ValueError(f"unsupported search term: {term}")
+
+    def action_storeMediaFile(self, filename: str, **kwargs: Any) -> str:
+        self.media[filename] = kwargs.get("path", "")
+        return filename
+
+    def action_getMediaFilesNames(self, pattern: str = "*") -> list[str]:
+        return [name for name in self.media if fnmatch.fnmatchcase(name, pattern)]
+
+    def action_multi(self, actions: list[dict]) -> list:
+        return [self.run(action) for action in actions]
+
+    def start(self) -> "FakeAnki":
+        self.server = FakeAnkiServer(self, self.requested_port)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self) -> "FakeAnki":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--latency", type=float, default=0.0)
+    arg_parser.add_argument("--note-latency", type=float, default=0.0)
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0)
+    arg_parser.add_argument("--drop-rate", type=float, default=0.0)
+    args = arg_parser.parse_args()
+
+    fake = FakeAnki(
+        latency=args.latency,
+        note_latency=args.note_latency,
+        fail_rate=args.fail_rate,
+        drop_rate=args.drop_rate,
+        port=args.port,
+    ).start()
+    print(f"Fake AnkiConnect listening on 127.0.0.1:{fake.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+        print(
+            f"{fake.requests} requests, {fake.bytes_received} bytes received, "
+            f"{len(fake.notes)} notes, {len(fake.media)} media files"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Reproducible synthetic vaults for the benchmarks.
+
+Every note is a heading followed by cards separated by blank lines. The share of
+cards with ``$...$`` math, a fenced code block, an indented extra, a ``---`` extra
+or an image is configurable, as is the share of words turned into clozes; the same
+seed always writes the same vault.
+
+Usage: python benchmarks/vault.py DIRECTORY [--files N] [--cards N] [--seed N]
+"""
+
+import argparse
+import random
+import struct
+import zlib
+from pathlib import Path
+
+WORDS = (
+    "vector function domain rule curve limit derivative integral matrix basis "
+    "kernel image graph vertex edge tree node heap queue stack proof lemma "
+    "theorem field ring group order series sum product space norm"
+).split()
+
+MATH = (
+    r"$\mathbf{F}(t)=f_{1}(t)\mathbf{i}+f_{2}(t)\mathbf{j}$",
+    r"$\operatorname*{lim}_{t\to t_{0}}f(t)$",
+    r"$x_{i}^{2} + \alpha \cdot \beta$",
+    r"$\sum_{k=0}^{n} \binom{n}{k}$",
+)
+
+CODE = (
+    "```python\ndef visit(node):\n    for child in node.children:\n"
+    "        visit(child)\n```",
+    "```c\nint sum(int *a, int n) {\n\tint s = 0;\n"
+    "\tfor (int i = 0; i < n; i++) s += a[i];\n\treturn s;\n}\n```",
+)
+
+IMAGES = 8
+
+
+class VaultSpec:
+    def __init__(
+        self,
+        files: int = 100,
+        cards: int = 20,
+        cloze: float = 0.15,
+        math: float = 0.3,
+        code: float = 0.1,
+        indented: float = 0.3,
+        separated: float = 0.1,
+        images: float = 0.05,
+        seed: int = 0,
+    ):
+        self.files = files
+        self.cards = cards
+        # share of the words of a card turned into clozes, at least one per card
+        self.cloze = cloze
+        # share of cards with each feature
+        self.math = math
+        self.code = code
+        self.indented = indented
+        self.separated = separated
+        self.images = images
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    defaults = VaultSpec()
+    for name, value in defaults.as_dict().items():
+        arg_parser.add_argument(
+            f"--{name}", type=type(value), default=value, help=f"default: {value}"
+        )
+
+
+def spec_from_args(args: argparse.Namespace) -> VaultSpec:
+    return VaultSpec(**{name: getattr(args, name) for name in VaultSpec().as_dict()})
+
+
+def png(seed: int) -> bytes:
+    """A valid 1x1 PNG whose colour, and so hash, depends on ``seed``"""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    pixel = b"\x00" + bytes([seed % 256, seed * 7 % 256, seed * 13 % 256])
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(pixel))
+        + chunk(b"IEND", b"")
+    )
+
+
+def sentence(rng: random.Random, spec: VaultSpec) -> str:
+    words = rng.choices(WORDS, k=rng.randint(8, 20))
+    clozed = [i for i in range(len(words)) if rng.random() < spec.cloze]
+    for i in clozed or [rng.randrange(len(words))]:
+        words[i] = f"**{words[i]}**"
+    return " ".join(words).capitalize() + "."
+
+
+def card(rng: random.Random, spec: VaultSpec) -> str:
+    lines = [sentence(rng, spec)]
+    if rng.random() < spec.math:
+        lines[0] += " Where " + rng.choice(MATH) + " holds."
+    if rng.random() < spec.images:
+        lines.append(f"![|300](z_attachments/image{rng.randrange(IMAGES)}.png)")
+    if rng.random() < spec.code:
+        lines.append(rng.choice(CODE))
+    if rng.random() < spec.indented:
+        lines.append("\t" + " ".join(rng.choices(WORDS, k=10)))
+    if rng.random() < spec.separated:
+        extra = " ".join(rng.choices(WORDS, k=12))
+        lines.append(f"\n---\n{extra}\n{rng.choice(MATH)}\n---")
+    return "\n".join(lines)
+
+
+def note(rng: random.Random, spec: VaultSpec, number: int) -> str:
+    cards = [card(rng, spec) for _ in range(spec.cards)]
+    return f"# Topic {number}\n\n" + "\n\n".join(cards) + "\n"
+
+
+def make_vault(directory: Path, spec: VaultSpec) -> list[Path]:
+    """Writes the notes of ``spec`` into ``directory`` and returns their paths"""
+    rng = random.Random(spec.seed)
+    paths = []
+    for i in range(spec.files):
+        folder = directory / f"chapter{i // 100}"
+        if not folder.exists():
+            attachments = folder / "z_attachments"
+            attachments.mkdir(parents=True)
+            for image in range(IMAGES):
+                (attachments / f"image{image}.png").write_bytes(png(image))
+        path = folder / f"note{i}.md"
+        path.write_text(note(rng, spec, i), encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("directory", type=Path)
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    paths = make_vault(args.directory, spec_from_args(args))
+    print(f"Wrote {len(paths)} notes to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
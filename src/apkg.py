@@ -0,0 +1,382 @@
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+import string
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from parser import RawCard
+
+MODEL_NAME = "cloze"
+FIELDS = ["Text", "Extra"]
+CSS = """.card {
+  font-family: arial;
+  font-size: 20px;
+  text-align: center;
+  color: black;
+  background-color: white;
+}
+.cloze {
+  font-weight: bold;
+  color: blue;
+}
+"""
+
+CLOZE_ORD_RE = re.compile(r"\{\{c(\d+)::")
+HTML_TAG_RE = re.compile(r"<[^>]*>", re.DOTALL)
+
+BASE91 = string.ascii_letters + string.digits + "!#$%&()*+,-./:;<=>?@[]^_`{|}~"
+
+# the schema of collections in legacy .apkg packages, which every Anki can import
+SCHEMA = """
+CREATE TABLE col (
+    id integer PRIMARY KEY, crt integer NOT NULL, mod integer NOT NULL,
+    scm integer NOT NULL, ver integer NOT NULL, dty integer NOT NULL,
+    usn integer NOT NULL, ls integer NOT NULL, conf text NOT NULL,
+    models text NOT NULL, decks text NOT NULL, dconf text NOT NULL, tags text NOT NULL
+);
+CREATE TABLE notes (
+    id integer PRIMARY KEY, guid text NOT NULL, mid integer NOT NULL,
+    mod integer NOT NULL, usn integer NOT NULL, tags text NOT NULL,
+    flds text NOT NULL, sfld integer NOT NULL, csum integer NOT NULL,
+    flags integer NOT NULL, data text NOT NULL
+);
+CREATE TABLE cards (
+    id integer PRIMARY KEY, nid integer NOT NULL, did integer NOT NULL,
+    ord integer NOT NULL, mod integer NOT NULL, usn integer NOT NULL,
+    type integer NOT NULL, queue integer NOT NULL, due integer NOT NULL,
+    ivl integer NOT NULL, factor integer NOT NULL, reps integer NOT NULL,
+    lapses integer NOT NULL, left integer NOT NULL, odue integer NOT NULL,
+    odid integer NOT NULL, flags integer NOT NULL, data text NOT NULL
+);
+CREATE TABLE revlog (
+    id integer PRIMARY KEY, cid integer NOT NULL, usn integer NOT NULL,
+    ease integer NOT NULL, ivl integer NOT NULL, lastIvl integer NOT NULL,
+    factor integer NOT NULL, time integer NOT NULL, type integer NOT NULL
+);
+CREATE TABLE graves (usn integer NOT NULL, oid integer NOT NULL, type integer NOT NULL);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+DECK_CONFIG = {
+    "id": 1,
+    "name": "Default",
+    "mod": 0,
+    "usn": 0,
+    "maxTaken": 60,
+    "autoplay": True,
+    "timer": 0,
+    "replayq": True,
+    "dyn": False,
+    "new": {
+        "bury": True,
+        "delays": [1.0, 10.0],
+        "initialFactor": 2500,
+        "ints": [1, 4, 7],
+        "order": 1,
+        "perDay": 20,
+        "separate": True,
+    },
+    "rev": {
+        "bury": True,
+        "ease4": 1.3,
+        "fuzz": 0.05,
+        "ivlFct": 1.0,
+        "maxIvl": 36500,
+        "minSpace": 1,
+        "perDay": 200,
+    },
+    "lapse": {
+        "delays": [10.0],
+        "leechAction": 0,
+        "leechFails": 8,
+        "minInt": 1,
+        "mult": 0.0,
+    },
+}
+
+
+def stable_id(*parts: str) -> int:
+    """Positive 63-bit integer derived from ``parts``, the same on every export"""
+    digest = hashlib.sha1("\0".join(parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") >> 1
+
+
+def base91(number: int) -> str:
+    """How Anki writes note GUIDs"""
+    digits = []
+    while number:
+        number, digit = divmod(number, len(BASE91))
+        digits.append(BASE91[digit])
+    return "".join(reversed(digits)) or BASE91[0]
+
+
+def note_guids(tag: str, fields: list[RawCard]) -> list[str]:
+    """GUIDs of the notes of a file, from its tag and the Markdown of each card's text.
+
+    Anki updates the note with the same GUID when a package is imported again, so
+    editing the extra of a card updates it while editing its text adds a new note.
+    """
+    seen: dict[str, int] = {}
+    guids = []
+    for text, _, _ in fields:
+        # identical cards in one file are told apart by their order
+        occurrence = seen[text] = seen.get(text, -1) + 1
+        guids.append(base91(stable_id(tag, text, str(occurrence))))
+    return guids
+
+
+def strip_html(text: str) -> str:
+    """The sort field of a note, as Anki derives it from the first field"""
+    return html.unescape(HTML_TAG_RE.sub("", text)).strip()
+
+
+def field_checksum(text: str) -> int:
+    return int(hashlib.sha1(strip_html(text).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def cloze_ords(text: str) -> list[int]:
+    """Card ordinals of a cloze note, one for each cloze number in its text"""
+    return sorted({int(n) - 1 for n in CLOZE_ORD_RE.findall(text)}) or [0]
+
+
+class ApkgStats:
+    def __init__(self) -> None:
+        self.notes = 0
+        self.cards = 0
+        self.media = 0
+        self.media_bytes = 0
+        self.bytes = 0
+
+    def summary(self, path: str | Path) -> str:
+        return (
+            f"Wrote {self.notes} notes ({self.cards} cards) and {self.media} media "
+            f"files ({self.media_bytes} bytes) to {path}, {self.bytes} bytes"
+        )
+
+
+class ApkgWriter:
+    """Writes notes in the AnkiConnect ``addNotes`` format to an ``.apkg`` package.
+
+    Notes go into a SQLite collection in a temporary directory, all in one
+    transaction, and images are copied into the package from disk when it is
+    closed. Nothing of Anki is needed, the package is imported with File > Import.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.stats = ApkgStats()
+        self.now = int(time.time())
+
+        self.tmp = tempfile.TemporaryDirectory(prefix="md-to-anki-apkg-")
+        self.db_path = Path(self.tmp.name) / "collection.anki2"
+        self.db = sqlite3.connect(self.db_path)
+        # the collection is thrown away if the export fails
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.executescript(SCHEMA)
+        self.db.execute("BEGIN")
+
+        self.model_id = stable_id("model", MODEL_NAME)
+        self.decks: dict[str, int] = {}
+        # filename in Anki to the image on disk
+        self.media: dict[str, str] = {}
+        # note and card IDs only need to be unique, Anki matches notes by GUID
+        self.next_id = self.now * 1000
+
+    def deck_id(self, name: str) -> int:
+        did = self.decks.get(name)
+        if did is None:
+            parts = name.split("::")
+            for depth in range(1, len(parts)):
+                # Anki expects every parent of a deck to exist
+                self.deck_id("::".join(parts[:depth]))
+            did = self.decks[name] = stable_id("deck", name)
+        return did
+
+    def add_notes(self, notes: list[dict], guids: list[str]) -> None:
+        """Adds the notes of one file, with a GUID for each"""
+        note_rows = []
+        card_rows = []
+        for note, guid in zip(notes, guids, strict=True):
+            did = self.deck_id(note["deckName"])
+            fields = note["fields"]
+            values = [fields.get(name, "") for name in FIELDS]
+            nid = self.next_id
+            self.next_id += 1
+            position = self.stats.notes
+            tags = " ".join(note["tags"])
+            note_rows.append(
+                (
+                    nid,
+                    guid,
+                    self.model_id,
+                    self.now,
+                    -1,
+                    f" {tags} " if tags else "",
+                    "\x1f".join(values),
+                    strip_html(values[0]),
+                    field_checksum(values[0]),
+                    0,
+                    "",
+                )
+            )
+            for ordinal in cloze_ords(values[0]):
+                # a new card, due in the order the notes were written
+                card_rows.append(
+                    (self.next_id, nid, did, ordinal, self.now, -1, 0, 0, position)
+                )
+                self.next_id += 1
+            self.stats.notes += 1
+
+        self.db.executemany(
+            "INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", note_rows
+        )
+        self.db.executemany(
+            "INSERT INTO cards VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')",
+            card_rows,
+        )
+        self.stats.cards += len(card_rows)
+
+    def add_media(self, images: Iterable[dict[str, str]]) -> None:
+        for image in images:
+            # filenames are content hashes, the first path is as good as any
+            self.media.setdefault(image["filename"], image["path"])
+
+    def model(self) -> dict[str, Any]:
+        field = {"sticky": False, "rtl": False, "font": "Arial", "size": 20}
+        return {
+            "id": self.model_id,
+            "name": MODEL_NAME,
+            "type": 1,
+            "mod": self.now,
+            "usn": -1,
+            "sortf": 0,
+            "did": 1,
+            "tmpls": [
+                {
+                    "name": "Cloze",
+                    "ord": 0,
+                    "qfmt": "{{cloze:Text}}",
+                    "afmt": "{{cloze:Text}}<br>\n{{Extra}}",
+                    "bqfmt": "",
+                    "bafmt": "",
+                    "did": None,
+                }
+            ],
+            "flds": [
+                {"name": name, "ord": i, "media": [], **field}
+                for i, name in enumerate(FIELDS)
+            ],
+            "css": CSS,
+            "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+            "\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n"
+            "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+            "latexPost": "\\end{document}",
+            "latexsvg": False,
+            "tags": [],
+            "vers": [],
+            "req": [[0, "any", [0]]],
+        }
+
+    def deck(self, did: int, name: str) -> dict[str, Any]:
+        return {
+            "id": did,
+            "name": name,
+            "mod": self.now,
+            "usn": -1,
+            "desc": "",
+            "dyn": 0,
+            "conf": 1,
+            "collapsed": False,
+            "browserCollapsed": False,
+            "extendNew": 0,
+            "extendRev": 0,
+            "newToday": [0, 0],
+            "revToday": [0, 0],
+            "lrnToday": [0, 0],
+            "timeToday": [0, 0],
+        }
+
+    def write_collection(self) -> None:
+        decks = {"Default": 1, **self.decks}
+        conf = {
+            "activeDecks": [1],
+            "curDeck": 1,
+            "curModel": str(self.model_id),
+            "nextPos": self.stats.notes + 1,
+            "newSpread": 0,
+            "collapseTime": 1200,
+            "timeLim": 0,
+            "estTimes": True,
+            "dueCounts": True,
+            "sortType": "noteFld",
+            "sortBackwards": False,
+            "addToCur": True,
+        }
+        self.db.execute(
+            "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+            (
+                self.now,
+                self.now * 1000,
+                self.now * 1000,
+                json.dumps(conf),
+                json.dumps({str(self.model_id): self.model()}),
+                json.dumps({str(did): self.deck(did, n) for n, did in decks.items()}),
+                json.dumps({"1": DECK_CONFIG}),
+            ),
+        )
+        self.db.commit()
+        self.db.close()
+
+    def close(self) -> ApkgStats:
+        """Writes the package, replacing ``path`` only once it is complete"""
+        self.write_collection()
+        partial = self.path.with_name(self.path.name + ".partial")
+        try:
+            with zipfile.ZipFile(partial, "w") as package:
+                package.write(
+                    self.db_path, "collection.anki2", compress_type=zipfile.ZIP_DEFLATED
+                )
+                names = {}
+                for i, (filename, path) in enumerate(self.media.items()):
+                    # images are compressed already; copied in chunks, not read whole
+                    package.write(path, str(i), compress_type=zipfile.ZIP_STORED)
+                    names[str(i)] = filename
+                    self.stats.media_bytes += os.path.getsize(path)
+                package.writestr(
+                    "media", json.dumps(names), compress_type=zipfile.ZIP_DEFLATED
+                )
+            os.replace(partial, self.path)
+        finally:
+            partial.unlink(missing_ok=True)
+            self.tmp.cleanup()
+        self.stats.media = len(self.media)
+        self.stats.bytes = self.path.stat().st_size
+        return self.stats
+
+    def abort(self) -> None:
+        self.db.close()
+        self.tmp.cleanup()
+
+    def __enter__(self) -> "ApkgWriter":
+        return self
+
+    def __exit__(self, exc_type: Optional[type], *exc: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
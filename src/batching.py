@@ -0,0 +1,375 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from utils import anki
+
+if TYPE_CHECKING:
+    from sync_index import SyncIndex
+
+DEFAULT_BATCH_NOTES = 500
+DEFAULT_BATCH_BYTES = 4 * 1024 * 1024
+# addNotes requests slower than this shrink the batch, much faster ones grow it
+DEFAULT_TARGET_LATENCY = 2.0
+MIN_BATCH_NOTES = 10
+# AnkiConnect requests in flight at once with --pipeline
+DEFAULT_ANKI_CONCURRENCY = 2
+
+# JSON around the fields of one note: deck, model, tags and options
+NOTE_OVERHEAD_BYTES = 300
+# one note ID in a deleteNotes request
+DELETE_BYTES = 16
+
+# buffer index standing for all the deletions of a file
+DELETES = -1
+
+# what Anki answers for a note whose first field is taken
+DUPLICATE = "cannot create note because it is a duplicate"
+
+# reason given for notes the local first field index finds to be duplicates
+LIKELY_DUPLICATE = "likely a duplicate, a note with this first field is in the deck"
+
+
+def estimate_note_bytes(note: dict) -> int:
+    fields = note["fields"]
+    return len(fields["Text"]) + len(fields["Extra"]) + NOTE_OVERHEAD_BYTES
+
+
+def preflight(
+    files: list[tuple[str, list[dict], list[dict], list[int]]],
+    index: SyncIndex,
+    ask_anki: bool = True,
+    chunk_notes: int = DEFAULT_BATCH_NOTES,
+) -> dict[str, dict[int, str]]:
+    """Notes to add that Anki would refuse, by file and index among its adds, with
+    the reason.
+
+    Likely duplicates are found in the first fields index without asking Anki. The
+    other notes are checked in one ``multi`` request of canAddNotesWithErrorDetail
+    actions, ``chunk_notes`` notes each; versions of AnkiConnect without the
+    action leave them to addNotes.
+    """
+    notes = [
+        (file_path, i, note)
+        for file_path, adds, *_ in files
+        for i, note in enumerate(adds)
+    ]
+    refused: dict[str, dict[int, str]] = {}
+    unknown = []
+    for item, duplicate in zip(notes, index.duplicates([n for *_, n in notes])):
+        if duplicate:
+            refused.setdefault(item[0], {})[item[1]] = LIKELY_DUPLICATE
+        else:
+            unknown.append(item)
+    if not ask_anki or not unknown:
+        return refused
+
+    chunks = [
+        unknown[start : start + chunk_notes]
+        for start in range(0, len(unknown), chunk_notes)
+    ]
+    actions = [
+        anki.request("canAddNotesWithErrorDetail", notes=[note for *_, note in chunk])
+        for chunk in chunks
+    ]
+    try:
+        answers = anki.invoke("multi", actions=actions)
+    except anki.AnkiError:
+        return refused
+    if not isinstance(answers, list):
+        return refused
+
+    for chunk, answer in zip(chunks, answers):
+        answer = action_answer(answer)
+        details = answer["result"] if answer["error"] is None else None
+        if not isinstance(details, list) or len(details) != len(chunk):
+            continue
+        for (file_path, i, _), detail in zip(chunk, details):
+            if isinstance(detail, dict) and not detail.get("canAdd", True):
+                reason = detail.get("error") or "Note rejected by Anki"
+                refused.setdefault(file_path, {})[i] = reason
+    return refused
+
+
+def action_answer(answer) -> dict:
+    """The ``{"result", "error"}`` answer to one action of a multi request"""
+    if isinstance(answer, dict) and answer.keys() == {"result", "error"}:
+        return answer
+    return {"result": None, "error": "Unexpected answer from Anki"}
+
+
+def without_refused(
+    index: SyncIndex, file_path: str, adds: list[dict], refused: dict[int, str]
+) -> list[dict]:
+    """The adds of a file left once the ``preflight`` refusals are skipped"""
+    if not refused:
+        return adds
+    index.skip(file_path, refused)
+    return [note for i, note in enumerate(adds) if i not in refused]
+
+
+def delete_files(index: SyncIndex, paths: list[str]) -> int:
+    """Deletes the notes of files removed from the decks in one request, then
+    forgets the files; returns how many notes were deleted"""
+    note_ids = [
+        note_id
+        for path in paths
+        for _, note_id in index.rows(path)
+        if note_id is not None
+    ]
+    if note_ids:
+        anki.invoke("deleteNotes", notes=note_ids)
+    index.forget(paths)
+    return len(note_ids)
+
+
+class PendingFile:
+    def __init__(self, cards: list[dict], updates: list[dict], deletes: list[int]):
+        self.adds = len(cards)
+        # notes to add followed by notes to update, ``results`` lines up with them
+        self.cards = cards + updates
+        self.deletes = deletes
+        self.results: list = [None] * len(self.cards)
+        self.deleted = not deletes
+        self.unsent = len(self.cards) + bool(deletes)
+        self.errors: list = []
+        self.failed = False
+
+    def succeeded(self) -> bool:
+        return self.deleted and not self.failed
+
+
+class NoteBatcher:
+    """Buffers notes across files and sends them in shared addNotes requests.
+
+    Files may also come with notes to update (``{"id", "fields"}``) and note IDs to
+    delete; batches containing those are sent as one ``multi`` request of
+    addNotes, updateNoteFields and deleteNotes actions.
+
+    Results are mapped back to the file each note came from. Once every note of a
+    file has been answered, ``on_file_done`` gets their note IDs (added, then
+    updated) if Anki accepted all of them, otherwise ``on_file_failed`` gets an
+    ``AnkiError`` whose ``result`` lines up with that file's cards.
+
+    The number of notes per request adapts to how long Anki takes to answer,
+    between ``MIN_BATCH_NOTES`` and ``max_notes``.
+    """
+
+    def __init__(
+        self,
+        on_file_done: Callable[[str, list[int]], None],
+        on_file_failed: Callable[[str, list[dict], anki.AnkiError], None],
+        max_notes: int = DEFAULT_BATCH_NOTES,
+        max_bytes: int = DEFAULT_BATCH_BYTES,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+        autoflush: bool = True,
+    ):
+        self.on_file_done = on_file_done
+        self.on_file_failed = on_file_failed
+        self.max_notes = max_notes
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        # without autoflush the caller decides when to send_batch(), e.g. off the event loop
+        self.autoflush = autoflush
+
+        self.batch_notes = max_notes
+        self.files: dict[str, PendingFile] = {}
+        self.buffer: list[tuple[str, int, int]] = []
+        self.buffer_bytes = 0
+        self.requests = 0
+
+    def add(
+        self,
+        file_path: str,
+        cards: list[dict],
+        updates: Optional[list[dict]] = None,
+        deletes: Optional[list[int]] = None,
+    ) -> None:
+        pending = PendingFile(cards, updates or [], deletes or [])
+        if not pending.unsent:
+            self.on_file_done(file_path, [])
+            return
+
+        self.files[file_path] = pending
+        for i, card in enumerate(pending.cards):
+            self.queue(file_path, i, estimate_note_bytes(card))
+        if pending.deletes:
+            self.queue(file_path, DELETES, DELETE_BYTES * len(pending.deletes))
+
+        while self.autoflush and self.full():
+            self.send_batch()
+
+    def queue(self, file_path: str, i: int, size: int) -> None:
+        self.buffer.append((file_path, i, size))
+        self.buffer_bytes += size
+
+    def full(self) -> bool:
+        return (
+            len(self.buffer) >= self.batch_notes or self.buffer_bytes >= self.max_bytes
+        )
+
+    def flush(self) -> None:
+        while self.buffer:
+            self.send_batch()
+
+    def send_batch(self) -> None:
+        """Sends the oldest buffered notes, as many as fit in one request"""
+        if not self.buffer:
+            return
+
+        count = 0
+        batch_bytes = 0
+        for _, _, size in self.buffer:
+            if count and (
+                count >= self.batch_notes or batch_bytes + size > self.max_bytes
+            ):
+                break
+            count += 1
+            batch_bytes += size
+
+        batch = [(file_path, i) for file_path, i, _ in self.buffer[:count]]
+        del self.buffer[:count]
+        self.buffer_bytes -= batch_bytes
+
+        start = time.perf_counter()
+        if all(0 <= i < self.files[file_path].adds for file_path, i in batch):
+            results, errors = self.send_adds(batch)
+        else:
+            results, errors = self.send_changes(batch)
+        self.requests += 1
+        self.adapt(len(batch), time.perf_counter() - start)
+
+        finished = []
+        for (file_path, i), result, error in zip(batch, results, errors):
+            pending = self.files[file_path]
+            if i == DELETES:
+                pending.deleted = error is None
+            else:
+                pending.results[i] = result
+                pending.failed = pending.failed or error is not None
+            pending.unsent -= 1
+            if error is not None and error not in pending.errors:
+                pending.errors.append(error)
+            if pending.unsent == 0:
+                finished.append(file_path)
+
+        for file_path in finished:
+            pending = self.files.pop(file_path)
+            if not pending.succeeded():
+                self.on_file_failed(
+                    file_path,
+                    pending.cards,
+                    anki.AnkiError(
+                        pending.errors or "Some notes were rejected by Anki",
+                        pending.results,
+                    ),
+                )
+            else:
+                self.on_file_done(file_path, pending.results)
+
+    def send_adds(self, batch: list[tuple[str, int]]) -> tuple[list, list]:
+        notes = [self.files[file_path].cards[i] for file_path, i in batch]
+        try:
+            return self.added(notes, anki.invoke("addNotes", notes=notes), None)
+        except anki.AnkiError as e:
+            return self.added(notes, e.result, e.e)
+
+    def added(
+        self, notes: list[dict], results: Any, error: Optional[str]
+    ) -> tuple[list, list]:
+        """Note IDs and errors of the notes of one addNotes action.
+
+        Anki answers null for the whole action when it refuses one note, after
+        adding the others. The notes are then sent again one by one: those refused
+        as duplicates now are taken to be in Anki, with no note ID.
+        """
+        if isinstance(results, list) and len(results) == len(notes):
+            return results, [
+                None if note_id is not None else error or "Note rejected by Anki"
+                for note_id in results
+            ]
+        if error is None:
+            return [None] * len(notes), ["Unexpected answer from Anki"] * len(notes)
+        return self.resend(notes)
+
+    def resend(self, notes: list[dict]) -> tuple[list, list]:
+        actions = [anki.request("addNote", note=note) for note in notes]
+        try:
+            answers = anki.invoke("multi", actions=actions)
+        except anki.AnkiError as e:
+            return [None] * len(notes), [e.e] * len(notes)
+        if not isinstance(answers, list) or len(answers) != len(notes):
+            return [None] * len(notes), ["Unexpected answer from Anki"] * len(notes)
+
+        results: list = []
+        errors: list = []
+        for answer in map(action_answer, answers):
+            results.append(answer["result"])
+            error = answer["error"]
+            errors.append(None if error is not None and DUPLICATE in error else error)
+        return results, errors
+
+    def send_changes(self, batch: list[tuple[str, int]]) -> tuple[list, list]:
+        """Sends adds, updates and deletes in one multi request"""
+        adds: list[dict] = []
+        updates: list[dict] = []
+        deletes: list[int] = []
+        for file_path, i in batch:
+            pending = self.files[file_path]
+            if i == DELETES:
+                deletes.extend(pending.deletes)
+            elif i < pending.adds:
+                adds.append(pending.cards[i])
+            else:
+                updates.append(pending.cards[i])
+
+        # versioned, or AnkiConnect answers with the bare result of each action
+        actions = [anki.request("updateNoteFields", note=note) for note in updates]
+        if adds:
+            actions.append(anki.request("addNotes", notes=adds))
+        if deletes:
+            actions.append(anki.request("deleteNotes", notes=deletes))
+
+        try:
+            answers = anki.invoke("multi", actions=actions)
+        except anki.AnkiError as e:
+            return [None] * len(batch), [e.e] * len(batch)
+        if not isinstance(answers, list) or len(answers) != len(actions):
+            return [None] * len(batch), ["Unexpected answer from Anki"] * len(batch)
+        answers = [action_answer(answer) for answer in answers]
+
+        update_answers = iter(answers[: len(updates)])
+        add_answer = answers[len(updates)] if adds else {"result": [], "error": None}
+        add_results, add_errors = self.added(
+            adds, add_answer["result"], add_answer["error"]
+        )
+        add_ids = iter(zip(add_results, add_errors))
+        delete_error = answers[-1]["error"] if deletes else None
+
+        results: list = []
+        errors: list = []
+        for file_path, i in batch:
+            pending = self.files[file_path]
+            if i == DELETES:
+                results.append(None)
+                errors.append(delete_error)
+            elif i < pending.adds:
+                note_id, error = next(add_ids)
+                results.append(note_id)
+                errors.append(error)
+            else:
+                # updateNoteFields answers null, only the error tells how it went
+                error = next(update_answers)["error"]
+                results.append(pending.cards[i]["id"] if error is None else None)
+                errors.append(error)
+        return results, errors
+
+    def adapt(self, sent: int, latency: float) -> None:
+        if latency > self.target_latency:
+            self.batch_notes = max(MIN_BATCH_NOTES, self.batch_notes // 2)
+        elif latency < self.target_latency / 4 and sent >= self.batch_notes:
+            self.batch_notes = min(self.max_notes, self.batch_notes * 2)
+
+    def close(self) -> None:
+        self.flush()
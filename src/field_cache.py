@@ -0,0 +1,206 @@
+import atexit
+import hashlib
+import importlib.metadata
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from render import get_renderer
+from utils import hash_cache
+from utils import profile
+from utils import utils
+
+# rendered fields kept on disk, most under a kilobyte
+DEFAULT_MAX_ENTRIES = 100_000
+# set by disable(), worker processes started with spawn read it too
+DISABLE_ENV = "MD_TO_ANKI_NO_FIELD_CACHE"
+
+SRC = Path(__file__).resolve().parent
+# the code between the raw Markdown of a field and its HTML
+SOURCES = [
+    SRC / "parser.py",
+    SRC / "render.py",
+    SRC / "render_markdown_it.py",
+    SRC / "highlight.py",
+    *sorted((SRC / "md_anki").glob("*.py")),
+    *sorted((SRC / "md_mathjax").glob("*.py")),
+]
+
+Rendered = tuple[str, list[dict[str, str]]]
+
+
+def fingerprint() -> str:
+    """Hash of everything besides the field text that its HTML depends on: library
+    versions, the backend and its configuration and our own code"""
+    digest = hashlib.sha1()
+    for package in ["markdown", "pygments", "beautifulsoup4"]:
+        version = importlib.metadata.version(package)
+        digest.update(f"{package}=={version}\0".encode("utf-8"))
+    renderer = get_renderer()
+    digest.update(f"{renderer.name}:{renderer.settings()}\0".encode("utf-8"))
+    for path in SOURCES:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class FieldCache:
+    """HTML and media of rendered fields, keyed by the raw field and its media root.
+
+    Everything cached is dropped when the ``fingerprint`` of the renderer changes.
+    Images are looked up in the media hash cache on every hit, so a field showing an
+    image whose content changed is rendered again. Least recently used entries are
+    evicted above ``max_entries`` when the cache is closed.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path,
+        fingerprint: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.db_path = Path(db_path)
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+
+        self.lock = threading.Lock()
+        self.db: Optional[sqlite3.Connection] = None
+        self.run_started = int(time.time())
+        self.touched: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self) -> sqlite3.Connection:
+        if self.db is None:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            # a lost write only costs rendering the field again
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS fields ("
+                "key TEXT PRIMARY KEY, html TEXT, media TEXT, last_used INTEGER)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = self.db.execute(
+                "SELECT value FROM meta WHERE name = 'fingerprint'"
+            ).fetchone()
+            if row is None or row[0] != self.fingerprint:
+                # the renderer changed, none of the cached HTML can be trusted
+                self.db.execute("DELETE FROM fields")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)",
+                    (self.fingerprint,),
+                )
+            self.db.commit()
+        return self.db
+
+    @staticmethod
+    def key(raw_string: str, root: Path) -> str:
+        return hashlib.sha1(f"{root}\0{raw_string}".encode("utf-8")).hexdigest()
+
+    def get(self, raw_string: str, root: Path) -> Optional[Rendered]:
+        key = self.key(raw_string, root)
+        with self.lock:
+            row = (
+                self.connect()
+                .execute("SELECT html, media FROM fields WHERE key = ?", (key,))
+                .fetchone()
+            )
+
+        if row is not None:
+            media = json.loads(row[1])
+            if self.media_unchanged(media):
+                with self.lock:
+                    self.touched.add(key)
+                    self.hits += 1
+                profile.count("field cache hits")
+                return row[0], media
+
+        with self.lock:
+            self.misses += 1
+        profile.count("field cache misses")
+        return None
+
+    @staticmethod
+    def media_unchanged(media: list[dict[str, str]]) -> bool:
+        for entry in media:
+            path = Path(entry["path"])
+            try:
+                digest = hash_cache.hash_file(path)
+            except OSError:
+                # rendering again reports the missing image
+                return False
+            if entry["filename"] != f"{digest}{path.suffix}":
+                return False
+        return True
+
+    def put(self, raw_string: str, root: Path, html: str, media: list) -> None:
+        with self.lock:
+            db = self.connect()
+            db.execute(
+                "INSERT OR REPLACE INTO fields VALUES (?, ?, ?, ?)",
+                (self.key(raw_string, root), html, json.dumps(media), self.run_started),
+            )
+            db.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            db = self.connect()
+            db.execute("DELETE FROM fields")
+            db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is None:
+                return
+            if self.touched:
+                self.db.executemany(
+                    "UPDATE fields SET last_used = ? WHERE key = ?",
+                    ((self.run_started, key) for key in self.touched),
+                )
+                self.touched.clear()
+            self.db.execute(
+                "DELETE FROM fields WHERE key IN (SELECT key FROM fields "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+
+_default: Optional[FieldCache] = None
+_default_lock = threading.Lock()
+
+
+def get_field_cache() -> Optional[FieldCache]:
+    """The cache of this run, None with ``--no-field-cache``"""
+    global _default
+    with _default_lock:
+        if _default is None and not os.environ.get(DISABLE_ENV):
+            _default = FieldCache(utils.cache_dir() / "fields.sqlite3", fingerprint())
+            atexit.register(_default.close)
+        return _default
+
+
+def disable() -> None:
+    """Renders every field from now on, in this process and the ones it starts"""
+    global _default
+    with _default_lock:
+        os.environ[DISABLE_ENV] = "1"
+        _default = None
+
+
+def _forget_connection() -> None:
+    # a SQLite connection must not be used on both sides of a fork
+    if _default is not None:
+        _default.db = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_connection)
@@ -0,0 +1,241 @@
+import atexit
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import markdown
+import pygments  # type: ignore[import-untyped]
+from markdown.extensions import codehilite, fenced_code
+
+from utils import profile
+from utils import utils
+
+# highlighted blocks kept in memory, per process
+DEFAULT_MAX_MEMORY = 2048
+# blocks kept on disk, a few kilobytes each
+DEFAULT_MAX_ENTRIES = 50_000
+# path of the disk store set by use_disk_store(), for the worker processes too
+DISK_STORE_ENV = "MD_TO_ANKI_HIGHLIGHT_STORE"
+
+
+class HighlightCache:
+    """Pygments HTML of code blocks, keyed by (language, code, Pygments and Markdown
+    versions, highlighting options).
+
+    A per-process LRU of ``max_memory`` blocks sits in front of an optional SQLite
+    store that survives between runs and is shared by the ``--jobs`` workers.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str | Path] = None,
+        max_memory: int = DEFAULT_MAX_MEMORY,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.db_path = Path(db_path) if db_path is not None else None
+        self.max_memory = max_memory
+        self.max_entries = max_entries
+
+        self.lock = threading.Lock()
+        self.db: Optional[sqlite3.Connection] = None
+        self.memory: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def connect(self) -> Optional[sqlite3.Connection]:
+        if self.db is None and self.db_path is not None:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS blocks ("
+                "key TEXT PRIMARY KEY, html TEXT, last_used INTEGER)"
+            )
+            self.db.commit()
+        return self.db
+
+    @staticmethod
+    def key(code: str, lang: Optional[str], options: dict[str, Any]) -> str:
+        versions = f"{pygments.__version__}\0{markdown.__version__}"
+        settings = repr(sorted(options.items()))
+        data = f"{lang}\0{versions}\0{settings}\0{code}"
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def highlight(self, code: str, lang: Optional[str], options: dict[str, Any]) -> str:
+        """What ``CodeHilite(code, lang, **options).hilite(shebang=False)`` returns"""
+        key = self.key(code, lang, options)
+        with self.lock:
+            html = self.memory.get(key)
+            if html is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                profile.count("highlight memory hits")
+                return html
+
+            db = self.connect()
+            if db is not None:
+                row = db.execute(
+                    "SELECT html FROM blocks WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    profile.count("highlight disk hits")
+                    self.remember(key, row[0])
+                    return row[0]
+
+        # Pygments runs outside the lock, other threads may highlight meanwhile
+        html = hilite(code, lang, options)
+        with self.lock:
+            self.misses += 1
+            profile.count("highlight misses")
+            self.remember(key, html)
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO blocks VALUES (?, ?, strftime('%s'))",
+                    (key, html),
+                )
+                db.commit()
+        return html
+
+    def remember(self, key: str, html: str) -> None:
+        self.memory[key] = html
+        if len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.disk_hits + self.misses
+
+    def summary(self) -> str:
+        cached = self.hits + self.disk_hits
+        return (
+            f"Code blocks: {self.lookups} highlighted, {self.hits} from memory and "
+            f"{self.disk_hits} from disk ({cached / max(1, self.lookups):.0%} hit rate)"
+        )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+            db = self.connect()
+            if db is not None:
+                db.execute("DELETE FROM blocks")
+                db.commit()
+
+    def close(self) -> None:
+        """Evicts the least recently stored blocks above ``max_entries``"""
+        with self.lock:
+            if self.db is None:
+                return
+            self.db.execute(
+                "DELETE FROM blocks WHERE key IN (SELECT key FROM blocks "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+
+def hilite(code: str, lang: Optional[str], options: dict[str, Any]) -> str:
+    local = dict(options)
+    with profile.span("pygments", lang=lang):
+        return codehilite.CodeHilite(
+            code, lang=lang, style=local.pop("pygments_style", "default"), **local
+        ).hilite(shebang=False)
+
+
+class CachedFencedBlockPreprocessor(fenced_code.FencedBlockPreprocessor):
+    """Highlights plain fenced blocks (a language at most) through the cache.
+
+    Blocks with ``{attributes}`` or ``hl_lines`` are left in place for
+    ``FencedBlockPreprocessor``, which runs next on the same text.
+    """
+
+    def __init__(
+        self,
+        md: markdown.Markdown,
+        config: dict[str, Any],
+        cache: Optional[HighlightCache] = None,
+    ):
+        super().__init__(md, config)
+        self.cache = cache
+
+    def run(self, lines: list[str]) -> list[str]:
+        if not self.checked_for_deps:
+            # picks up the codehilite configuration
+            super().run([])
+        conf = self.codehilite_conf
+        if not conf or not conf["use_pygments"]:
+            return super().run(lines)
+
+        cache = self.cache or get_highlight_cache()
+        text = "\n".join(lines)
+        index = 0
+        while m := self.FENCED_BLOCK_RE.search(text, index):
+            if m.group("attrs") or m.group("hl_lines"):
+                index = m.end()
+                continue
+            html = cache.highlight(m.group("code"), m.group("lang") or None, conf)
+            placeholder = self.md.htmlStash.store(html)
+            text = f"{text[:m.start()]}\n{placeholder}\n{text[m.end():]}"
+            index = m.start() + 1 + len(placeholder)
+        return super().run(text.split("\n"))
+
+
+class CachedFencedCodeExtension(fenced_code.FencedCodeExtension):
+    """``fenced_code`` with memoized highlighting, used with ``CodeHiliteExtension``.
+
+    Without a ``cache`` the process-wide one from ``get_highlight_cache`` is used.
+    """
+
+    def __init__(self, cache: Optional[HighlightCache] = None, **kwargs: Any):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md: markdown.Markdown) -> None:
+        md.registerExtension(self)
+        md.preprocessors.register(
+            CachedFencedBlockPreprocessor(md, self.getConfigs(), self.cache),
+            "fenced_code_block",
+            25,
+        )
+
+
+_default: Optional[HighlightCache] = None
+_default_lock = threading.Lock()
+
+
+def get_highlight_cache() -> HighlightCache:
+    global _default
+    with _default_lock:
+        if _default is None:
+            db_path = os.environ.get(DISK_STORE_ENV)
+            _default = HighlightCache(db_path or None)
+            if db_path:
+                atexit.register(_default.close)
+        return _default
+
+
+def use_disk_store(db_path: Optional[str | Path] = None) -> HighlightCache:
+    """Makes the default cache keep highlighted blocks on disk between runs, in
+    this process and the ones it starts"""
+    global _default
+    with _default_lock:
+        path = db_path or utils.cache_dir() / "highlight.sqlite3"
+        os.environ[DISK_STORE_ENV] = str(path)
+        _default = HighlightCache(path)
+        atexit.register(_default.close)
+        return _default
+
+
+def _forget_connection() -> None:
+    # a SQLite connection must not be used on both sides of a fork
+    if _default is not None:
+        _default.db = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_connection)
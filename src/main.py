@@ -1,39 +1,31 @@
+from __future__ import annotations
+
+import functools
 import os
-import re
-from typing import Collection
+import time
+from typing import TYPE_CHECKING, Collection, Iterable, Iterator, Optional
 from pathlib import Path
 
-from rich.console import Console
-from rich.progress import Progress
-
 import argparse
-import parser
+import batching
+import scanner
+import sync_index
 from utils import anki
+from utils import hash_cache
+from utils import profile
 from utils import utils
 
-from deckConsts import DECKS, IGNORE_KEYWORDS  # type: ignore
-
-
-def process_file(
-    root: Path, deck_name: str, deck_directory: str, file_path: str, force: bool
-) -> tuple[list[dict[str, Collection[str]]], list[dict[str, str]]]:
-    """Returns tuple representing payload for cards and images to be imported to Anki"""
-
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    content = parser.remove_yaml(content)
+# rich and the rendering stack (Markdown, Pygments, BeautifulSoup) are imported where
+# they are used, so a run with nothing to sync exits before loading any of them
+if TYPE_CHECKING:
+    from rich.console import Console
 
-    if not force:
-        if content.rstrip("\n ").endswith("***"):
-            return [], []
+    import media
+    import parallel
+    import parser
 
-        if "***" in content:
-            imported_parts = content.split("***")
-            content = imported_parts[-1]
-    else:
-        content = content.replace("***", "")
 
+def file_tag(deck_name: str, deck_directory: str, file_path: str) -> str:
     tag = "#"
     tag += "::#".join(deck_name.replace(" ", "").split("::"))
 
@@ -42,25 +34,79 @@ def process_file(
     tag += "::"
     tag += utils.string_to_tag(last_path)
 
-    parsed_cards = parser.parse_markdown(content, root)
+    return tag
+
+
+def read_cards(f: Iterable[str]) -> Iterator[parser.RawCard]:
+    """Yields the raw cards of an open note, without front matter or ``***`` markers"""
+    import parser
+
+    return parser.iter_cards(sync_index.blank_markers(parser.skip_front_matter(f)))
+
+
+def plan_file(
+    index: sync_index.SyncIndex,
+    scanned: scanner.ScannedFile,
+    force: bool,
+    diff: bool = False,
+) -> Optional[tuple[str, list[parser.RawCard]]]:
+    """Returns the tag of a file and the cards to send from it, None if there is nothing to sync"""
+    with profile.span("read", file=scanned.path), open(
+        scanned.path, "r", encoding="utf-8"
+    ) as f:
+        state = index.plan(
+            scanned.path, scanned.stat, read_cards(f), force=force, diff=diff
+        )
+    if not state.render and not state.deletes:
+        # cards were only moved around, or removed without --diff
+        index.done(scanned.path, [])
+        return None
+
+    return (
+        file_tag(scanned.deck_path, scanned.deck_directory, scanned.path),
+        state.fields,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def deck_options(deck_name: str) -> dict:
+    """The options of every note of a deck, one shared object that requests encode
+    once however many notes refer to it"""
+    return {
+        "allowDuplicate": False,
+        "duplicateScope": deck_name,
+        "duplicateScopeOptions": {
+            "deckName": deck_name,
+            "checkChildren": False,
+            "checkAllModels": False,
+        },
+    }
+
 
+def build_payload(
+    parsed_cards: Iterable[parser.Card], deck_name: str, tag: str
+) -> tuple[list[dict[str, Collection[str]]], list[dict[str, str]]]:
     # future integration path for multiple tag syntax
     base_tags = [tag]
 
     cards_payload = []
     images_payload = []
+    options = deck_options(deck_name)
+    # cards under the same heading share their list of tags
+    heading_tags: dict[tuple[str, ...], list[str]] = {}
 
     unclozed_cards = []
     for card in parsed_cards:
-        text = card.text
-
-        if not re.search(r"\{\{c\d+::", text):
-            unclozed_cards.append((text, card.extra))
+        if not card.cloze_count:
+            unclozed_cards.append((card.text, card.extra))
             continue
 
         if card.tags and len(card.tags) > 0:
-            heading_tag = "::".join(card.tags)
-            new_tags = [f"{tag}::{heading_tag}" for tag in base_tags]
+            new_tags = heading_tags.get(card.tags)
+            if new_tags is None:
+                heading_tag = "::".join(card.tags)
+                new_tags = [f"{tag}::{heading_tag}" for tag in base_tags]
+                heading_tags[card.tags] = new_tags
         else:
             new_tags = base_tags
 
@@ -72,15 +118,7 @@ def process_file(
             "modelName": "cloze",
             "fields": {"Text": card.text, "Extra": card.extra},
             "tags": new_tags,
-            "options": {
-                "allowDuplicate": False,
-                "duplicateScope": deck_name,
-                "duplicateScopeOptions": {
-                    "deckName": deck_name,
-                    "checkChildren": False,
-                    "checkAllModels": False,
-                },
-            },
+            "options": options,
         }
         cards_payload.append(single_card_payload)
 
@@ -90,88 +128,649 @@ def process_file(
     return cards_payload, images_payload
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(prog="md-to-anki")
-    parser.add_argument("-f", "--force", action="store_true")
-    return parser.parse_args()
-
-
-def main():
-    console = Console()
-    args = parse_args()
-
-    with Progress(console=console, transient=True) as progress:
-        task = None
-
-        for deck_path, deck_directory in DECKS.items():
-            # 'task' is a whole progress bar -- remove old ones and only show the current one while processing
-            if task is not None:
-                progress.remove_task(task)
-
-            console.print(f" --- [blue]{deck_path}[/blue] --- ")
-
-            for root, _, files in os.walk(deck_directory):
-                task = progress.add_task(
-                    f"[green][bold]{deck_path}", total=len(files) - 1
-                )
-
-                for file in files:
-                    if root.split(os.sep)[-1] in IGNORE_KEYWORDS:
-                        print(f"Skipping {file}")
-                        continue
+def process_file(
+    root: Path, deck_name: str, deck_directory: str, file_path: str
+) -> tuple[list[dict[str, Collection[str]]], list[dict[str, str]]]:
+    """Returns tuple representing payload for cards and images to be imported to Anki"""
+    import parser
 
-                    if file.startswith("_") or not file.endswith(".md"):
-                        progress.advance(task)
-                        continue
+    tag = file_tag(deck_name, deck_directory, file_path)
+    with open(file_path, "r", encoding="utf-8") as f:
+        lines = sync_index.blank_markers(parser.skip_front_matter(f))
+        return build_payload(parser.parse_markdown(lines, root), deck_name, tag)
 
-                    file_path = os.path.join(root, file)
 
-                    try:
-                        all_cards, all_images = process_file(
-                            root, deck_path, deck_directory, str(file_path), args.force
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="md-to-anki")
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="read every file again, and without --diff send all of its cards",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="update edited cards and delete removed ones instead of only adding new cards",
+    )
+    parser.add_argument(
+        "--sync-index",
+        default=None,
+        help="SQLite file recording imported cards (default: %s)"
+        % sync_index.default_path(),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and sync notes as soon as they are saved",
+    )
+    parser.add_argument(
+        "--apkg",
+        metavar="FILE",
+        help="write every note to an .apkg package instead of syncing with AnkiConnect",
+    )
+    parser.add_argument(
+        "--migrate-markers",
+        action="store_true",
+        help="record cards above the *** markers of older versions as imported",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        choices=["verify", "rebuild"],
+        help="rehash every cached media file and report (or fix) stale entries",
+    )
+    parser.add_argument(
+        "--no-field-cache",
+        action="store_true",
+        help="render every field again instead of reusing the HTML of earlier runs",
+    )
+    parser.add_argument(
+        "--markdown",
+        choices=["python-markdown", "markdown-it"],
+        help="Markdown library rendering the fields (default: MARKDOWN_BACKEND in "
+        "deckConsts.py, else python-markdown)",
+    )
+    parser.add_argument(
+        "--highlight-cache",
+        action="store_true",
+        help="keep highlighted code blocks on disk, so unchanged ones are never lexed again",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=anki.settings["connect_timeout"],
+        help="seconds to wait for a connection to AnkiConnect",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=anki.settings["read_timeout"],
+        help="seconds to wait for AnkiConnect to answer a request",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=anki.settings["retries"],
+        help="retries for requests that failed on a dropped connection",
+    )
+    parser.add_argument(
+        "--batch-notes",
+        type=int,
+        default=batching.DEFAULT_BATCH_NOTES,
+        help="most notes sent in one addNotes request",
+    )
+    parser.add_argument(
+        "--batch-bytes",
+        type=int,
+        default=batching.DEFAULT_BATCH_BYTES,
+        help="approximate size limit of one addNotes request",
+    )
+    parser.add_argument(
+        "--batch-latency",
+        type=float,
+        default=batching.DEFAULT_TARGET_LATENCY,
+        help="seconds per addNotes request above which batches shrink",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="processes rendering cards in parallel",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="overlap reading, rendering and uploading in an asyncio pipeline",
+    )
+    parser.add_argument(
+        "--anki-concurrency",
+        type=int,
+        default=batching.DEFAULT_ANKI_CONCURRENCY,
+        help="most AnkiConnect requests in flight at once with --pipeline",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="FILE",
+        help="time every stage and print the slowest, writing the spans to FILE",
+    )
+    parser.add_argument(
+        "--profile-format",
+        choices=["chrome", "json"],
+        default="chrome",
+        help="chrome://tracing and Perfetto trace, or the report as JSON",
+    )
+    return parser.parse_args(argv)
+
+
+def check_hash_cache(console: Console, rebuild: bool) -> None:
+    cache = hash_cache.get_hash_cache()
+    counts = cache.verify(rebuild=rebuild)
+    console.print(f"Media hash cache at {cache.db_path}")
+    for state, count in counts.items():
+        console.print(f"  {state}: {count}")
+    if rebuild:
+        console.print("[green]Rebuilt stale entries[/green]")
+
+
+def migrate_markers(
+    console: Console,
+    index: sync_index.SyncIndex,
+    decks: dict[str, str],
+    ignore_keywords: Collection[str],
+) -> None:
+    import parser
+
+    migrated = 0
+    for deck_path, deck_directory in decks.items():
+        for root, _, files in os.walk(deck_directory):
+            if root.split(os.sep)[-1] in ignore_keywords:
+                continue
+            for file in files:
+                if file.startswith("_") or not file.endswith(".md"):
+                    continue
+
+                file_path = os.path.join(root, file)
+                stat = os.stat(file_path)
+                with open(file_path, "r", encoding="utf-8") as f:
+                    content = parser.remove_yaml(f.read())
+
+                markers = list(sync_index.MARKER_RE.finditer(content))
+                if not markers:
+                    continue
+
+                last = markers[-1]
+                try:
+                    fields = parser.split_cards(sync_index.strip_markers(content))
+                    imported = len(
+                        parser.split_cards(
+                            sync_index.strip_markers(content[: last.start()])
                         )
-                    except ValueError as e:
-                        console.print(f"Error processing {file}: {e}")
-                        progress.advance(task)
-                        continue
+                    )
+                except ValueError as e:
+                    console.print(f"Error processing {file}: {e}")
+                    continue
+
+                complete = not content[last.end() :].strip()
+                index.migrate(file_path, stat, fields, imported, complete)
+                migrated += 1
+
+    console.print(f"Migrated {migrated} files to the sync index at {index.db_path}")
+
+
+def report_rejected(console: Console, cards: list[dict], e: anki.AnkiError) -> None:
+    for i, item in enumerate(cards):
+        style = "bold red" if e.result is None or e.result[i] is None else "bold green"
+        console.print("Text: " + item["fields"]["Text"], style=style)
+        console.print("Extra: " + item["fields"]["Extra"], style=style)
+        console.print("\n----------\n\n")
+    console.print(e.result)
+    console.print(e.e)
+
+
+def report_refused(
+    console: Console, file_path: str, cards: list[dict], refused: dict[int, str]
+) -> None:
+    console.print(
+        f"[yellow]Skipped {len(refused)} notes of {os.path.basename(file_path)} "
+        "Anki would refuse[/yellow]"
+    )
+    for i, reason in sorted(refused.items()):
+        console.print(f"  {cards[i]['fields']['Text']}: {reason}", style="yellow")
+
+
+def report_profile(
+    console: Console, profiler: profile.Profiler, args: argparse.Namespace
+) -> None:
+    from rich.table import Table
+
+    report = profiler.report()
+    console.print(f"\n[bold]Profile[/bold] of {report['wall_ms']:.0f} ms")
+
+    table = Table("stage", "calls", "total ms", "mean ms", "max ms")
+    for stage in report["stages"]:
+        table.add_row(
+            stage["name"],
+            str(stage["calls"]),
+            f"{stage['total_ms']:.1f}",
+            f"{stage['mean_ms']:.3f}",
+            f"{stage['max_ms']:.1f}",
+        )
+    console.print(table)
+
+    for name, count in report["counters"].items():
+        console.print(f"{name}: {count}")
+    for title, key, label in [
+        ("Slowest files", "slowest_files", "file"),
+        ("Slowest cards", "slowest_cards", "text"),
+    ]:
+        if report[key]:
+            console.print(f"[bold]{title}[/bold]")
+        for span in report[key]:
+            console.print(f"{span['ms']:9.1f} ms  {span[label]!r}", markup=False)
+
+    if args.profile:
+        profiler.write(args.profile, chrome=args.profile_format == "chrome")
+        console.print(f"Wrote the profile to {args.profile}")
+
+
+def up_to_date(args: argparse.Namespace) -> bool:
+    """Whether a plain sync would find no changed note, checked with the standard
+    library alone; prints what the sync would have printed"""
+    if args.force or args.watch or args.migrate_markers or args.hash_cache:
+        return False
+    if args.apkg:
+        return False
+    if args.profile is not None:
+        return False
+
+    from deckConsts import DECKS, IGNORE_KEYWORDS  # type: ignore
+
+    index = sync_index.SyncIndex(args.sync_index or sync_index.default_path())
+    try:
+        files = scanner.scan(DECKS, IGNORE_KEYWORDS)
+        if scanner.changed(files, index.stats()):
+            return False
+        if args.diff and scanner.removed(DECKS, files, index.paths()):
+            return False
+    finally:
+        index.close()
+    print(f"0 of {len(files)} notes changed since the last sync")
+    return True
+
+
+def main() -> None:
+    args = parse_args()
+    if up_to_date(args):
+        return
 
-                    if len(all_cards) == 0:
-                        progress.advance(task)
-                        continue
+    from rich.console import Console
 
-                    if all_images:
-                        for image in all_images:
-                            console.print(f"Uploading {image['filename']} to Anki")
-                            anki.send_media(image)
+    import field_cache
+    import highlight
 
-                    console.print(f"[bold]Processing {file}[/bold]")
+    console = Console()
+    anki.configure(
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        retries=args.retries,
+    )
+
+    if args.hash_cache:
+        check_hash_cache(console, args.hash_cache == "rebuild")
+        return
+
+    # only needed to sync, the functions above can be used without a configuration
+    import deckConsts  # type: ignore
+    from deckConsts import DECKS, IGNORE_KEYWORDS  # type: ignore
+
+    backend = args.markdown or getattr(deckConsts, "MARKDOWN_BACKEND", None)
+    if backend:
+        import render
+
+        # before the field cache fingerprints the renderer
+        render.use_backend(backend)
+    if args.no_field_cache:
+        field_cache.disable()
+    if args.highlight_cache:
+        highlight.use_disk_store()
+    profiler = profile.enable() if args.profile is not None else None
+    index = sync_index.SyncIndex(args.sync_index or sync_index.default_path())
+    try:
+        if args.migrate_markers:
+            migrate_markers(console, index, DECKS, IGNORE_KEYWORDS)
+        else:
+            if args.apkg:
+                export(console, args, DECKS, IGNORE_KEYWORDS)
+            else:
+                sync(console, args, index, DECKS, IGNORE_KEYWORDS)
+            # rendering in --jobs worker processes isn't counted here
+            highlights = highlight.get_highlight_cache()
+            if highlights.lookups:
+                console.print(highlights.summary())
+    finally:
+        index.close()
+        if profiler is not None:
+            profile.disable()
+            report_profile(console, profiler, args)
+
+
+def delete_removed(
+    console: Console,
+    index: sync_index.SyncIndex,
+    decks: dict[str, str],
+    files: list[scanner.ScannedFile],
+) -> None:
+    """Deletes the notes of synced files that were deleted from the decks"""
+    paths = scanner.removed(decks, files, index.paths())
+    if not paths:
+        return
+    try:
+        deleted = batching.delete_files(index, paths)
+    except anki.AnkiError as e:
+        console.print(f"[bold red]Failed to delete the notes of removed files: {e.e}")
+        return
+    console.print(f"Deleted {deleted} notes of {len(paths)} removed files")
+
+
+def sync(
+    console: Console,
+    args: argparse.Namespace,
+    index: sync_index.SyncIndex,
+    decks: dict[str, str],
+    ignore_keywords: Collection[str],
+) -> None:
+    import media
+    import parallel
+    import pipeline
+
+    if args.pipeline:
+        if args.diff:
+            delete_removed(console, index, decks, scanner.scan(decks, ignore_keywords))
+        pipeline.Pipeline(
+            console,
+            decks,
+            ignore_keywords,
+            functools.partial(plan_file, index, diff=args.diff),
+            build_payload,
+            index,
+            report_rejected,
+            report_refused,
+            force=args.force,
+            jobs=args.jobs,
+            anki_concurrency=args.anki_concurrency,
+            batch_notes=args.batch_notes,
+            batch_bytes=args.batch_bytes,
+        ).run()
+        return
+
+    renderer = (
+        parallel.PooledCardRenderer(args.jobs)
+        if args.jobs > 1
+        else parallel.CardRenderer()
+    )
+    media_sync = media.MediaSync()
+
+    with profile.span("scan"):
+        files = scanner.scan(decks, ignore_keywords)
+        work = files if args.force else scanner.changed(files, index.stats())
+    console.print(f"{len(work)} of {len(files)} notes changed since the last sync")
+    if args.diff:
+        with profile.span("removed"):
+            delete_removed(console, index, decks, files)
+
+    try:
+        if args.watch:
+            watch(
+                console,
+                args,
+                index,
+                decks,
+                ignore_keywords,
+                work,
+                renderer,
+                media_sync,
+            )
+        else:
+            sync_files(console, args, index, work, renderer, media_sync)
+    finally:
+        renderer.close()
+
+    if media_sync.stats.references:
+        console.print(media_sync.stats.summary())
+
+
+def sync_files(
+    console: Console,
+    args: argparse.Namespace,
+    index: sync_index.SyncIndex,
+    work: list[scanner.ScannedFile],
+    renderer: parallel.CardRenderer,
+    media_sync: media.MediaSync,
+) -> None:
+    if not work:
+        return
+
+    from rich.progress import Progress
+
+    # files with changes to sync, uploaded once every deck has been parsed
+    pending: list[tuple[str, list[dict], list[dict], list[int]]] = []
+    all_images: list[dict[str, str]] = []
+
+    def collect(
+        key: tuple[str, str, str], cards: list[parser.Card] | ValueError
+    ) -> None:
+        file_path, deck_path, tag = key
+        try:
+            if isinstance(cards, ValueError):
+                raise cards
+            with profile.span("payload"):
+                cards_payload, images = build_payload(cards, deck_path, tag)
+        except ValueError as e:
+            console.print(f"Error processing {os.path.basename(file_path)}: {e}")
+            return
+
+        pending.append((file_path, *index.changes(file_path, cards_payload)))
+        all_images.extend(images)
 
+    with Progress(console=console, transient=True) as progress:
+        task = progress.add_task("[green][bold]Reading", total=len(work))
+        deck_path = None
+
+        for scanned in work:
+            if scanned.deck_path != deck_path:
+                deck_path = scanned.deck_path
+                progress.console.print(f" --- [blue]{deck_path}[/blue] --- ")
+
+            with profile.span("file", file=scanned.path):
+                try:
+                    planned = plan_file(index, scanned, args.force, args.diff)
+                except ValueError as e:
+                    progress.console.print(
+                        f"Error processing {os.path.basename(scanned.path)}: {e}"
+                    )
+                    planned = None
+
+                if planned is not None:
+                    tag, fields = planned
+                    key = (scanned.path, deck_path, tag)
+                    for rendered in renderer.submit(key, fields, Path(scanned.root)):
+                        collect(*rendered)
+
+            progress.advance(task)
+
+        for rendered in renderer.drain():
+            collect(*rendered)
+
+        progress.remove_task(task)
+
+        if all_images:
+            with profile.span("media"):
+                media_sync.upload(media_sync.add(all_images))
+
+        task = progress.add_task("[green][bold]Uploading", total=len(pending))
+
+        def file_done(file_path: str, note_ids: list[int]) -> None:
+            index.done(file_path, note_ids)
+            progress.advance(task)
+
+        def file_failed(file_path: str, cards: list[dict], e: anki.AnkiError) -> None:
+            index.failed(file_path, e.result)
+            progress.console.print(f"[bold red]Failed to import {file_path}[/bold red]")
+            report_rejected(progress.console, cards, e)
+            progress.advance(task)
+
+        batcher = batching.NoteBatcher(
+            file_done,
+            file_failed,
+            max_notes=args.batch_notes,
+            max_bytes=args.batch_bytes,
+            target_latency=args.batch_latency,
+        )
+        with profile.span("preflight"):
+            refused = batching.preflight(pending, index, chunk_notes=args.batch_notes)
+        with profile.span("notes"):
+            for file_path, cards, updates, deletes in pending:
+                console.print(f"[bold]Processing {os.path.basename(file_path)}[/bold]")
+                if file_path in refused:
+                    report_refused(console, file_path, cards, refused[file_path])
+                    cards = batching.without_refused(
+                        index, file_path, cards, refused[file_path]
+                    )
+                batcher.add(file_path, cards, updates, deletes)
+            batcher.close()
+
+
+def export(
+    console: Console,
+    args: argparse.Namespace,
+    decks: dict[str, str],
+    ignore_keywords: Collection[str],
+) -> None:
+    """Writes every note to an .apkg package, leaving Anki and the sync index alone"""
+    import apkg
+    import parallel
+    from rich.progress import Progress
+
+    renderer = (
+        parallel.PooledCardRenderer(args.jobs)
+        if args.jobs > 1
+        else parallel.CardRenderer()
+    )
+    package = apkg.ApkgWriter(args.apkg)
+
+    def collect(
+        key: tuple[str, str, str, list[str]], cards: list[parser.Card] | ValueError
+    ) -> None:
+        file_path, deck_path, tag, guids = key
+        try:
+            if isinstance(cards, ValueError):
+                raise cards
+            with profile.span("payload"):
+                notes, images = build_payload(cards, deck_path, tag)
+        except ValueError as e:
+            console.print(f"Error processing {os.path.basename(file_path)}: {e}")
+            return
+        package.add_notes(notes, guids)
+        package.add_media(images)
+
+    with profile.span("scan"):
+        files = scanner.scan(decks, ignore_keywords)
+
+    try:
+        with package, Progress(console=console, transient=True) as progress:
+            task = progress.add_task("[green][bold]Exporting", total=len(files))
+            for scanned in files:
+                with profile.span("file", file=scanned.path):
                     try:
-                        anki.send_notes(all_cards)
-                    except anki.AnkiError as e:
-                        for i, item in enumerate(all_cards):
-                            style = (
-                                "bold red"
-                                if e.result is None or e.result[i] is None
-                                else "bold green"
-                            )
-                            progress.console.print(
-                                "Text: " + item["fields"]["Text"], style=style
-                            )
-                            progress.console.print(
-                                "Extra: " + item["fields"]["Extra"], style=style
-                            )
-                            progress.console.print("\n----------\n\n")
-                        progress.console.print(e.result)
-                        progress.console.print(e.e)
-
-                        continue
-
-                    # TODO: fix multi-write of end delimiter on force
-                    with open(file_path, "a+", encoding="utf-8") as f:
-                        f.write("\n***\n")
-
-                    progress.advance(task)
+                        with profile.span("read", file=scanned.path), open(
+                            scanned.path, "r", encoding="utf-8"
+                        ) as f:
+                            fields = list(read_cards(f))
+                    except ValueError as e:
+                        progress.console.print(
+                            f"Error processing {os.path.basename(scanned.path)}: {e}"
+                        )
+                        fields = []
+
+                    tag = file_tag(
+                        scanned.deck_path, scanned.deck_directory, scanned.path
+                    )
+                    guids = apkg.note_guids(tag, fields)
+                    key = (scanned.path, scanned.deck_path, tag, guids)
+                    for rendered in renderer.submit(key, fields, Path(scanned.root)):
+                        collect(*rendered)
+
+                progress.advance(task)
+
+            for rendered in renderer.drain():
+                collect(*rendered)
+    finally:
+        renderer.close()
+
+    console.print(package.stats.summary(args.apkg))
+
+
+def watch(
+    console: Console,
+    args: argparse.Namespace,
+    index: sync_index.SyncIndex,
+    decks: dict[str, str],
+    ignore_keywords: Collection[str],
+    work: list[scanner.ScannedFile],
+    renderer: parallel.CardRenderer,
+    media_sync: media.MediaSync,
+) -> None:
+    """Syncs notes as they are saved, keeping the renderer and indexes warm"""
+    import watcher
+
+    events = watcher.open_watcher(decks, ignore_keywords)
+    try:
+        # catch up on what changed while not watching
+        failed = False
+        try:
+            sync_files(console, args, index, work, renderer, media_sync)
+        except anki.AnkiError as e:
+            failed = True
+            console.print(f"[bold red]Failed to sync {len(work)} notes: {e.e}")
+        console.print(
+            f"Watching {len(decks)} decks for changes ({events.name}), Ctrl+C to stop"
+        )
+
+        while True:
+            paths = events.wait()
+            start = time.perf_counter()
+
+            # images may have changed along with the notes
+            hash_cache.get_hash_cache().forget_all()
+            if paths is None or failed:
+                # the watcher lost track of events or notes were left unsynced,
+                # check every note again
+                files = scanner.scan(decks, ignore_keywords)
+            else:
+                files = scanner.scan_paths(decks, ignore_keywords, paths)
+
+            work = files if args.force else scanner.changed(files, index.stats())
+            if not work:
+                continue
+            # Anki may have been started again since it was found not running
+            anki.reconnect()
+            try:
+                sync_files(console, args, index, work, renderer, media_sync)
+            except anki.AnkiError as e:
+                failed = True
+                console.print(f"[bold red]Failed to sync {len(work)} notes: {e.e}")
+                continue
+            failed = False
+            console.print(
+                f"Synced {len(work)} notes in {(time.perf_counter() - start) * 1000:.0f} ms"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        events.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+from .md_anki import (
+    AnkiFieldExtension,
+    REM_CONVERSION,
+    makeExtension,
+    media_for_image,
+    restore_spaces,
+)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*-coding:utf-8-*-
+
+import html
+import re
+from pathlib import Path
+from typing import Optional
+from urllib.parse import unquote
+from xml.etree.ElementTree import Element, HTML_EMPTY
+
+from markdown import util
+from markdown.extensions import Extension
+from markdown.serializers import RE_AMP, to_xhtml_string
+from markdown.treeprocessors import Treeprocessor
+
+from md_mathjax.md_mathjax import MATH_PREFIXES
+from utils import hash_cache
+
+REM_CONVERSION = 16
+
+ENTITY_RE = re.compile(r"^&(?:#[0-9]+|#x[0-9a-f]+|[0-9a-z]+);$", re.I)
+ENTITIES_RE = re.compile(r"&(?:#[0-9]+|#x[0-9a-f]+|[0-9a-z]+);", re.I)
+PLACEHOLDER_RE = re.compile(util.HTML_PLACEHOLDER % r"[0-9]+")
+CODEHILITE_PREFIX = '<div class="codehilite">'
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def media_for_image(
+    src: str, alt: str, media_root: Path
+) -> tuple[dict[str, str], Optional[str]]:
+    """Returns the media entry for an image and its inline style, if sized with ``|width``"""
+    image_path = media_root / Path(unquote(src))
+    image_id = hash_cache.hash_file(image_path)
+    filename = f"{image_id}{image_path.suffix}"
+
+    style = None
+    alt_size = re.match(r"^\|(\d+)", alt)
+    if alt_size:
+        width_val = str(int(alt_size.group(1)) / REM_CONVERSION) + "rem"
+        style = f"width: {width_val}; height: auto;"
+
+    return {"filename": filename, "path": str(image_path)}, style
+
+
+def _escape_minimal(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def _decode_entity(match: re.Match) -> str:
+    char = html.unescape(match.group(0))
+    if not char.strip():
+        # Markdown strips the field after serializing it, see restore_spaces
+        return match.group(0)
+    return _escape_minimal(char)
+
+
+def _decode_space(match: re.Match) -> str:
+    char = html.unescape(match.group(0))
+    return match.group(0) if char.strip() else char
+
+
+def normalize_text(text: str) -> str:
+    """Text as it reads after Markdown escaped it and an HTML parser decoded it again"""
+    if "&" in text:
+        text = RE_AMP.sub("&amp;", text)
+        return ENTITIES_RE.sub(
+            _decode_entity, text.replace("<", "&lt;").replace(">", "&gt;")
+        )
+    return _escape_minimal(text)
+
+
+def restore_spaces(field: str) -> str:
+    """Decodes the whitespace entities ``normalize_text`` left for after the strip"""
+    if "&" in field:
+        return ENTITIES_RE.sub(_decode_space, field)
+    return field
+
+
+def _quote_attrib(value: str) -> str:
+    value = normalize_text(value)
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('"', "&quot;") + '"'
+
+
+class AnkiHtmlWriter:
+    """
+    Serializes the tree the way ``str(BeautifulSoup(...))`` prints Markdown's XHTML
+    output once every ``<p>`` has been unwrapped: attributes sorted and re-quoted,
+    entities decoded, void tags closed with ``/>`` and whitespace-only text between
+    tags collapsed to a single character.
+    """
+
+    def __init__(self, block_placeholders: dict[str, str]):
+        # placeholder of block-level stashed HTML -> whitespace trailing that HTML
+        self.block_placeholders = block_placeholders
+        self.data: list[str] = []
+        self.pending: list[str] = []
+        self.pre_depth = 0
+
+    def text(self, text: str) -> None:
+        if "\x02" not in text or not self.block_placeholders:
+            self.pending.append(text)
+            return
+
+        last = 0
+        for m in PLACEHOLDER_RE.finditer(text):
+            trailing = self.block_placeholders.get(m.group(0))
+            if trailing is None:
+                continue
+            self.pending.append(text[last : m.start()])
+            self.boundary()
+            self.data.append(m.group(0))
+            self.pending.append(trailing)
+            last = m.end()
+        self.pending.append(text[last:])
+
+    def boundary(self) -> None:
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        if not text:
+            return
+
+        if not self.pre_depth and not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        self.data.append(normalize_text(text))
+
+    def element(self, elem: Element) -> None:
+        tag = elem.tag
+        if tag == "p" and len(elem) == 0 and elem.text in self.block_placeholders:
+            # Markdown drops the <p> around stashed block-level HTML altogether
+            self.text(elem.text)
+        elif tag is None or tag == "p":
+            self.boundary()
+            if elem.text:
+                self.text(elem.text)
+            for child in elem:
+                self.element(child)
+            self.boundary()
+        else:
+            self.boundary()
+            self.data.append("<" + tag)
+            for k, v in sorted(elem.items()):
+                self.data.append(f" {k}={_quote_attrib(v)}")
+            if tag in HTML_EMPTY:
+                self.data.append("/>")
+            else:
+                self.data.append(">")
+                if tag == "pre":
+                    self.pre_depth += 1
+                if elem.text:
+                    self.text(elem.text)
+                for child in elem:
+                    self.element(child)
+                self.boundary()
+                if tag == "pre":
+                    self.pre_depth -= 1
+                self.data.append(f"</{tag}>")
+        if elem.tail:
+            self.text(elem.tail)
+
+    def serialize(self, root: Element) -> str:
+        self.element(root)
+        self.boundary()
+        return "".join(self.data)
+
+
+class AnkiFieldTreeprocessor(Treeprocessor):
+    """Points images at their content-addressed media files and collects them"""
+
+    def __init__(self, md, extension):
+        super().__init__(md)
+        self.extension = extension
+
+    def run(self, root):
+        if not self.extension.active:
+            return
+
+        if not self.normalize_stash():
+            # raw HTML from the note itself, hand the output to BeautifulSoup instead
+            self.extension.needs_soup = True
+            return
+
+        self.process_images(root)
+
+    def normalize_stash(self) -> bool:
+        stash = self.md.htmlStash
+        blocks = stash.rawHtmlBlocks
+        for i, block in enumerate(blocks):
+            if not isinstance(block, str):
+                return False
+            if block.startswith(CODEHILITE_PREFIX):
+                stripped = block.rstrip(ASCII_SPACES)
+                self.extension.block_placeholders[stash.get_placeholder(i)] = block[
+                    len(stripped) :
+                ]
+                blocks[i] = stripped.replace("&quot;", '"').replace("&#39;", "'")
+            elif ENTITY_RE.match(block):
+                blocks[i] = normalize_text(block)
+            elif block.startswith(MATH_PREFIXES):
+                # escaped as text by md_mathjax
+                blocks[i] = normalize_text(block)
+            else:
+                return False
+        return True
+
+    def process_images(self, root: Element) -> None:
+        media_root = self.extension.media_root
+        for img in root.iter("img"):
+            media, style = media_for_image(
+                img.get("src", ""), img.get("alt", ""), media_root
+            )
+            self.extension.media.append(media)
+
+            if style:
+                img.set("style", style)
+            img.set("src", media["filename"])
+            img.set("alt", "")
+
+
+class AnkiFieldExtension(Extension):
+    """
+    Produces Anki field HTML straight from the element tree: paragraphs are unwrapped,
+    images are renamed to their hashed media filename and the media to upload is
+    collected on ``media``.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+
+        # only rewrite the output while rendering a card field
+        self.active = False
+        self.media_root = Path(".")
+        self.media: list[dict[str, str]] = []
+        self.block_placeholders: dict[str, str] = {}
+        self.needs_soup = False
+
+    def reset(self):
+        self.media = []
+        self.block_placeholders = {}
+        self.needs_soup = False
+
+    def serialize(self, root: Element) -> str:
+        if self.active and not self.needs_soup:
+            return AnkiHtmlWriter(self.block_placeholders).serialize(root)
+        return to_xhtml_string(root)
+
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        md.treeprocessors.register(AnkiFieldTreeprocessor(md, self), "anki_field", 5)
+
+
+def makeExtension(**kwargs):
+    return AnkiFieldExtension(**kwargs)
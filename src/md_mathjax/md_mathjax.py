@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 # -*-coding:utf-8-*-
 
-from markdown.inlinepatterns import InlineProcessor
+import re
+from typing import Callable
+
 from markdown.extensions import Extension
+from markdown.preprocessors import Preprocessor
+from markdown.serializers import _escape_cdata  # type: ignore[attr-defined]
+from markdown.util import BLOCK_LEVEL_ELEMENTS
 
 DEFUALT_MATHJAX_SETTING = r"""
 window.MathJax = {
@@ -20,17 +25,130 @@ window.MathJax = {
 """
 
 
-class MathJaxInlinePattern(InlineProcessor):
-    """ """
+# what a math span starts with once rendered, for MathJax
+MATH_PREFIXES = ("\\(", "\\[")
+
+# escaped dollars and backslashes, code spans and the dollars of math
+SPECIAL_RE = re.compile(r"\\[\\$]|`+|\$\$?")
+# within $...$, where the next unescaped dollar sign ends it
+INLINE_END_RE = re.compile(r"\\.|\$\$?", re.DOTALL)
+BACKTICKS_RE = re.compile(r"`+")
+FENCE_RE = re.compile(r" {0,3}(`{3,}|~{3,})")
+LIST_ITEM_RE = re.compile(r" {0,3}(?:[*+-]|[0-9]+\.)[ \t]")
+HEADING_RE = re.compile(r" {0,3}#")
+HTML_BLOCK_RE = re.compile(r" {0,3}<(?:!|/?([a-zA-Z][a-zA-Z0-9]*))")
+
+
+def math_html(math: str, display: bool) -> str:
+    """MathJax delimiters around the math, escaped as text. A space after every
+    brace keeps ``}}`` from closing the cloze the math is in"""
+    text = _escape_cdata(math.replace("}", "} "))
+    return f"\\[{text}\\]" if display else f"\\({text}\\)"
+
+
+def replace_math(text: str, store: Callable[[str], str]) -> str:
+    """Replaces the ``$...$`` and ``$$...$$`` math of a paragraph with what ``store``
+    returns for its HTML, in a single pass. Code spans are left alone and ``\\$``
+    is a dollar sign."""
+    out = []
+    pos = index = 0
+    while m := SPECIAL_RE.search(text, index):
+        token = m.group()
+        index = m.end()
+        if token == "\\\\":
+            continue
+        if token == "\\$":
+            out.append(text[pos : m.start()] + "$")
+            pos = index
+        elif token[0] == "`":
+            # the code span ends at the next run of as many backticks
+            for run in BACKTICKS_RE.finditer(text, index):
+                if run.group() == token:
+                    index = run.end()
+                    break
+        elif token == "$$":
+            end = text.find("$$", index)
+            if end > index:
+                out.append(
+                    text[pos : m.start()] + store(math_html(text[index:end], True))
+                )
+                pos = index = end + 2
+        else:
+            # scans up to the next dollar sign only, every character is read twice at most
+            end_m = INLINE_END_RE.search(text, index)
+            while end_m is not None and end_m.group()[0] == "\\":
+                end_m = INLINE_END_RE.search(text, end_m.end())
+            if end_m is not None and end_m.group() == "$" and end_m.start() > index:
+                out.append(
+                    text[pos : m.start()]
+                    + store(math_html(text[index : end_m.start()], False))
+                )
+                pos = index = end_m.end()
+    out.append(text[pos:])
+    return "".join(out)
+
 
-    def __init__(self, pattern, extension):
-        super().__init__(pattern)
-        self.extension = extension
+def stash_math(text: str, store: Callable[[str], str]) -> str:
+    """``replace_math`` on every paragraph of a note, skipping fenced and indented
+    code and blocks of raw HTML, which Markdown leaves alone as well"""
+    out = []
+    paragraph: list[str] = []
+    fence = ""
+    in_list = in_code = in_html = False
+    blank = True
+    for line in text.split("\n"):
+        if fence:
+            code = True
+            if line.lstrip(" ").startswith(fence):
+                fence = ""
+        elif not line.strip():
+            code = True
+            in_html = False
+        elif m := FENCE_RE.match(line):
+            code = True
+            fence = m.group(1)
+        elif in_html or (blank and is_html_block(line)):
+            code = in_html = True
+        elif (blank or in_code) and line.expandtabs(4).startswith("    "):
+            # Markdown's indented code, unless the line continues a list item
+            code = in_code = not in_list
+        else:
+            code = in_code = False
+            item = LIST_ITEM_RE.match(line)
+            if item:
+                in_list = True
+            elif blank and not line.startswith((" ", "\t")):
+                in_list = False
+            if (item or HEADING_RE.match(line)) and paragraph:
+                # math does not run from one list item or heading into the next
+                out.append(replace_math("\n".join(paragraph), store))
+                paragraph = []
 
-    def handleMatch(self, m, data):
-        text = m.group("math")
-        text = text.replace("}", "} ")
-        return "\(" + text + "\)", m.start(0), m.end(0)
+        if code and paragraph:
+            out.append(replace_math("\n".join(paragraph), store))
+            paragraph = []
+        (out if code else paragraph).append(line)
+        blank = not line.strip()
+
+    if paragraph:
+        out.append(replace_math("\n".join(paragraph), store))
+    return "\n".join(out)
+
+
+def is_html_block(line: str) -> bool:
+    m = HTML_BLOCK_RE.match(line)
+    return m is not None and (
+        not m.group(1) or m.group(1).lower() in BLOCK_LEVEL_ELEMENTS
+    )
+
+
+class MathJaxPreprocessor(Preprocessor):
+    """Stashes math before Markdown parses the note, so neither emphasis nor escapes
+    change the LaTeX. Runs after fenced code and raw HTML blocks are stashed."""
+
+    def run(self, lines):
+        text = stash_math("\n".join(lines), self.md.htmlStash.store)
+        return text.split("\n")
 
 
 class Md4MathjaxExtension(Extension):
@@ -56,12 +174,7 @@ class Md4MathjaxExtension(Extension):
     def extendMarkdown(self, md):
         # later we will use it
         self.md = md
-        # Regex to detect mathjax
-        mathjax_inline_regex1 = r"(?<!\$)\$(?!\$)" r"(?P<math>.+?)" r"(?<!\$)\$(?!\$)"
-
-        md.inlinePatterns.register(
-            MathJaxInlinePattern(mathjax_inline_regex1, self), "mathjax_inlined1", 190
-        )
+        md.preprocessors.register(MathJaxPreprocessor(md), "mathjax", 15)
 
 
 def makeExtension(**kwargs):
@@ -0,0 +1,124 @@
+import os
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from utils import anki
+
+# AnkiConnect reads each file from "path" itself, these bound the work per request
+MEDIA_BATCH_BYTES = 32 * 1024 * 1024
+MEDIA_BATCH_FILES = 64
+
+
+@dataclass
+class MediaSyncStats:
+    references: int = 0
+    unique: int = 0
+    already_in_anki: int = 0
+    uploaded: int = 0
+    bytes_uploaded: int = 0
+    bytes_saved: int = 0
+    requests: int = 0
+    # storeMediaFile requests, the others ask Anki for its media names
+    upload_requests: int = 0
+
+    @property
+    def requests_saved(self) -> int:
+        # previously every reference cost one storeMediaFile request
+        return self.references - self.upload_requests
+
+    def summary(self) -> str:
+        return (
+            f"Media: {self.references} references, {self.unique} unique, "
+            f"{self.already_in_anki} already in Anki, {self.uploaded} uploaded "
+            f"({self.bytes_uploaded} bytes) in {self.requests} requests; "
+            f"saved {self.bytes_saved} bytes and {self.requests_saved} round-trips"
+        )
+
+
+def _batches(
+    media: list[dict[str, str]], sizes: dict[str, int]
+) -> Iterable[list[dict[str, str]]]:
+    batch: list[dict[str, str]] = []
+    batch_bytes = 0
+    for item in media:
+        size = sizes[item["filename"]]
+        if batch and (
+            len(batch) >= MEDIA_BATCH_FILES or batch_bytes + size > MEDIA_BATCH_BYTES
+        ):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(item)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+class MediaSync:
+    """Uploads the images Anki does not have yet.
+
+    Filenames are content hashes, so a filename Anki already knows is the same
+    file and duplicates within the run are the same upload. Images can be added
+    as they are found; Anki is asked for its media names on the first upload.
+    """
+
+    def __init__(self) -> None:
+        self.stats = MediaSyncStats()
+        self.sizes: dict[str, int] = {}
+        self.existing: Optional[set[str]] = None
+
+    def add(self, images: Iterable[dict[str, str]]) -> list[dict[str, str]]:
+        """Returns the images that were not seen before in this run"""
+        new = []
+        for image in images:
+            self.stats.references += 1
+            filename = image["filename"]
+            if filename in self.sizes:
+                self.stats.bytes_saved += self.sizes[filename]
+                continue
+            self.sizes[filename] = os.path.getsize(image["path"])
+            new.append(image)
+        self.stats.unique = len(self.sizes)
+        return new
+
+    def upload(self, images: list[dict[str, str]]) -> None:
+        if not images:
+            return
+
+        try:
+            self._upload(images)
+        except anki.AnkiError:
+            # let a later sync upload what did not reach Anki
+            for image in images:
+                if self.existing is None or image["filename"] not in self.existing:
+                    self.sizes.pop(image["filename"], None)
+            raise
+
+    def _upload(self, images: list[dict[str, str]]) -> None:
+        if self.existing is None:
+            self.existing = set(anki.get_media_file_names())
+            self.stats.requests += 1
+
+        missing = []
+        for image in images:
+            if image["filename"] in self.existing:
+                self.stats.already_in_anki += 1
+                self.stats.bytes_saved += self.sizes[image["filename"]]
+            else:
+                missing.append(image)
+
+        for batch in _batches(missing, self.sizes):
+            anki.multi([anki.request("storeMediaFile", **image) for image in batch])
+            self.existing.update(image["filename"] for image in batch)
+            self.stats.requests += 1
+            self.stats.upload_requests += 1
+            self.stats.uploaded += len(batch)
+            self.stats.bytes_uploaded += sum(
+                self.sizes[image["filename"]] for image in batch
+            )
+
+
+def sync_media(images: Iterable[dict[str, str]]) -> MediaSyncStats:
+    sync = MediaSync()
+    sync.upload(sync.add(images))
+    return sync.stats
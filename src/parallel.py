@@ -0,0 +1,79 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, Union
+
+import parser
+
+# cards rendered per pool task, so one huge note is spread over every worker
+CARDS_PER_TASK = 16
+
+RawCard = parser.RawCard
+Rendered = tuple[Any, Union[list[parser.Card], ValueError]]
+
+
+class CardRenderer:
+    """Renders the cards of each submitted file in the calling process.
+
+    ``submit`` and ``drain`` yield ``(key, cards)`` for finished files in the
+    order they were submitted, with a ``ValueError`` in place of the cards if the
+    file could not be rendered.
+    """
+
+    def submit(self, key: Any, fields: list[RawCard], root: Path) -> Iterator[Rendered]:
+        try:
+            yield key, parser.render_cards(fields, root)
+        except ValueError as e:
+            yield key, e
+
+    def drain(self) -> Iterator[Rendered]:
+        return iter(())
+
+    def close(self) -> None:
+        pass
+
+
+class PooledCardRenderer(CardRenderer):
+    """Renders cards in a process pool, a few cards per task.
+
+    Files are still handed back one at a time in submission order, so a single
+    consumer can upload and mark them deterministically. At most ``jobs * 4``
+    tasks are in flight before ``submit`` waits for the oldest file.
+    """
+
+    def __init__(self, jobs: int):
+        self.pool = ProcessPoolExecutor(jobs)
+        self.max_in_flight = jobs * 4
+        self.in_flight: deque[tuple[Any, list[Future]]] = deque()
+        self.tasks = 0
+
+    def submit(self, key: Any, fields: list[RawCard], root: Path) -> Iterator[Rendered]:
+        futures = [
+            self.pool.submit(parser.render_cards, fields[i : i + CARDS_PER_TASK], root)
+            for i in range(0, len(fields), CARDS_PER_TASK)
+        ]
+        self.in_flight.append((key, futures))
+        self.tasks += len(futures)
+
+        while self.tasks > self.max_in_flight and len(self.in_flight) > 1:
+            yield self.pop()
+
+    def pop(self) -> Rendered:
+        key, futures = self.in_flight.popleft()
+        self.tasks -= len(futures)
+
+        cards: list[parser.Card] = []
+        error = None
+        for future in futures:
+            try:
+                cards.extend(future.result())
+            except ValueError as e:
+                error = error or e
+        return key, error if error is not None else cards
+
+    def drain(self) -> Iterator[Rendered]:
+        while self.in_flight:
+            yield self.pop()
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
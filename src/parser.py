@@ -1,16 +1,18 @@
-from typing import Optional
-from urllib.parse import unquote
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
 
 import bs4
 import re
 from pathlib import Path
-import markdown
-from markdown.extensions import codehilite, fenced_code
 
-from md_mathjax import Md4MathjaxExtension
+import field_cache
+from md_anki import media_for_image
+from render import Renderer, get_renderer
+from utils import profile
 from utils import utils
 
-REM_CONVERSION = 16
+# text, extra and the heading tags of one card, before rendering
+RawCard = tuple[str, str, tuple[str, ...]]
 
 
 def remove_yaml(content):
@@ -30,126 +32,149 @@ def process_images(soup: bs4.BeautifulSoup, media_root: Path) -> list[dict[str,
     images = soup.find_all("img")
     media_to_post = []
     for img in images:
-        src = img["src"]
-        alt = img["alt"]
+        media, style = media_for_image(img["src"], img["alt"], media_root)
+        media_to_post.append(media)
 
-        image_path: Path = media_root / Path(unquote(src))
-        image_id = utils.hash_file(image_path)
-        filename = f"{image_id}{image_path.suffix}"
-        media_to_post.append({"filename": filename, "path": str(image_path)})
+        if style:
+            img["style"] = style
 
-        alt_size = re.match(r"^\|(\d+)", alt)
-        if alt_size:
-            width_val = str(int(alt_size.group(1)) / REM_CONVERSION) + "rem"
-            img["style"] = f"width: {width_val}; height: auto;"
-
-        img["src"] = filename
+        img["src"] = media["filename"]
         img["alt"] = ""
     return media_to_post
 
 
-def md_to_html(raw_string: str) -> str:
-    raw_string = raw_string.strip()
+def md_to_html(raw_string: str, renderer: Optional[Renderer] = None) -> str:
+    if renderer is None:
+        renderer = get_renderer()
+    return renderer.render(raw_string)
 
-    s = markdown.markdown(
-        raw_string,
-        extensions=[
-            codehilite.CodeHiliteExtension(),
-            fenced_code.FencedCodeExtension(),
-            Md4MathjaxExtension(),
-            "nl2br",
-        ],
-    )
 
-    return s.strip("\n")
+def process_field(
+    raw_string: str, root: Path, renderer: Optional[Renderer] = None
+) -> tuple[str, list[dict[str, str]]]:
+    cache = field_cache.get_field_cache()
+    if cache is not None:
+        cached = cache.get(raw_string, root)
+        if cached is not None:
+            return cached
+
+    if renderer is None:
+        renderer = get_renderer()
+
+    with profile.span("markdown"):
+        s, media_to_post, needs_soup = renderer.render_field(raw_string, root)
+
+    if needs_soup:
+        # raw HTML in the note is only visible to a real HTML parser
+        with profile.span("soup"):
+            soup = bs4.BeautifulSoup(s, "html.parser")
+            remove_paragraph_tags(soup)
+            media_to_post = process_images(soup, root)
+            s = str(soup)
+
+    if cache is not None:
+        cache.put(raw_string, root, s, media_to_post)
+    return s, media_to_post
+
+
+@dataclass(frozen=True, slots=True)
+class Card:
+    """A rendered card, one of many held until its file is synced"""
 
+    text: str
+    extra: str
+    tags: Optional[tuple[str, ...]] = None
+    images: Optional[list[dict[str, str]]] = None
+    cloze_count: int = 0
 
-def process_field(
-    raw_string: str, root: Path
-) -> tuple[bs4.BeautifulSoup, list[dict[str, str]]]:
-    s = md_to_html(raw_string)
 
-    soup = bs4.BeautifulSoup(s, "html.parser")
-    remove_paragraph_tags(soup)
-    media_to_post = process_images(soup, root)
+# explicit cloze already in the note | bold text | ** left over, e.g. inside MathJax
+CLOZE_RE = re.compile(r"\{\{c\d+::|<strong>(.*?)</strong>|\*\*(.*?)\*\*")
+EXPLICIT_CLOZE_ID_RE = re.compile(r"\d+::")
 
-    return soup, media_to_post
 
+def clozify(text: str) -> tuple[str, int]:
+    """Turns bold text into clozes in a single scan, returning the text and its cloze count"""
+    cloze_id = 1
+    cloze_count = 0
 
-class Card:
-    text: str
-    extra: str
-    tags: Optional[list[str]]
-    images: Optional[list[dict[str, str]]]
-
-    def __init__(
-        self,
-        text: str,
-        extra: str,
-        tags: Optional[list[str]] = None,
-        images: Optional[list[dict[str, str]]] = None,
-    ):
-        self.text = text
-        self.extra = extra
-        self.tags = tags
-        self.images = images
-
-
-def process_fields(t: str, e: str, root: Path) -> tuple[str, str, list[dict[str, str]]]:
-    text_field, t_img = process_field(t, root)
-    extra_field, e_img = process_field(e, root)
+    def replace(m: re.Match) -> str:
+        nonlocal cloze_id, cloze_count
+        cloze_count += 1
 
-    images = t_img + e_img
+        bold_text = m.group(1)
+        if bold_text is None:
+            bold_text = m.group(2)
+            if bold_text is None:
+                return m.group(0)
 
-    text_string = str(text_field)
+        if not EXPLICIT_CLOZE_ID_RE.match(bold_text):
+            bold_text = f"{cloze_id}::{bold_text}"
+            cloze_id += 1
+        return f"{{{{c{bold_text}}}}}"
 
-    bold_tags = ("<strong>", "</strong>")
+    return CLOZE_RE.sub(replace, text), cloze_count
 
-    # replace remaining ** with <strong> and </strong>
-    asterisk_matches = re.findall(r"\*\*(.*?)\*\*", text_string)
-    for asterisk_text in asterisk_matches:
-        text_string = text_string.replace(
-            f"**{asterisk_text}**", f"{bold_tags[0]}{asterisk_text}{bold_tags[1]}"
-        )
 
-    # process clozes
-    cloze_id = 1
-    bold_matches = re.findall(rf"{bold_tags[0]}(.*?){bold_tags[1]}", text_string)
-    for bold_text in bold_matches:
-        cloze_text = bold_text
-        if not re.match(r"^\d+::.*", bold_text):
-            cloze_text = f"{cloze_id}::{bold_text}"
-            cloze_id += 1
-        cloze_text = f"{{{{c{cloze_text}}}}}"
+def process_fields(
+    t: str, e: str, root: Path
+) -> tuple[str, str, list[dict[str, str]], int]:
+    renderer = get_renderer()
+    text_field, t_img = process_field(t, root, renderer)
+    extra_field, e_img = process_field(e, root, renderer)
+
+    images = t_img + e_img
 
-        text_string = text_string.replace(
-            f"{bold_tags[0]}{bold_text}{bold_tags[1]}", cloze_text
-        )
+    text_string, cloze_count = clozify(text_field)
 
-    return text_string, str(extra_field), images
+    return text_string, extra_field, images, cloze_count
 
 
-def parse_markdown(raw: str, root: Path) -> list[Card]:
-    content = raw.split("\n")
+def skip_front_matter(lines: Iterable[str]) -> Iterator[str]:
+    """``remove_yaml`` over the lines of a note, reading no further than needed"""
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    if not first.startswith("---"):
+        yield first
+        yield from lines
+        return
 
-    text = ""
-    extra = ""
+    part: Optional[str] = first[2:]
+    while part is not None:
+        end = part.find("---")
+        if end >= 0:
+            yield part[end + 3 :]
+            yield from lines
+            return
+        part = next(lines, None)
+    raise ValueError("Front matter is never closed")
 
-    extracted_fields = []
+
+def iter_cards(lines: Iterable[str]) -> Iterator[RawCard]:
+    """Splits the lines of a note into the raw (text, extra, heading tags) of each
+    card, yielding every card as soon as its last line has been read"""
+    text: list[str] = []
+    extra: list[str] = []
 
     tag_hierarchy: list[str] = []
+    # headings in effect where the card being built started
+    card_tags: tuple[str, ...] = ()
 
     is_building_multiline_extra = False
     is_building_code = False
 
     append = False
-    for line in iter(content):
+    for line in lines:
         # only strip on right to prevent stripping of indent/extra indicator
         line = line.rstrip()
 
+        if not text and not extra:
+            card_tags = tuple(tag_hierarchy)
+
         if line.lstrip() == "+":
-            text += "\n"
-            text += "\n"
+            text.append("\n\n")
             continue
 
         if line.startswith("#") and not is_building_code:
@@ -165,28 +190,24 @@ def parse_markdown(raw: str, root: Path) -> list[Card]:
 
         if line.startswith("```"):
             if is_building_multiline_extra:
-                extra += line
-                extra += "\n"
+                extra.append(line + "\n")
             else:
-                text += line
-                text += "\n"
+                text.append(line + "\n")
             is_building_code = not is_building_code
             continue
 
         if is_building_code:
             if is_building_multiline_extra:
-                extra += line
-                extra += "\n"
+                extra.append(line + "\n")
             else:
-                text += line
-                text += "\n"
+                text.append(line + "\n")
             continue
 
         if line == "---":
             if is_building_multiline_extra:
-                extracted_fields.append((text, extra, tag_hierarchy))
-                text = ""
-                extra = ""
+                yield "".join(text), "".join(extra), card_tags
+                text = []
+                extra = []
                 append = False
 
             is_building_multiline_extra = not is_building_multiline_extra
@@ -200,27 +221,46 @@ def parse_markdown(raw: str, root: Path) -> list[Card]:
             continue
 
         if append:
-            if text != "":
-                extracted_fields.append((text, extra, tag_hierarchy))
+            if text:
+                yield "".join(text), "".join(extra), card_tags
                 append = False
-            text = ""
-            extra = ""
+            text = []
+            extra = []
+            card_tags = tuple(tag_hierarchy)
 
         if is_building_multiline_extra or line.startswith("\t") or line.startswith(" "):
             append = False
-            extra += line.lstrip()
-            extra += "\n"
+            extra.append(line.lstrip() + "\n")
         else:
             append = False
-            text += line
-            text += "\n"
+            text.append(line + "\n")
+
+    if text:
+        yield "".join(text), "".join(extra), card_tags
+
+
+def split_cards(raw: str) -> list[RawCard]:
+    """Splits a note into the raw (text, extra, heading tags) of each card"""
+    return list(iter_cards(raw.split("\n")))
+
+
+def render_card(fields: RawCard, root: Path) -> Card:
+    text, extra, tags = fields
+    with profile.span("card", text=text[:60]):
+        text, extra, images, cloze_count = process_fields(text, extra, root)
+    return Card(text, extra, tags, images, cloze_count)
+
+
+def render_cards(fields: list[RawCard], root: Path) -> list[Card]:
+    return [render_card(f, root) for f in fields]
 
-    if text != "":
-        extracted_fields.append((text, extra, tag_hierarchy))
 
-    all_cards: list[Card] = []
-    for text, extra, tag_hierarchy in extracted_fields:
-        text, extra, images = process_fields(text, extra, root)
-        all_cards.append(Card(text, extra, tag_hierarchy, images))
+def parse_markdown(source: str | Iterable[str], root: Path) -> Iterator[Card]:
+    """Yields the rendered cards of a note one at a time.
 
-    return all_cards
+    ``source`` is the text of a note or anything yielding its lines, such as an
+    open file, which is then read as the cards are consumed.
+    """
+    lines = source.split("\n") if isinstance(source, str) else source
+    for fields in iter_cards(lines):
+        yield render_card(fields, root)
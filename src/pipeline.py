@@ -0,0 +1,257 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from rich.console import Console
+from rich.progress import Progress, ProgressColumn, Task, TextColumn
+from rich.text import Text
+
+import batching
+import media
+import parser
+import scanner
+import sync_index
+from utils import anki
+
+# files waiting between two stages; a full queue pauses the stage feeding it
+DEFAULT_QUEUE_SIZE = 32
+# how long the note stage waits for more files before sending a partial batch
+BATCH_LINGER = 0.25
+
+STAGES = ["scan", "read", "render", "media", "notes", "done"]
+
+
+class RateColumn(ProgressColumn):
+    def render(self, task: Task) -> Text:
+        return Text(f"{task.speed or 0:8.1f} files/s", style="progress.data.speed")
+
+
+class Pipeline:
+    """Runs a sync as stages connected by bounded queues:
+
+    scan -> read -> render (in an executor) -> media sync -> note sync -> record
+
+    Every stage works on a different file at the same time, so parsing continues
+    while Anki is busy. At most ``anki_concurrency`` AnkiConnect requests are in
+    flight at once.
+    """
+
+    def __init__(
+        self,
+        console: Console,
+        decks: dict[str, str],
+        ignore_keywords: Any,
+        plan: Callable[[scanner.ScannedFile, bool], Optional[tuple[str, list]]],
+        build: Callable[[list[parser.Card], str, str], tuple[list, list]],
+        index: sync_index.SyncIndex,
+        report_rejected: Callable[[Console, list[dict], anki.AnkiError], None],
+        report_refused: Callable[[Console, str, list[dict], dict[int, str]], None],
+        force: bool = False,
+        jobs: int = 1,
+        anki_concurrency: int = batching.DEFAULT_ANKI_CONCURRENCY,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        batch_notes: int = batching.DEFAULT_BATCH_NOTES,
+        batch_bytes: int = batching.DEFAULT_BATCH_BYTES,
+    ):
+        self.console = console
+        self.decks = decks
+        self.ignore_keywords = ignore_keywords
+        self.plan = plan
+        self.build = build
+        self.index = index
+        self.report_rejected = report_rejected
+        self.report_refused = report_refused
+        self.force = force
+        self.jobs = max(1, jobs)
+        self.anki_concurrency = anki_concurrency
+        self.queue_size = queue_size
+        self.batch_notes = batch_notes
+        self.batch_bytes = batch_bytes
+
+        self.media = media.MediaSync()
+
+    def run(self) -> None:
+        asyncio.run(self.main())
+
+    async def main(self) -> None:
+        self.anki_slots = asyncio.Semaphore(self.anki_concurrency)
+        queues: dict[str, asyncio.Queue] = {
+            stage: asyncio.Queue(self.queue_size)
+            for stage in ["read", "render", "media", "notes", "done"]
+        }
+        executor: Executor = (
+            ProcessPoolExecutor(self.jobs)
+            if self.jobs > 1
+            else ThreadPoolExecutor(1, thread_name_prefix="render")
+        )
+
+        with Progress(
+            TextColumn("[bold]{task.description:<8}"),
+            TextColumn("{task.completed:>6.0f}"),
+            RateColumn(),
+            console=self.console,
+            transient=True,
+        ) as progress:
+            self.progress = progress
+            self.tasks = {
+                stage: progress.add_task(stage, total=None) for stage in STAGES
+            }
+
+            try:
+                async with asyncio.TaskGroup() as group:
+                    group.create_task(self.scan(queues["read"]))
+                    group.create_task(self.read(queues["read"], queues["render"]))
+                    group.create_task(
+                        self.render(queues["render"], queues["media"], executor)
+                    )
+                    group.create_task(self.sync_media(queues["media"], queues["notes"]))
+                    group.create_task(self.sync_notes(queues["notes"], queues["done"]))
+                    group.create_task(self.finish(queues["done"]))
+            finally:
+                executor.shutdown(cancel_futures=True)
+
+        if self.media.stats.references:
+            self.console.print(self.media.stats.summary())
+
+    def advance(self, stage: str) -> None:
+        self.progress.advance(self.tasks[stage])
+
+    def skip(self, file_path: str, e: Exception) -> None:
+        self.console.print(f"Error processing {os.path.basename(file_path)}: {e}")
+
+    async def scan(self, out: asyncio.Queue) -> None:
+        files = await asyncio.to_thread(scanner.scan, self.decks, self.ignore_keywords)
+        if not self.force:
+            files = scanner.changed(files, await asyncio.to_thread(self.index.stats))
+        for stage in STAGES:
+            self.progress.update(self.tasks[stage], total=len(files))
+        for scanned in files:
+            await out.put(scanned)
+            self.advance("scan")
+        await out.put(None)
+
+    async def read(self, inbox: asyncio.Queue, out: asyncio.Queue) -> None:
+        while (scanned := await inbox.get()) is not None:
+            try:
+                planned = await asyncio.to_thread(self.plan, scanned, self.force)
+                if planned is None:
+                    continue
+                tag, fields = planned
+            except ValueError as e:
+                self.skip(scanned.path, e)
+                continue
+            finally:
+                self.advance("read")
+            await out.put(
+                (Path(scanned.root), scanned.deck_path, scanned.path, tag, fields)
+            )
+        await out.put(None)
+
+    async def render(
+        self, inbox: asyncio.Queue, out: asyncio.Queue, executor: Executor
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        in_flight: set[asyncio.Task] = set()
+        slots = asyncio.Semaphore(self.jobs * 2)
+
+        async def render_one(root, deck_path, file_path, tag, fields) -> None:
+            try:
+                try:
+                    cards = await loop.run_in_executor(
+                        executor, parser.render_cards, fields, root
+                    )
+                    cards_payload, images = self.build(cards, deck_path, tag)
+                except ValueError as e:
+                    self.skip(file_path, e)
+                    return
+                finally:
+                    self.advance("render")
+                changes = self.index.changes(file_path, cards_payload)
+                await out.put((file_path, changes, images))
+            finally:
+                # only once passed on, so a full queue downstream stops rendering
+                slots.release()
+
+        def forget(task: asyncio.Task) -> None:
+            # failed tasks are kept for gather to raise their exception
+            if not task.cancelled() and task.exception() is None:
+                in_flight.discard(task)
+
+        while (item := await inbox.get()) is not None:
+            await slots.acquire()
+            task = asyncio.create_task(render_one(*item))
+            in_flight.add(task)
+            task.add_done_callback(forget)
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        await out.put(None)
+
+    async def sync_media(self, inbox: asyncio.Queue, out: asyncio.Queue) -> None:
+        while (item := await inbox.get()) is not None:
+            file_path, changes, images = item
+            new = self.media.add(images)
+            if new:
+                async with self.anki_slots:
+                    await asyncio.to_thread(self.media.upload, new)
+            self.advance("media")
+            await out.put((file_path, *changes))
+        await out.put(None)
+
+    async def sync_notes(self, inbox: asyncio.Queue, out: asyncio.Queue) -> None:
+        finished: list[tuple[str, list, Optional[anki.AnkiError]]] = []
+        batcher = batching.NoteBatcher(
+            lambda file_path, note_ids: finished.append((file_path, note_ids, None)),
+            lambda file_path, cards, e: finished.append((file_path, cards, e)),
+            max_notes=self.batch_notes,
+            max_bytes=self.batch_bytes,
+            autoflush=False,
+        )
+
+        async def send(flush_all: bool) -> None:
+            while batcher.buffer and (flush_all or batcher.full()):
+                async with self.anki_slots:
+                    await asyncio.to_thread(batcher.send_batch)
+                for result in finished:
+                    self.advance("notes")
+                    await out.put(result)
+                finished.clear()
+
+        while True:
+            try:
+                item = await asyncio.wait_for(inbox.get(), BATCH_LINGER)
+            except TimeoutError:
+                # upstream is slow, don't let buffered notes wait for a full batch
+                await send(flush_all=True)
+                continue
+            if item is None:
+                break
+            file_path, cards, updates, deletes = item
+            # only the local first fields index, asking Anki would cost a
+            # round-trip per file
+            refused = await asyncio.to_thread(
+                batching.preflight, [item], self.index, ask_anki=False
+            )
+            if file_path in refused:
+                self.report_refused(self.console, file_path, cards, refused[file_path])
+                cards = batching.without_refused(
+                    self.index, file_path, cards, refused[file_path]
+                )
+            batcher.add(file_path, cards, updates, deletes)
+            await send(flush_all=False)
+
+        await send(flush_all=True)
+        await out.put(None)
+
+    async def finish(self, inbox: asyncio.Queue) -> None:
+        while (item := await inbox.get()) is not None:
+            file_path, result, e = item
+            if e is None:
+                await asyncio.to_thread(self.index.done, file_path, result)
+            else:
+                await asyncio.to_thread(self.index.failed, file_path, e.result)
+                self.console.print(f"[bold red]Failed to import {file_path}[/bold red]")
+                self.report_rejected(self.console, result, e)
+            self.advance("done")
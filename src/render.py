@@ -0,0 +1,124 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import markdown
+from markdown.extensions import codehilite
+
+from highlight import CachedFencedCodeExtension
+from md_anki import AnkiFieldExtension, restore_spaces
+from md_mathjax import Md4MathjaxExtension
+
+
+# read by every --jobs worker process as well
+BACKEND_ENV = "MD_TO_ANKI_MARKDOWN"
+DEFAULT_BACKEND = "python-markdown"
+BACKENDS = ["python-markdown", "markdown-it"]
+
+
+class Renderer(ABC):
+    """Turns the Markdown of a field into HTML; ``render`` for whole notes and
+    ``render_field`` for card fields, with images pointed at their media files.
+
+    Renderers keep state between calls, use ``get_renderer`` for the instance of the
+    current thread.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def render(self, raw_string: str) -> str: ...
+
+    @abstractmethod
+    def render_field(
+        self, raw_string: str, media_root: Path
+    ) -> tuple[str, list[dict[str, str]], bool]:
+        """Returns field HTML, media to upload and whether raw HTML still needs processing"""
+
+    @abstractmethod
+    def settings(self) -> str:
+        """Library versions and configuration the HTML depends on"""
+
+
+class MarkdownRenderer(Renderer):
+    """Markdown pipeline built once and reset between fields.
+
+    A ``markdown.Markdown`` instance is not safe to share across threads, so use
+    ``get_renderer`` to obtain the instance belonging to the current thread.
+    """
+
+    name = "python-markdown"
+
+    def __init__(self) -> None:
+        self.field = AnkiFieldExtension()
+        self.md = markdown.Markdown(
+            extensions=[
+                codehilite.CodeHiliteExtension(),
+                CachedFencedCodeExtension(),
+                Md4MathjaxExtension(),
+                "nl2br",
+                self.field,
+            ],
+        )
+        # Markdown picks its serializer after extensions are registered
+        self.md.serializer = self.field.serialize
+
+    def render(self, raw_string: str) -> str:
+        self.field.active = False
+        self.md.reset()
+        return self.md.convert(raw_string.strip()).strip("\n")
+
+    def render_field(
+        self, raw_string: str, media_root: Path
+    ) -> tuple[str, list[dict[str, str]], bool]:
+        self.field.active = True
+        self.field.media_root = media_root
+        self.md.reset()
+        try:
+            s = self.md.convert(raw_string.strip()).strip("\n")
+        finally:
+            self.field.active = False
+        if not self.field.needs_soup:
+            s = restore_spaces(s)
+        return s, self.field.media, self.field.needs_soup
+
+    def settings(self) -> str:
+        configs = []
+        for extension in self.md.registeredExtensions:
+            config = repr(sorted(extension.getConfigs().items()))
+            configs.append(f"{type(extension).__name__}:{config}")
+        return f"markdown=={markdown.__version__}:" + ",".join(configs)
+
+
+_local = threading.local()
+
+
+def backend() -> str:
+    name = os.environ.get(BACKEND_ENV) or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown Markdown backend {name!r}, one of {BACKENDS}")
+    return name
+
+
+def use_backend(name: str) -> None:
+    """Renders with ``name`` from now on, in this process and the ones it starts"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown Markdown backend {name!r}, one of {BACKENDS}")
+    os.environ[BACKEND_ENV] = name
+
+
+def get_renderer() -> Renderer:
+    name = backend()
+    renderers = _local.__dict__.setdefault("renderers", {})
+    renderer = renderers.get(name)
+    if renderer is None:
+        if name == "markdown-it":
+            # markdown-it-py is only imported by those who render with it
+            from render_markdown_it import MarkdownItRenderer
+
+            renderer = MarkdownItRenderer()
+        else:
+            renderer = MarkdownRenderer()
+        renderers[name] = renderer
+    return renderer
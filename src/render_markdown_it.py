@@ -0,0 +1,324 @@
+import re
+from pathlib import Path
+from typing import Optional
+from xml.etree.ElementTree import Element, SubElement
+
+import markdown
+import markdown_it
+from markdown import util
+from markdown.extensions import codehilite
+from markdown.serializers import to_xhtml_string
+from markdown.treeprocessors import PrettifyTreeprocessor
+from markdown_it.rules_block import StateBlock, list_block, paragraph
+from markdown_it.rules_inline import StateInline
+from markdown_it.token import Token
+
+from highlight import HighlightCache, get_highlight_cache
+from md_anki.md_anki import (
+    ASCII_SPACES,
+    AnkiHtmlWriter,
+    CODEHILITE_PREFIX,
+    media_for_image,
+    normalize_text,
+    restore_spaces,
+)
+from md_mathjax.md_mathjax import MATH_PREFIXES, stash_math
+from render import Renderer
+
+# Obsidian writes ![](Pasted image 1.png), without the <> CommonMark asks for
+IMAGE_RE = re.compile(
+    r'!\[(?P<alt>[^\]\n]*)\]\((?P<src>[^)"\n]* [^)"\n]*?)(?:\s+"(?P<title>[^"\n]*)")?\s*\)'
+)
+# Markdown reads "#heading" as a heading, CommonMark wants a space after the #
+ATX_HEADING_RE = re.compile(r"(#{1,6})([^#\s].*?)#*$")
+# Markdown only knows ordered lists numbered "1."
+PAREN_ITEM_RE = re.compile(r"[0-9]+\)")
+PLACEHOLDER_RE = re.compile(
+    "(?:<p>)?" + util.HTML_PLACEHOLDER % r"([0-9]+)" + "(?:</p>)?"
+)
+BLOCK_HTML_RE = re.compile(r"^</?([^ >]+)")
+# Markdown expands tabs before parsing
+TAB_LENGTH = 4
+
+
+def backslash_newline(state: StateInline, silent: bool) -> bool:
+    """A backslash does not escape the end of a line in Markdown, it stays put"""
+    if not state.src.startswith("\\\n", state.pos):
+        return False
+    if not silent:
+        state.pending += "\\"
+    state.pos += 1
+    return True
+
+
+def image_with_spaces(state: StateInline, silent: bool) -> bool:
+    if not state.src.startswith("![", state.pos):
+        return False
+    m = IMAGE_RE.match(state.src, state.pos, state.posMax)
+    if m is None:
+        return False
+    if not silent:
+        token = state.push("image", "img", 0)
+        token.attrs = {"src": m.group("src").strip(), "alt": ""}
+        if m.group("title") is not None:
+            token.attrs["title"] = m.group("title")
+        token.children = [Token("text", "", 0, content=m.group("alt"))]
+    state.pos = m.end()
+    return True
+
+
+def newline(state: StateInline, silent: bool) -> bool:
+    """Line breaks as ``nl2br`` makes them, a hard break only takes its two spaces"""
+    pos = state.pos
+    if state.src[pos] != "\n":
+        return False
+
+    if not silent:
+        if state.pending.endswith("  "):
+            state.pending = state.pending[:-2]
+            state.push("hardbreak", "br", 0)
+        else:
+            state.push("softbreak", "br", 0)
+
+    # unlike CommonMark, Markdown keeps the indentation of the next line
+    state.pos = pos + 1
+    return True
+
+
+def list_after_blank_line(
+    state: StateBlock, start_line: int, end_line: int, silent: bool
+) -> bool:
+    """Python-Markdown only starts a list after a blank line, outside of lists"""
+    if silent and state.parentType == "paragraph" and state.blkIndent == 0:
+        return False
+    start = state.bMarks[start_line] + state.tShift[start_line]
+    if PAREN_ITEM_RE.match(state.src, start, state.eMarks[start_line]):
+        return False
+    return list_block(state, start_line, end_line, silent)
+
+
+def paragraph_with_trailing_spaces(
+    state: StateBlock, start_line: int, end_line: int, silent: bool
+) -> bool:
+    """Markdown only strips a paragraph where it starts, spaces at its end stay"""
+    if not paragraph(state, start_line, end_line, silent):
+        return False
+    inline = state.tokens[-2]
+    inline.content = state.getLines(
+        start_line, state.line, state.blkIndent, False
+    ).lstrip()
+    return True
+
+
+def heading_without_space(
+    state: StateBlock, start_line: int, end_line: int, silent: bool
+) -> bool:
+    if state.sCount[start_line] - state.blkIndent >= 4:
+        return False
+    start = state.bMarks[start_line] + state.tShift[start_line]
+    m = ATX_HEADING_RE.match(state.src, start, state.eMarks[start_line])
+    if m is None:
+        return False
+    if silent:
+        return True
+
+    state.line = start_line + 1
+    tag = f"h{len(m.group(1))}"
+    token = state.push("heading_open", tag, 1)
+    token.map = [start_line, state.line]
+    token = state.push("inline", "", 0)
+    token.content = m.group(2).strip()
+    token.map = [start_line, state.line]
+    token.children = []
+    state.push("heading_close", tag, -1)
+    return True
+
+
+class MarkdownItRenderer(Renderer):
+    """The dialect of ``MarkdownRenderer`` on the faster markdown-it-py parser.
+
+    Tokens are built into the element tree Python-Markdown would have produced, so
+    fields are serialized by the same ``AnkiHtmlWriter``. Differences that remain
+    are CommonMark's: nested lists may be indented by two spaces, link destinations
+    may hold quotes and emphasis nests where Markdown closes and reopens it.
+    """
+
+    name = "markdown-it"
+
+    def __init__(self, cache: Optional[HighlightCache] = None):
+        self.cache = cache
+        # entities stay apart from the text around them, as Markdown keeps them
+        self.md = markdown_it.MarkdownIt("commonmark", {"html": True}).disable(
+            "text_join"
+        )
+        # links are kept as written, Markdown does not percent-encode them
+        self.md.normalizeLink = lambda url: url  # type: ignore[method-assign]
+        self.md.inline.ruler.before("escape", "backslash_newline", backslash_newline)
+        self.md.inline.ruler.before("image", "image_with_spaces", image_with_spaces)
+        self.md.inline.ruler.at("newline", newline)
+        self.md.block.ruler.before(
+            "heading",
+            "heading_without_space",
+            heading_without_space,
+            {"alt": ["paragraph", "reference", "blockquote"]},
+        )
+        self.md.block.ruler.at("paragraph", paragraph_with_trailing_spaces)
+        self.md.block.ruler.at(
+            "list",
+            list_after_blank_line,
+            {"alt": ["paragraph", "reference", "blockquote"]},
+        )
+        # the options fenced code is highlighted with in MarkdownRenderer
+        self.codehilite = codehilite.CodeHiliteExtension().getConfigs()
+        # only asks Markdown which tags are block-level
+        self.prettify = PrettifyTreeprocessor(markdown.Markdown())
+
+        self.stash: list[str] = []
+        self.needs_soup = False
+
+    def settings(self) -> str:
+        options = sorted(self.md.options.items())
+        return f"markdown-it-py=={markdown_it.__version__}:{options}:{self.codehilite}"
+
+    def store(self, html: str) -> str:
+        self.stash.append(html)
+        return util.HTML_PLACEHOLDER % (len(self.stash) - 1)
+
+    def tree(self, raw_string: str) -> Element:
+        self.stash = []
+        self.needs_soup = False
+        root = Element("div")
+        stack = [root]
+        # math is stashed before parsing, as md_mathjax does
+        source = stash_math(raw_string.strip().expandtabs(TAB_LENGTH), self.store)
+        for token in self.md.parse(source):
+            parent = stack[-1]
+            if token.nesting == -1:
+                stack.pop()
+            elif token.type == "inline":
+                self.inline(token.children or [], parent)
+            elif token.type == "paragraph_open" and token.hidden:
+                # the items of tight lists hold their text directly
+                stack.append(parent)
+            elif token.type in ("fence", "code_block"):
+                lang = token.info.split()[0] if token.info.strip() else None
+                cache = self.cache or get_highlight_cache()
+                html = cache.highlight(token.content, lang, self.codehilite)
+                SubElement(parent, "p").text = self.store(html)
+            elif token.type == "html_block":
+                self.needs_soup = True
+                SubElement(parent, "p").text = self.store(token.content.rstrip("\n"))
+            elif token.nesting == 1:
+                # Python-Markdown numbers every ordered list from 1
+                stack.append(SubElement(parent, token.tag))
+            else:
+                SubElement(parent, token.tag)
+
+        self.prettify.run(root)
+        return root
+
+    def inline(self, tokens: list[Token], parent: Element) -> None:
+        stack = [parent]
+        for token in tokens:
+            parent = stack[-1]
+            if token.type == "text_special" and token.info == "entity":
+                append_text(parent, token.markup)
+            elif token.type in ("text", "text_special"):
+                append_text(parent, token.content.replace("&", "&amp;"))
+            elif token.type in ("softbreak", "hardbreak"):
+                SubElement(parent, "br")
+            elif token.type == "code_inline":
+                SubElement(parent, "code").text = util.code_escape(token.content)
+            elif token.type == "html_inline":
+                self.needs_soup = True
+                append_text(parent, self.store(token.content))
+            elif token.type == "image":
+                img = SubElement(parent, "img")
+                img.set("src", str(token.attrs["src"]))
+                img.set("alt", "".join(c.content for c in token.children or []))
+                if "title" in token.attrs:
+                    img.set("title", str(token.attrs["title"]))
+            elif token.nesting == 1:
+                element = SubElement(parent, token.tag)
+                for k, v in token.attrs.items():
+                    element.set(k, str(v).replace("&", "&amp;"))
+                stack.append(element)
+            elif token.nesting == -1:
+                element = stack.pop()
+                if element.tag == "em" and is_only_child(element, "strong"):
+                    # ***x*** is <strong><em>x</em></strong> in Python-Markdown
+                    element.tag, element[0].tag = "strong", "em"
+
+    def serialize(self, root: Element, writer: Optional[AnkiHtmlWriter]) -> str:
+        output = writer.serialize(root) if writer else to_xhtml_string(root)
+        if output.endswith("<div />"):
+            return ""
+        output = output[output.index("<div>") + 5 : output.rindex("</div>")].strip()
+
+        def restore(m: re.Match) -> str:
+            html = self.stash[int(m.group(1))]
+            if m.group(0).startswith("<p>") and m.group(0).endswith("</p>"):
+                tag = BLOCK_HTML_RE.match(html)
+                if tag is None or not markdown.Markdown.is_block_level(
+                    self.prettify.md, tag.group(1)
+                ):
+                    return f"<p>{html}</p>"
+            elif m.group(0).startswith("<p>"):
+                return "<p>" + html
+            elif m.group(0).endswith("</p>"):
+                return html + "</p>"
+            return html
+
+        if self.stash:
+            output = PLACEHOLDER_RE.sub(restore, output)
+        return output.strip()
+
+    def render(self, raw_string: str) -> str:
+        return self.serialize(self.tree(raw_string), None).strip("\n")
+
+    def render_field(
+        self, raw_string: str, media_root: Path
+    ) -> tuple[str, list[dict[str, str]], bool]:
+        root = self.tree(raw_string)
+        if self.needs_soup:
+            # raw HTML from the note itself, hand the output to BeautifulSoup instead
+            return self.serialize(root, None).strip("\n"), [], True
+
+        block_placeholders = {}
+        for i, html in enumerate(self.stash):
+            if html.startswith(CODEHILITE_PREFIX):
+                stripped = html.rstrip(ASCII_SPACES)
+                block_placeholders[util.HTML_PLACEHOLDER % i] = html[len(stripped) :]
+                self.stash[i] = stripped.replace("&quot;", '"').replace("&#39;", "'")
+            elif html.startswith(MATH_PREFIXES):
+                self.stash[i] = normalize_text(html)
+
+        media = []
+        for img in root.iter("img"):
+            entry, style = media_for_image(
+                img.get("src", ""), img.get("alt", ""), media_root
+            )
+            media.append(entry)
+            if style:
+                img.set("style", style)
+            img.set("src", entry["filename"])
+            img.set("alt", "")
+
+        html = self.serialize(root, AnkiHtmlWriter(block_placeholders))
+        return restore_spaces(html.strip("\n")), media, False
+
+
+def append_text(parent: Element, text: str) -> None:
+    if len(parent):
+        parent[-1].tail = (parent[-1].tail or "") + text
+    else:
+        parent.text = (parent.text or "") + text
+
+
+def is_only_child(element: Element, tag: str) -> bool:
+    return (
+        not element.text
+        and len(element) == 1
+        and element[0].tag == tag
+        and not element[0].tail
+    )
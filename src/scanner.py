@@ -0,0 +1,99 @@
+import os
+from typing import Collection, Iterable, Iterator
+
+
+class ScannedFile:
+    def __init__(
+        self, deck_path: str, deck_directory: str, path: str, stat: os.stat_result
+    ):
+        self.deck_path = deck_path
+        self.deck_directory = deck_directory
+        self.path = path
+        self.stat = stat
+
+    @property
+    def root(self) -> str:
+        return os.path.dirname(self.path)
+
+
+def scan_deck(
+    deck_path: str, deck_directory: str, ignore_keywords: Collection[str]
+) -> Iterator[ScannedFile]:
+    """Yields the notes of a deck directory in ``os.walk`` order.
+
+    Directories named in ``ignore_keywords`` are pruned with everything below them,
+    and a note's stat comes from its directory entry, so nothing is opened.
+    """
+    stack = [deck_directory]
+    while stack:
+        directory = stack.pop()
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in ignore_keywords:
+                        subdirectories.append(entry.path)
+                elif entry.name.endswith(".md") and not entry.name.startswith("_"):
+                    yield ScannedFile(
+                        deck_path, deck_directory, entry.path, entry.stat()
+                    )
+        stack.extend(reversed(subdirectories))
+
+
+def scan(decks: dict[str, str], ignore_keywords: Collection[str]) -> list[ScannedFile]:
+    return [
+        scanned
+        for deck_path, deck_directory in decks.items()
+        for scanned in scan_deck(deck_path, deck_directory, ignore_keywords)
+    ]
+
+
+def removed(
+    decks: dict[str, str], files: list[ScannedFile], synced: Iterable[str]
+) -> list[str]:
+    """The ``synced`` files of the deck directories that are gone from the disk"""
+    roots = [os.path.join(os.path.abspath(d), "") for d in decks.values()]
+    scanned = {os.path.abspath(f.path) for f in files}
+    return sorted(
+        path
+        for path in synced
+        if path not in scanned
+        and any(path.startswith(root) for root in roots)
+        and not os.path.exists(path)
+    )
+
+
+def scan_paths(
+    decks: dict[str, str], ignore_keywords: Collection[str], paths: Iterable[str]
+) -> list[ScannedFile]:
+    """The notes among ``paths`` that exist and would have been found by ``scan``"""
+    found = []
+    for path in sorted(set(paths)):
+        name = os.path.basename(path)
+        if not name.endswith(".md") or name.startswith("_"):
+            continue
+        for deck_path, deck_directory in decks.items():
+            relative = os.path.relpath(path, deck_directory)
+            if relative.startswith(os.pardir + os.sep):
+                continue
+            if any(part in ignore_keywords for part in relative.split(os.sep)[:-1]):
+                break
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                break
+            found.append(ScannedFile(deck_path, deck_directory, path, stat))
+            break
+    return found
+
+
+def changed(
+    files: list[ScannedFile], synced: dict[str, tuple[int, int]]
+) -> list[ScannedFile]:
+    """The files whose size or mtime differ from their last complete sync"""
+    return [
+        scanned
+        for scanned in files
+        if synced.get(os.path.abspath(scanned.path))
+        != (scanned.stat.st_size, scanned.stat.st_mtime_ns)
+    ]
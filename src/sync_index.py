@@ -0,0 +1,440 @@
+from __future__ import annotations
+
+import hashlib
+import html
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Sequence
+
+from utils import utils
+
+if TYPE_CHECKING:
+    # parser loads the whole rendering stack
+    from parser import RawCard
+
+# line older versions appended to a note after importing everything above it
+MARKER_RE = re.compile(r"^\*\*\*[ \t]*$", re.MULTILINE)
+HTML_TAG_RE = re.compile(r"<[^>]*>", re.DOTALL)
+
+
+def strip_markers(content: str) -> str:
+    """Blanks out ``***`` marker lines, keeping the cards on either side apart"""
+    return MARKER_RE.sub("", content)
+
+
+def card_hash(fields: RawCard) -> str:
+    """Hash of the text and extra of a card, what updateNoteFields would change"""
+    text, extra, _ = fields
+    return hashlib.sha1(f"{text}\0{extra}".encode("utf-8")).hexdigest()
+
+
+def first_field_hash(note: dict) -> str:
+    """Hash of the first field of a note as Anki compares it to find duplicates,
+    without HTML tags or surrounding whitespace"""
+    text = html.unescape(HTML_TAG_RE.sub("", note["fields"]["Text"])).strip()
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def blank_markers(lines: Iterable[str]) -> Iterator[str]:
+    """``strip_markers`` over the lines of a note"""
+    for line in lines:
+        yield "\n" if MARKER_RE.match(line.rstrip("\r\n")) else line
+
+
+class FileState:
+    """The cards of one file as split in this run, and what to send for them.
+
+    By default cards whose hash was imported before are skipped and every other
+    card is added (all of them with ``force``). With ``diff`` the previous cards
+    are aligned with the current ones instead: a card replacing an imported one
+    becomes an update of that note, and imported cards that are gone are deleted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stat: os.stat_result,
+        hashes: list[str],
+        previous: list[tuple[str, Optional[int]]],
+        force: bool = False,
+        diff: bool = False,
+    ):
+        self.path = path
+        self.stat = stat
+        self.hashes = hashes
+        self.known = dict(previous)
+        # raw fields of the cards in ``render``, filled in by ``SyncIndex.plan``
+        self.fields: list[RawCard] = []
+
+        self.new: list[int] = []
+        # (position, note ID) of cards whose note gets their new fields
+        self.updates: list[tuple[int, int]] = []
+        # index rows of imported cards that were removed from the file
+        self.removed: list[tuple[str, Optional[int]]] = []
+        # rows kept for a position when sending its card fails, or isn't needed
+        self.kept: dict[int, tuple[str, Optional[int]]] = {}
+        # (deck, first field hash) of the cards in ``render``, once rendered
+        self.first_fields: dict[int, tuple[str, str]] = {}
+
+        if diff:
+            self.align(previous)
+        else:
+            for position, digest in enumerate(hashes):
+                if digest in self.known:
+                    self.kept[position] = (digest, self.known[digest])
+                if force or digest not in self.known:
+                    self.new.append(position)
+
+    def align(self, previous: list[tuple[str, Optional[int]]]) -> None:
+        # only --diff needs it, not worth importing on every run
+        import difflib
+
+        matcher = difflib.SequenceMatcher(
+            None, [digest for digest, _ in previous], self.hashes, autojunk=False
+        )
+        blocks = []
+        # imported cards outside the matched runs, by hash, to find moved cards
+        unmatched: dict[str, list[int]] = {}
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == "equal":
+                for k in range(i2 - i1):
+                    self.kept[j1 + k] = previous[i1 + k]
+                continue
+            blocks.append((i1, i2, j1, j2))
+            for i in range(i1, i2):
+                unmatched.setdefault(previous[i][0], []).append(i)
+
+        moved: set[int] = set()
+        fresh: list[list[int]] = []
+        for _, _, j1, j2 in blocks:
+            fresh.append([])
+            for position in range(j1, j2):
+                rows = unmatched.get(self.hashes[position])
+                if rows:
+                    i = rows.pop(0)
+                    moved.add(i)
+                    self.kept[position] = previous[i]
+                elif self.hashes[position] in self.known:
+                    # a copy of a card already in Anki would be rejected as a duplicate
+                    self.kept[position] = (self.hashes[position], None)
+                else:
+                    fresh[-1].append(position)
+
+        for (i1, i2, _, _), positions in zip(blocks, fresh):
+            old = [previous[i] for i in range(i1, i2) if i not in moved]
+            for position in positions:
+                row = old.pop(0) if old else None
+                if row is not None and row[1] is not None:
+                    self.updates.append((position, row[1]))
+                    self.kept[position] = row
+                else:
+                    # migrated cards have no note ID to update
+                    self.new.append(position)
+            self.removed.extend(row for row in old if row[1] is not None)
+
+    @property
+    def render(self) -> list[int]:
+        """Positions of the cards whose fields are sent"""
+        return self.new + [position for position, _ in self.updates]
+
+    @property
+    def deletes(self) -> list[int]:
+        return [note_id for _, note_id in self.removed if note_id is not None]
+
+    def changes(self, cards: list[dict]) -> tuple[list[dict], list[dict], list[int]]:
+        """Splits the payload of the rendered cards into notes to add, notes to
+        update and the IDs of notes to delete"""
+        for position, card in zip(self.render, cards):
+            self.first_fields[position] = (card["deckName"], first_field_hash(card))
+        adds = cards[: len(self.new)]
+        updates = [
+            {"id": note_id, "fields": card["fields"]}
+            for (_, note_id), card in zip(self.updates, cards[len(self.new) :])
+        ]
+        return adds, updates, self.deletes
+
+    def skip(self, adds: Iterable[int]) -> None:
+        """Leaves out the notes at these indices of the adds, Anki would refuse them.
+
+        They are recorded like copies of imported cards, so the file can complete
+        and they are only sent again once edited.
+        """
+        for i in sorted(adds, reverse=True):
+            position = self.new.pop(i)
+            self.kept.setdefault(position, (self.hashes[position], None))
+
+    def first_field_rows(
+        self, results: Sequence[Optional[int]]
+    ) -> list[tuple[str, str, int]]:
+        """(deck, first field hash, note ID) of the notes Anki accepted"""
+        return [
+            (*self.first_fields[position], note_id)
+            for position, note_id in zip(self.render, results)
+            if note_id is not None and position in self.first_fields
+        ]
+
+    def synced(
+        self, results: Sequence[Optional[int]], complete: bool
+    ) -> list[tuple[str, Optional[int]]]:
+        """Index rows of every card in Anki, given the note IDs returned for the
+        rendered cards. None is a rejected card, or once every change was applied
+        a card Anki has without telling its note ID."""
+        sent = {
+            position: note_id
+            for position, note_id in zip(self.render, results)
+            if note_id is not None or complete
+        }
+        rows: list[tuple[str, Optional[int]]] = []
+        for position, digest in enumerate(self.hashes):
+            if sent.get(position) is not None:
+                rows.append((digest, sent[position]))
+            elif position in self.kept:
+                rows.append(self.kept[position])
+            elif position in sent:
+                rows.append((digest, None))
+        if not complete:
+            rows.extend(self.removed)
+        return rows
+
+
+class SyncIndex:
+    """What has been imported from each note, replacing ``***`` markers in the notes.
+
+    Cards are stored in order by file path and the hash of their raw fields, with the
+    Anki note ID they were imported as (``NULL`` for cards migrated from markers).
+    A file whose size and mtime match the last complete sync is not opened again.
+    """
+
+    def __init__(self, db_path: str | Path):
+        self.db_path = Path(db_path)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cards ("
+            "path TEXT, position INTEGER, digest TEXT, note_id INTEGER, "
+            "PRIMARY KEY (path, position))"
+        )
+        # first fields of the notes in Anki, to leave out likely duplicates
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS first_fields ("
+            "deck TEXT, digest TEXT, note_id INTEGER, PRIMARY KEY (deck, digest))"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS first_fields_note ON first_fields (note_id)"
+        )
+        self.db.commit()
+
+        # files planned in this run, waiting for the results of their notes
+        self.pending: dict[str, FileState] = {}
+
+    def unchanged(self, path: str, stat: os.stat_result) -> bool:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size, mtime_ns FROM files WHERE path = ?",
+                (os.path.abspath(path),),
+            ).fetchone()
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime_ns)
+
+    def stats(self) -> dict[str, tuple[int, int]]:
+        """(size, mtime_ns) of every file at its last complete sync"""
+        with self.lock:
+            return {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self.db.execute(
+                    "SELECT path, size, mtime_ns FROM files"
+                )
+            }
+
+    def paths(self) -> list[str]:
+        """Every file with cards or a complete sync in the index"""
+        with self.lock:
+            return [
+                path
+                for (path,) in self.db.execute(
+                    "SELECT path FROM files UNION SELECT path FROM cards"
+                )
+            ]
+
+    def forget(self, paths: Iterable[str]) -> None:
+        """Drops files whose notes were deleted from Anki"""
+        keys = [(os.path.abspath(path),) for path in paths]
+        with self.lock:
+            self.db.executemany(
+                "DELETE FROM first_fields WHERE note_id IN "
+                "(SELECT note_id FROM cards WHERE path = ?)",
+                keys,
+            )
+            self.db.executemany("DELETE FROM cards WHERE path = ?", keys)
+            self.db.executemany("DELETE FROM files WHERE path = ?", keys)
+            self.db.commit()
+
+    def rows(self, path: str) -> list[tuple[str, Optional[int]]]:
+        """Hashes of the imported cards of a file in order, with their note IDs"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT digest, note_id FROM cards WHERE path = ? ORDER BY position",
+                (os.path.abspath(path),),
+            ).fetchall()
+
+    def cards(self, path: str) -> dict[str, Optional[int]]:
+        return dict(self.rows(path))
+
+    def plan(
+        self,
+        path: str,
+        stat: os.stat_result,
+        cards: Iterable[RawCard],
+        force: bool = False,
+        diff: bool = False,
+    ) -> FileState:
+        """Decides what to send for the cards of a file, consuming them one at a time.
+
+        Only the raw fields of cards that may be sent are kept, so planning a long
+        note that is mostly imported already holds little more than its hashes.
+        """
+        previous = self.rows(path)
+        known = {digest for digest, _ in previous}
+        hashes = []
+        fields: dict[int, RawCard] = {}
+        for position, card in enumerate(cards):
+            digest = card_hash(card)
+            hashes.append(digest)
+            if force or digest not in known:
+                fields[position] = card
+
+        state = FileState(path, stat, hashes, previous, force=force, diff=diff)
+        state.fields = [fields[position] for position in state.render]
+        with self.lock:
+            self.pending[os.path.abspath(path)] = state
+        return state
+
+    def changes(
+        self, path: str, cards: list[dict]
+    ) -> tuple[list[dict], list[dict], list[int]]:
+        """Notes to add, notes to update and notes to delete for a planned file"""
+        with self.lock:
+            return self.pending[os.path.abspath(path)].changes(cards)
+
+    def skip(self, path: str, adds: Iterable[int]) -> None:
+        """Leaves notes Anki would refuse out of the adds of a planned file"""
+        with self.lock:
+            self.pending[os.path.abspath(path)].skip(adds)
+
+    def duplicates(self, notes: list[dict]) -> list[bool]:
+        """Whether each note repeats the first field of a note synced to its deck,
+        or of an earlier one of these notes. Only notes sent with ``allowDuplicate``
+        off are checked."""
+        keys = [(note["deckName"], first_field_hash(note)) for note in notes]
+        with self.lock:
+            seen = {
+                (deck, digest)
+                for deck in {deck for deck, _ in keys}
+                for (digest,) in self.db.execute(
+                    "SELECT digest FROM first_fields WHERE deck = ?", (deck,)
+                )
+            }
+        duplicates = []
+        for note, key in zip(notes, keys):
+            if (note.get("options") or {}).get("allowDuplicate", True):
+                duplicates.append(False)
+                continue
+            duplicates.append(key in seen)
+            seen.add(key)
+        return duplicates
+
+    def done(self, path: str, note_ids: list[int]) -> None:
+        """Records a file whose changes were all applied"""
+        self.record(path, note_ids, complete=True)
+
+    def failed(self, path: str, results: Optional[list]) -> None:
+        """Records the changes Anki accepted; the file is read again next run"""
+        self.record(path, results or [], complete=False)
+
+    def record(
+        self, path: str, results: Sequence[Optional[int]], complete: bool
+    ) -> None:
+        key = os.path.abspath(path)
+        with self.lock:
+            state = self.pending.pop(key, None)
+            if state is None:
+                return
+            rows = state.first_field_rows(results)
+            # an updated note may have a new first field
+            self.db.executemany(
+                "DELETE FROM first_fields WHERE note_id = ?",
+                ((note_id,) for *_, note_id in rows),
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO first_fields VALUES (?, ?, ?)", rows
+            )
+            if complete:
+                self.db.executemany(
+                    "DELETE FROM first_fields WHERE note_id = ?",
+                    ((note_id,) for note_id in state.deletes),
+                )
+            self.write(
+                key,
+                state.synced(results, complete),
+                state.stat if complete else None,
+            )
+
+    def write(
+        self,
+        key: str,
+        rows: list[tuple[str, Optional[int]]],
+        stat: Optional[os.stat_result],
+    ) -> None:
+        self.db.execute("DELETE FROM cards WHERE path = ?", (key,))
+        self.db.executemany(
+            "INSERT INTO cards VALUES (?, ?, ?, ?)",
+            (
+                (key, position, digest, note_id)
+                for position, (digest, note_id) in enumerate(rows)
+            ),
+        )
+        if stat is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (key, stat.st_size, stat.st_mtime_ns),
+            )
+        else:
+            self.db.execute("DELETE FROM files WHERE path = ?", (key,))
+        self.db.commit()
+
+    def migrate(
+        self,
+        path: str,
+        stat: os.stat_result,
+        fields: list[RawCard],
+        imported: int,
+        complete: bool,
+    ) -> None:
+        """Records the first ``imported`` cards of a file as already in Anki"""
+        key = os.path.abspath(path)
+        with self.lock:
+            known = dict(
+                self.db.execute(
+                    "SELECT digest, note_id FROM cards WHERE path = ?", (key,)
+                ).fetchall()
+            )
+            rows = []
+            for f in fields[:imported]:
+                digest = card_hash(f)
+                rows.append((digest, known.get(digest)))
+            self.write(key, rows, stat if complete else None)
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+def default_path() -> Path:
+    return utils.data_dir() / "sync-index.sqlite3"
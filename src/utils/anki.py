@@ -1,6 +1,15 @@
+from __future__ import annotations
+
 import json
-import socket
-import urllib.request
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from utils import profile
+
+if TYPE_CHECKING:
+    # imported by the first request, a run with nothing to sync never needs it
+    import http.client
 
 
 class AnkiError(Exception):
@@ -9,24 +18,258 @@ class AnkiError(Exception):
         self.result = result
 
 
+NOT_RUNNING = "AnkiConnect is not running. Please start Anki and try again."
+
+# defaults for every client, see configure()
+settings = {
+    "host": "localhost",
+    "port": 8765,
+    "connect_timeout": 3.0,
+    "read_timeout": 120.0,
+    "retries": 3,
+    "backoff": 0.2,
+}
+
+# set once a connection is refused so the rest of the run fails fast, see reconnect()
+_not_running = threading.Event()
+
+
 def request(action, **params):
     return {"action": action, "params": params, "version": 6}
 
 
-def invoke(action, **params):
-    request_json = json.dumps(request(action, **params)).encode("utf-8")
+# actions that change nothing in Anki, or nothing more when applied twice
+REPEATABLE_ACTIONS = frozenset(
+    {
+        "version",
+        "canAddNotes",
+        "canAddNotesWithErrorDetail",
+        "findNotes",
+        "notesInfo",
+        "getMediaFilesNames",
+        "storeMediaFile",
+        "updateNoteFields",
+    }
+)
+
+
+def repeatable(action: str, params: dict) -> bool:
+    """Whether a request that may have reached Anki can safely be sent again"""
+    if action == "multi":
+        return all(
+            repeatable(a.get("action", ""), a.get("params", {}))
+            for a in params.get("actions", [])
+        )
+    return action in REPEATABLE_ACTIONS
+
+
+_encoder = json.JSONEncoder()
+# bytes of JSON joined into each piece of a request body
+CHUNK_BYTES = 64 * 1024
+# objects encoding to at most this many characters are encoded once per request
+SHARED_MAX_CHARS = 512
+
+
+class RequestBody:
+    """The JSON of a request, encoded one note at a time into chunks of about
+    ``CHUNK_BYTES``.
+
+    A large addNotes or multi batch is never held as one string and one bytes copy
+    next to its dicts. Small objects that notes share, like the options of a deck,
+    are encoded once per request. The bytes are those of ``json.dumps``.
+    """
+
+    def __init__(self, payload: dict):
+        self.chunks: list[bytes] = []
+        self.length = 0
+        self.pending: list[str] = []
+        self.pending_chars = 0
+        self.memo: dict[int, str] = {}
+        self.encode(payload)
+        self.flush()
+        # ids are only meaningful while the payload is alive
+        self.memo.clear()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.chunks)
+
+    def __bytes__(self) -> bytes:
+        return b"".join(self.chunks)
+
+    def emit(self, text: str) -> None:
+        self.pending.append(text)
+        self.pending_chars += len(text)
+
+    def flush(self) -> None:
+        if self.pending:
+            # ASCII only, as json.dumps escapes everything else
+            chunk = "".join(self.pending).encode("ascii")
+            self.chunks.append(chunk)
+            self.length += len(chunk)
+            self.pending.clear()
+            self.pending_chars = 0
+
+    def encode(self, value: Any) -> None:
+        if not isinstance(value, (dict, list)):
+            self.emit(_encoder.encode(value))
+            return
+        key = id(value)
+        if key in self.memo:
+            self.emit(self.memo[key])
+            return
+
+        items = value.values() if isinstance(value, dict) else value
+        if not any(isinstance(item, (dict, list)) for item in items):
+            # no nesting, the C encoder does it in one go
+            text = _encoder.encode(value)
+        else:
+            start = len(self.pending)
+            chunks = len(self.chunks)
+            self.encode_items(value)
+            if len(self.chunks) != chunks:
+                return
+            text = "".join(self.pending[start:])
+            del self.pending[start:]
+            self.pending_chars -= len(text)
+        if len(text) <= SHARED_MAX_CHARS:
+            self.memo[key] = text
+        self.emit(text)
+
+    def encode_items(self, value: dict | list) -> None:
+        if isinstance(value, dict):
+            self.emit("{")
+            for i, (k, v) in enumerate(value.items()):
+                self.emit(
+                    f", {_encoder.encode(k)}: " if i else f"{_encoder.encode(k)}: "
+                )
+                self.encode(v)
+            self.emit("}")
+            return
+
+        self.emit("[")
+        for i, item in enumerate(value):
+            if i:
+                self.emit(", ")
+            self.encode(item)
+            if self.pending_chars >= CHUNK_BYTES:
+                self.flush()
+        self.emit("]")
+
+
+class AnkiClient:
+    """HTTP/1.1 keep-alive connection to AnkiConnect.
+
+    A kept connection that Anki closed while idle is replaced before sending.
+    Transient connection failures are retried with exponential backoff, once the
+    request is sent only for ``repeatable`` requests: adding notes twice would
+    create them twice. Timeouts are not retried, since the request may already
+    have been applied.
+    """
 
-    a_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        connect_timeout: float,
+        read_timeout: float,
+        retries: int,
+        backoff: float,
+    ):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
 
-    location = ("localhost", 8765)
-    result_of_check = a_socket.connect_ex(location)
+        self.conn: Optional[http.client.HTTPConnection] = None
+        self.requests = 0
 
-    if result_of_check == 0:
-        response = json.load(
-            urllib.request.urlopen(
-                urllib.request.Request("http://localhost:8765", request_json)
-            )
+    def connect(self) -> http.client.HTTPConnection:
+        import http.client
+        import socket
+
+        conn = http.client.HTTPConnection(
+            self.host, self.port, timeout=self.connect_timeout
         )
+        conn.connect()
+        assert conn.sock is not None
+        conn.sock.settimeout(self.read_timeout)
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def stale(self) -> bool:
+        """Whether the kept connection was closed: an idle one has nothing to read"""
+        import select
+
+        assert self.conn is not None
+        if self.conn.sock is None:
+            return True
+        readable, _, _ = select.select([self.conn.sock], [], [], 0)
+        return bool(readable)
+
+    def post(self, body: bytes | RequestBody, repeatable: bool = True) -> bytes:
+        import http.client
+
+        if _not_running.is_set():
+            raise AnkiError(NOT_RUNNING, [])
+
+        attempt = 0
+        while True:
+            sent = False
+            try:
+                if self.conn is not None and self.stale():
+                    self.close()
+                if self.conn is None:
+                    self.conn = self.connect()
+                self.conn.request(
+                    "POST",
+                    "/",
+                    body,
+                    {
+                        "Content-Type": "application/json",
+                        "Content-Length": str(len(body)),
+                    },
+                )
+                sent = True
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self.close()
+                self.requests += 1
+                return data
+            except ConnectionRefusedError:
+                self.close()
+                if attempt >= self.retries:
+                    _not_running.set()
+                    raise AnkiError(NOT_RUNNING, [])
+            except TimeoutError as e:
+                self.close()
+                raise AnkiError(f"AnkiConnect did not answer in time: {e}", [])
+            except (ConnectionError, http.client.HTTPException) as e:
+                self.close()
+                if attempt >= self.retries or (sent and not repeatable):
+                    raise AnkiError(f"AnkiConnect request failed: {e}", [])
+
+            profile.count("anki retries")
+            time.sleep(self.backoff * 2**attempt)
+            attempt += 1
+
+    def invoke(self, action, **params):
+        body = RequestBody(request(action, **params))
+        profile.count("anki bytes sent", len(body))
+        with profile.span("anki", action=action):
+            # small requests go out with their headers in one packet
+            data = body.chunks[0] if len(body.chunks) == 1 else body
+            response = json.loads(self.post(data, repeatable(action, params)))
 
         if len(response) != 2:
             raise ValueError("response has an unexpected number of fields")
@@ -38,10 +281,59 @@ def invoke(action, **params):
             raise AnkiError(response["error"], response["result"])
 
         return response["result"]
-    else:
-        raise AnkiError(
-            "AnkiConnect is not running. Please start Anki and try again.", []
-        )
+
+
+_local = threading.local()
+
+
+def configure(**kwargs) -> None:
+    """Changes the settings used by clients created from now on"""
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise TypeError(f"unknown AnkiConnect settings: {', '.join(sorted(unknown))}")
+    settings.update(kwargs)
+    _not_running.clear()
+    reset_client()
+
+
+def reconnect() -> None:
+    """Lets the next request try Anki again, after one found it not running"""
+    _not_running.clear()
+
+
+def get_client() -> AnkiClient:
+    """The current thread's client; connections can't be shared between threads"""
+    client = getattr(_local, "client", None)
+    if client is None:
+        client = AnkiClient(**settings)  # type: ignore[arg-type]
+        _local.client = client
+    return client
+
+
+def reset_client() -> None:
+    client = getattr(_local, "client", None)
+    if client is not None:
+        client.close()
+        _local.client = None
+
+
+def invoke(action, **params):
+    return get_client().invoke(action, **params)
+
+
+def multi(actions: list[dict]) -> list:
+    """Runs several actions in one round-trip, raising if any of them failed"""
+    results = invoke("multi", actions=actions)
+
+    errors = [r["error"] for r in results if r["error"] is not None]
+    if errors:
+        raise AnkiError(errors, [r["result"] for r in results])
+
+    return [r["result"] for r in results]
+
+
+def get_media_file_names(pattern: str = "*") -> list[str]:
+    return invoke("getMediaFilesNames", pattern=pattern)
 
 
 def send_notes(notes) -> None:
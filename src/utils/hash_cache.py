@@ -0,0 +1,190 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from utils import profile
+from utils import utils
+
+# roughly 150 bytes per entry on disk
+DEFAULT_MAX_ENTRIES = 200_000
+
+
+class HashCache:
+    """Content hashes of media files, keyed by (path, size, mtime_ns, inode).
+
+    A file whose stat matches its stored entry is never read again. Lookups are
+    also memoized for the lifetime of the cache, so an image referenced by many
+    cards is stat-ed once per run. Least recently used entries are evicted once
+    the cache holds more than ``max_entries``.
+    """
+
+    def __init__(self, db_path: str | Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "digest TEXT, last_used INTEGER)"
+        )
+        self.db.commit()
+
+        self.run_started = int(time.time())
+        self.memo: dict[str, str] = {}
+        self.touched: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, path: str | Path) -> str:
+        key = os.path.abspath(path)
+        with self.lock:
+            digest = self.memo.get(key)
+            if digest is not None:
+                return digest
+
+            stat = os.stat(key)
+            row = self.db.execute(
+                "SELECT size, mtime_ns, inode, digest FROM hashes WHERE path = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and tuple(row[:3]) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+            ):
+                digest = row[3]
+                self.touched.add(key)
+                self.hits += 1
+            else:
+                digest = utils.hash_file(key)
+                self.store(key, stat, digest)
+                self.misses += 1
+
+            self.memo[key] = digest
+            return digest
+
+    def forget(self, path: str | Path) -> None:
+        """Drops the memoized digest so the next lookup checks the file again"""
+        with self.lock:
+            self.memo.pop(os.path.abspath(path), None)
+
+    def forget_all(self) -> None:
+        with self.lock:
+            self.memo.clear()
+
+    def store(self, key: str, stat: os.stat_result, digest: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                digest,
+                self.run_started,
+            ),
+        )
+        self.db.commit()
+
+    def verify(self, rebuild: bool = False) -> dict[str, int]:
+        """Rehashes every entry, reporting (and with ``rebuild`` fixing) stale ones"""
+        counts = {"ok": 0, "stale": 0, "corrupt": 0, "missing": 0}
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, size, mtime_ns, inode, digest FROM hashes"
+            ).fetchall()
+            for path, size, mtime_ns, inode, digest in rows:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    counts["missing"] += 1
+                    if rebuild:
+                        self.db.execute("DELETE FROM hashes WHERE path = ?", (path,))
+                    continue
+
+                actual = utils.hash_file(path)
+                if (stat.st_size, stat.st_mtime_ns, stat.st_ino) != (
+                    size,
+                    mtime_ns,
+                    inode,
+                ):
+                    counts["stale"] += 1
+                elif actual != digest:
+                    # same stat but different content: the entry can't be trusted
+                    counts["corrupt"] += 1
+                else:
+                    counts["ok"] += 1
+                    continue
+
+                if rebuild:
+                    self.store(path, stat, actual)
+
+            self.memo.clear()
+            self.db.commit()
+        return counts
+
+    def clear(self) -> None:
+        with self.lock:
+            self.db.execute("DELETE FROM hashes")
+            self.db.commit()
+            self.memo.clear()
+
+    def evict(self) -> int:
+        """Removes least recently used entries above ``max_entries``"""
+        count = self.db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        self.db.execute(
+            "DELETE FROM hashes WHERE path IN "
+            "(SELECT path FROM hashes ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        )
+        return excess
+
+    def close(self) -> None:
+        with self.lock:
+            if self.touched:
+                self.db.executemany(
+                    "UPDATE hashes SET last_used = ? WHERE path = ?",
+                    ((self.run_started, path) for path in self.touched),
+                )
+                self.touched.clear()
+            self.evict()
+            self.db.commit()
+            self.db.close()
+
+
+_default: Optional[HashCache] = None
+_default_lock = threading.Lock()
+
+
+def get_hash_cache() -> HashCache:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HashCache(utils.cache_dir() / "media-hashes.sqlite3")
+            atexit.register(_default.close)
+        return _default
+
+
+def _forget_default() -> None:
+    # a SQLite connection must not be used on both sides of a fork
+    global _default
+    _default = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_default)
+
+
+def hash_file(path: str | Path) -> str:
+    """Cached ``utils.hash_file``"""
+    with profile.span("hash_file"):
+        return get_hash_cache().digest(path)
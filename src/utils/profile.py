@@ -0,0 +1,148 @@
+"""Timers and counters for ``--profile``.
+
+Nothing is recorded until ``enable`` is called: ``span`` then returns one shared
+no-op context manager and ``count`` returns at once, so instrumented code pays for a
+global lookup and a call. Spans recorded in worker processes (``--jobs``) are lost.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, ContextManager, Optional
+
+_NOOP = contextlib.nullcontext()
+
+
+class Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler: "Profiler", name: str, args: dict[str, Any]):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        end = time.perf_counter_ns()
+        self.profiler.add(self.name, self.start, end - self.start, self.args)
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.started = time.perf_counter_ns()
+        self.lock = threading.Lock()
+        # (name, start, duration, thread, args), times in nanoseconds
+        self.events: list[tuple[str, int, int, int, dict[str, Any]]] = []
+        self.counters: collections.Counter[str] = collections.Counter()
+
+    def add(self, name: str, start: int, duration: int, args: dict[str, Any]) -> None:
+        event = (name, start, duration, threading.get_native_id(), args)
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, name: str, n: int) -> None:
+        with self.lock:
+            self.counters[name] += n
+
+    def wall(self) -> int:
+        return time.perf_counter_ns() - self.started
+
+    def stages(self) -> list[dict[str, Any]]:
+        """Calls and time of each span name, by total time; spans include nested ones"""
+        totals: dict[str, list[int]] = {}
+        for name, _, duration, _, _ in self.events:
+            calls_total_max = totals.setdefault(name, [0, 0, 0])
+            calls_total_max[0] += 1
+            calls_total_max[1] += duration
+            calls_total_max[2] = max(calls_total_max[2], duration)
+        stages = [
+            {
+                "name": name,
+                "calls": calls,
+                "total_ms": total / 1e6,
+                "mean_ms": total / calls / 1e6,
+                "max_ms": longest / 1e6,
+            }
+            for name, (calls, total, longest) in totals.items()
+        ]
+        return sorted(stages, key=lambda s: s["total_ms"], reverse=True)
+
+    def slowest(self, name: str, limit: int) -> list[dict[str, Any]]:
+        spans = [
+            (duration, args) for n, _, duration, _, args in self.events if n == name
+        ]
+        spans.sort(key=lambda span: span[0], reverse=True)
+        return [{"ms": duration / 1e6, **args} for duration, args in spans[:limit]]
+
+    def report(self, limit: int = 10) -> dict[str, Any]:
+        return {
+            "wall_ms": self.wall() / 1e6,
+            "stages": self.stages(),
+            "counters": dict(self.counters),
+            # the pipeline reads files in threads but has no span per whole file
+            "slowest_files": self.slowest("file", limit) or self.slowest("read", limit),
+            "slowest_cards": self.slowest("card", limit),
+        }
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """The spans in the Trace Event Format of chrome://tracing and Perfetto"""
+        pid = os.getpid()
+        events: list[dict[str, Any]] = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.started) / 1e3,
+                "dur": duration / 1e3,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+            for name, start, duration, tid, args in self.events
+        ]
+        end = self.wall() / 1e3
+        for name, value in self.counters.items():
+            events.append(
+                {"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}}
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str | Path, chrome: bool = True) -> None:
+        data = self.chrome_trace() if chrome else self.report(limit=100)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    """Stops recording and returns what was recorded"""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def span(name: str, **args: Any) -> ContextManager:
+    """Times the ``with`` block, ``args`` show up in the report and the trace"""
+    if _profiler is None:
+        return _NOOP
+    return Span(_profiler, name, args)
+
+
+def count(name: str, n: int = 1) -> None:
+    if _profiler is not None:
+        _profiler.count(name, n)
@@ -6,6 +6,26 @@ from pathlib import Path
 BUFF_SIZE = 65536
 
 
+def cache_dir() -> Path:
+    """Directory for caches persisted between runs, ``$MD_TO_ANKI_CACHE_DIR`` if set"""
+    path = Path(
+        os.environ.get("MD_TO_ANKI_CACHE_DIR", Path.home() / ".cache" / "md-to-anki")
+    )
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def data_dir() -> Path:
+    """Directory for state that must survive between runs, ``$MD_TO_ANKI_DATA_DIR`` if set"""
+    path = Path(
+        os.environ.get(
+            "MD_TO_ANKI_DATA_DIR", Path.home() / ".local" / "share" / "md-to-anki"
+        )
+    )
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
 def hash_file(path: str | Path) -> str:
     sha1 = hashlib.sha1()
     with open(path, "rb") as f:
@@ -0,0 +1,187 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import Collection, Optional
+
+import scanner
+
+# quiet time after the last event before a burst of saves is synced
+DEBOUNCE = 0.05
+POLL_INTERVAL = 0.5
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# a note is complete once it is closed after writing or moved into place
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT = struct.Struct("iIII")
+
+
+class Watcher(ABC):
+    name = "none"
+
+    @abstractmethod
+    def changes(self, timeout: Optional[float]) -> Optional[set[str]]:
+        """Paths changed since the last call, waiting up to ``timeout`` for one.
+
+        None means events were lost and anything may have changed.
+        """
+
+    def wait(self, debounce: float = DEBOUNCE) -> Optional[set[str]]:
+        """Blocks until something changes, then until saves stop for ``debounce``"""
+        paths = self.changes(None)
+        while True:
+            more = self.changes(debounce)
+            if more is not None and not more:
+                return paths
+            if paths is None or more is None:
+                paths = None
+            else:
+                paths |= more
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher(Watcher):
+    """Watches every directory of the decks with inotify, through ctypes"""
+
+    name = "inotify"
+
+    def __init__(self, decks: dict[str, str], ignore_keywords: Collection[str]):
+        self.ignore_keywords = ignore_keywords
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.directories: dict[int, str] = {}
+        try:
+            for deck_directory in decks.values():
+                self.add_tree(deck_directory)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, directory: str) -> list[str]:
+        """Watches a directory and its subdirectories, returning the files in them"""
+        files = []
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC: raise fs.inotify.max_user_watches, or fall back to polling
+                raise OSError(ctypes.get_errno(), f"cannot watch {current}")
+            self.directories[wd] = current
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in self.ignore_keywords:
+                            stack.append(entry.path)
+                    else:
+                        files.append(entry.path)
+        return files
+
+    def changes(self, timeout: Optional[float]) -> Optional[set[str]]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        paths: set[str] = set()
+        lost = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    lost = True
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if name not in self.ignore_keywords:
+                        # notes may have been written before the watch was added
+                        paths.update(self.add_tree(path))
+                elif not mask & IN_CREATE:
+                    paths.add(path)
+
+        return None if lost else paths
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher(Watcher):
+    """Rescans the decks every ``interval`` seconds, comparing stats"""
+
+    name = "polling"
+
+    def __init__(
+        self,
+        decks: dict[str, str],
+        ignore_keywords: Collection[str],
+        interval: float = POLL_INTERVAL,
+    ):
+        self.decks = decks
+        self.ignore_keywords = ignore_keywords
+        self.interval = interval
+        self.stats = self.snapshot()
+
+    def snapshot(self) -> dict[str, tuple[int, int]]:
+        return {
+            scanned.path: (scanned.stat.st_size, scanned.stat.st_mtime_ns)
+            for scanned in scanner.scan(self.decks, self.ignore_keywords)
+        }
+
+    def changes(self, timeout: Optional[float]) -> Optional[set[str]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self.snapshot()
+            paths = {
+                path for path, stat in stats.items() if self.stats.get(path) != stat
+            }
+            self.stats = stats
+            if paths:
+                return paths
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+
+def open_watcher(decks: dict[str, str], ignore_keywords: Collection[str]) -> Watcher:
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(decks, ignore_keywords)
+        except (OSError, AttributeError):
+            # no inotify in this libc, or too many directories to watch
+            pass
+    return PollingWatcher(decks, ignore_keywords)
@@ -1,8 +1,21 @@
+import os
+import sys
+import tempfile
+
 import pytest
 from pathlib import Path
 import json
 
-test_case_directory = Path('fixtures')
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+# keep persistent caches out of the user's cache directory
+os.environ["MD_TO_ANKI_CACHE_DIR"] = tempfile.mkdtemp(prefix="md-to-anki-tests-")
+os.environ["MD_TO_ANKI_DATA_DIR"] = tempfile.mkdtemp(prefix="md-to-anki-tests-")
+
+# interactive fixture generator, not a test module
+collect_ignore = ["utils/create_test.py"]
+
+test_case_directory = Path(__file__).parent / 'fixtures'
 test_case_paths = [x for x in test_case_directory.iterdir() if x.is_dir()]
 test_case_names = [path.name for path in test_case_paths]
 
@@ -12,4 +25,4 @@ def test_data(request: pytest.FixtureRequest):
     test_case_directory = request.param
     given_contents = (test_case_directory / 'input.md').read_text()
     expected_contents = (test_case_directory / 'expected.json').read_text()
-    return given_contents, json.loads(expected_contents)
\ No newline at end of file
+    return given_contents, json.loads(expected_contents)
@@ -0,0 +1,130 @@
+import json
+import socket
+import time
+
+import pytest
+
+from benchmarks.fake_anki import FakeAnki
+from utils import anki
+
+
+@pytest.fixture
+def fake():
+    with FakeAnki() as fake:
+        anki.configure(host="127.0.0.1", port=fake.port, backoff=0.001)
+        yield fake
+    anki.configure(host="localhost", port=8765, backoff=0.2)
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_requests_share_one_connection(fake):
+    for _ in range(5):
+        assert anki.invoke("version") == 6
+
+    assert fake.requests == 5
+    assert fake.connections == 1
+
+
+def test_dropped_connection_is_retried(fake):
+    assert anki.invoke("version") == 6
+    # simulate Anki closing an idle keep-alive connection
+    client = anki.get_client()
+    assert client.conn is not None and client.conn.sock is not None
+    client.conn.sock.shutdown(socket.SHUT_RDWR)
+
+    assert anki.invoke("version") == 6
+
+
+def test_not_running_is_detected_once():
+    anki.configure(host="127.0.0.1", port=unused_port(), retries=1, backoff=0.001)
+    try:
+        with pytest.raises(anki.AnkiError, match="not running"):
+            anki.invoke("version")
+
+        start = time.perf_counter()
+        with pytest.raises(anki.AnkiError, match="not running"):
+            anki.invoke("version")
+        assert time.perf_counter() - start < 0.001
+    finally:
+        anki.configure(host="localhost", port=8765, retries=3, backoff=0.2)
+
+
+def test_action_errors_raise_anki_error(fake):
+    with pytest.raises(anki.AnkiError) as e:
+        anki.invoke("noSuchAction")
+    assert "unsupported action" in e.value.e
+
+
+def test_large_requests_are_sent_in_chunks(fake):
+    options = {"allowDuplicate": False, "duplicateScope": "deck"}
+    notes = [
+        {
+            "deckName": "deck",
+            "modelName": "cloze",
+            "fields": {"Text": f"{{{{c1::{i}}}}} é" + "x" * 500, "Extra": ""},
+            "tags": ["#tag"],
+            "options": options,
+        }
+        for i in range(500)
+    ]
+    payload = anki.request("addNotes", notes=notes)
+    body = anki.RequestBody(payload)
+    assert len(body.chunks) > 1
+    assert bytes(body) == json.dumps(payload).encode("utf-8")
+
+    assert len(anki.invoke("addNotes", notes=notes)) == 500
+    assert fake.bytes_received == len(body)
+
+
+def test_changes_are_not_sent_again_once_sent():
+    fake = FakeAnki(drop_rate=1.0).start()
+    anki.configure(host="127.0.0.1", port=fake.port, retries=2, backoff=0.001)
+    try:
+        with pytest.raises(anki.AnkiError, match="request failed"):
+            anki.invoke("addNotes", notes=[])
+        assert fake.requests == 1
+
+        with pytest.raises(anki.AnkiError, match="request failed"):
+            anki.invoke("multi", actions=[anki.request("findNotes", query="*")])
+        assert fake.requests == 1 + 3
+    finally:
+        fake.stop()
+        anki.configure(host="localhost", port=8765, retries=3, backoff=0.2)
+
+
+def test_closed_connection_is_replaced_before_sending_changes(fake):
+    assert anki.invoke("version") == 6
+    client = anki.get_client()
+    assert client.conn is not None and client.conn.sock is not None
+    client.conn.sock.shutdown(socket.SHUT_RDWR)
+
+    assert anki.invoke("addNotes", notes=[]) == []
+    assert fake.connections == 2
+
+
+def test_anki_is_reached_again_once_restarted():
+    port = unused_port()
+    anki.configure(host="127.0.0.1", port=port, retries=1, backoff=0.001)
+    try:
+        with FakeAnki(port=port):
+            assert anki.invoke("version") == 6
+        # Anki closes its connections when it quits
+        anki.reset_client()
+        with pytest.raises(anki.AnkiError, match="not running"):
+            anki.invoke("version")
+
+        with FakeAnki(port=port) as fake:
+            with pytest.raises(anki.AnkiError, match="not running"):
+                anki.invoke("version")
+            assert fake.requests == 0
+
+            anki.reconnect()
+            assert anki.invoke("version") == 6
+            assert fake.requests == 1
+    finally:
+        anki.configure(host="localhost", port=8765, retries=3, backoff=0.2)
@@ -0,0 +1,82 @@
+import json
+import sqlite3
+import zipfile
+
+import pytest
+
+import apkg
+
+
+def note(text, extra="", deck="a::b", tags=("#a::#b::note",)):
+    return {
+        "deckName": deck,
+        "modelName": "cloze",
+        "fields": {"Text": text, "Extra": extra},
+        "tags": list(tags),
+    }
+
+
+def read_package(path, tmp_path):
+    with zipfile.ZipFile(path) as package:
+        media = json.loads(package.read("media"))
+        files = {name: package.read(name) for name in media}
+        (tmp_path / "collection.anki2").write_bytes(package.read("collection.anki2"))
+    return sqlite3.connect(tmp_path / "collection.anki2"), media, files
+
+
+def test_notes_cards_and_media_are_written(tmp_path):
+    image = tmp_path / "image.png"
+    image.write_bytes(b"png")
+    fields = [("**x** and **y**", "", ()), ("**z**", "more", ())]
+
+    with apkg.ApkgWriter(tmp_path / "deck.apkg") as package:
+        package.add_notes(
+            [
+                note("{{c1::x}} and {{c2::y}}"),
+                note("<b>{{c1::z}}</b> &amp;", "more"),
+            ],
+            apkg.note_guids("#a::#b::note", fields),
+        )
+        package.add_media([{"filename": "abc.png", "path": str(image)}] * 2)
+
+    db, media, files = read_package(tmp_path / "deck.apkg", tmp_path)
+    rows = db.execute("SELECT id, flds, sfld, tags FROM notes ORDER BY id").fetchall()
+    assert [row[1:] for row in rows] == [
+        ("{{c1::x}} and {{c2::y}}\x1f", "{{c1::x}} and {{c2::y}}", " #a::#b::note "),
+        ("<b>{{c1::z}}</b> &amp;\x1fmore", "{{c1::z}} &", " #a::#b::note "),
+    ]
+    cards = db.execute("SELECT nid, ord, did FROM cards ORDER BY id").fetchall()
+    assert [(nid, ord) for nid, ord, _ in cards] == [
+        (rows[0][0], 0),
+        (rows[0][0], 1),
+        (rows[1][0], 0),
+    ]
+
+    decks = json.loads(db.execute("SELECT decks FROM col").fetchone()[0])
+    assert sorted(deck["name"] for deck in decks.values()) == ["Default", "a", "a::b"]
+    assert str(cards[0][2]) in decks
+    assert package.stats.cards == 3
+    assert db.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+
+    assert media == {"0": "abc.png"}
+    assert files == {"0": b"png"}
+
+
+def test_guids_survive_reexports_and_edits_of_the_extra():
+    before = apkg.note_guids("#a", [("**x**", "", ()), ("**y**", "old", ())])
+    after = apkg.note_guids("#a", [("**x**", "", ()), ("**y**", "new", ())])
+    assert before == after
+
+    # identical cards still get a GUID each
+    twice = apkg.note_guids("#a", [("**x**", "", ()), ("**x**", "", ())])
+    assert twice[0] == before[0] and twice[1] != twice[0]
+    assert apkg.note_guids("#b", [("**x**", "", ())]) != before[:1]
+
+
+def test_failed_export_leaves_no_package(tmp_path):
+    with pytest.raises(RuntimeError):
+        with apkg.ApkgWriter(tmp_path / "deck.apkg") as package:
+            package.add_notes([note("{{c1::x}}")], ["guid"])
+            raise RuntimeError
+
+    assert list(tmp_path.iterdir()) == []
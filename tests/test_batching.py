@@ -0,0 +1,289 @@
+import os
+
+from benchmarks.fake_anki import FakeAnki
+import batching
+import sync_index
+from utils import anki
+
+
+def note(text: str) -> dict:
+    return {"deckName": "deck", "fields": {"Text": text, "Extra": ""}}
+
+
+class FakeAddNotes:
+    def __init__(self, rejected: frozenset[str] = frozenset()):
+        self.rejected = rejected
+        self.batches: list[list[str]] = []
+        self.next_id = 1
+
+    def __call__(self, action, notes):
+        assert action == "addNotes"
+        self.batches.append([n["fields"]["Text"] for n in notes])
+        result = []
+        for n in notes:
+            if n["fields"]["Text"] in self.rejected:
+                result.append(None)
+            else:
+                result.append(self.next_id)
+                self.next_id += 1
+        if None in result:
+            raise anki.AnkiError("cannot create note because it is a duplicate", result)
+        return result
+
+
+def run(monkeypatch, files, fake, **kwargs):
+    monkeypatch.setattr(anki, "invoke", fake)
+    done: list[tuple[str, list]] = []
+    failed: list[tuple[str, list]] = []
+    batcher = batching.NoteBatcher(
+        lambda path, note_ids: done.append((path, note_ids)),
+        lambda path, cards, e: failed.append((path, e.result)),
+        **kwargs,
+    )
+    for path, cards in files:
+        batcher.add(path, cards)
+    batcher.close()
+    return done, failed
+
+
+def test_notes_from_several_files_share_a_request(monkeypatch):
+    fake = FakeAddNotes()
+    files = [(f"{i}.md", [note(f"{i}a"), note(f"{i}b")]) for i in range(3)]
+
+    done, failed = run(monkeypatch, files, fake, max_notes=100)
+
+    assert fake.batches == [["0a", "0b", "1a", "1b", "2a", "2b"]]
+    assert done == [("0.md", [1, 2]), ("1.md", [3, 4]), ("2.md", [5, 6])]
+    assert failed == []
+
+
+def test_rejections_only_fail_their_own_file(monkeypatch):
+    fake = FakeAddNotes(rejected=frozenset({"1b"}))
+    files = [(f"{i}.md", [note(f"{i}a"), note(f"{i}b")]) for i in range(3)]
+
+    done, failed = run(monkeypatch, files, fake, max_notes=100)
+
+    assert done == [("0.md", [1, 2]), ("2.md", [4, 5])]
+    assert failed == [("1.md", [3, None])]
+
+
+def test_file_split_across_batches_finishes_with_its_last_note(monkeypatch):
+    fake = FakeAddNotes(rejected=frozenset({"1a"}))
+    files = [("0.md", [note("0a")]), ("1.md", [note("1a"), note("1b"), note("1c")])]
+
+    done, failed = run(monkeypatch, files, fake, max_notes=2, target_latency=60)
+
+    assert fake.batches == [["0a", "1a"], ["1b", "1c"]]
+    assert done == [("0.md", [1])]
+    assert failed == [("1.md", [None, 2, 3])]
+
+
+def test_byte_limit_starts_a_new_batch(monkeypatch):
+    fake = FakeAddNotes()
+    files = [("0.md", [note("x" * 100), note("y" * 100)])]
+
+    run(monkeypatch, files, fake, max_bytes=batching.NOTE_OVERHEAD_BYTES + 150)
+
+    assert len(fake.batches) == 2
+
+
+def test_slow_requests_shrink_the_batch(monkeypatch):
+    batcher = batching.NoteBatcher(print, print, max_notes=400, target_latency=1.0)
+    batcher.adapt(400, 5.0)
+    assert batcher.batch_notes == 200
+    batcher.adapt(200, 0.1)
+    assert batcher.batch_notes == 400
+
+
+def test_updates_and_deletes_share_a_multi_request():
+    with FakeAnki() as fake:
+        anki.configure(host="127.0.0.1", port=fake.port)
+        try:
+            added = fake.action_addNotes([note("old a"), note("old b")])
+            done: list[tuple[str, list]] = []
+            batcher = batching.NoteBatcher(
+                lambda path, note_ids: done.append((path, note_ids)),
+                lambda path, cards, e: None,
+            )
+            batcher.add(
+                "0.md",
+                [note("new")],
+                [{"id": added[0], "fields": {"Text": "edited a", "Extra": ""}}],
+                [added[1]],
+            )
+            batcher.close()
+        finally:
+            anki.configure(host="localhost", port=8765)
+
+    assert fake.requests == 1
+    assert done == [("0.md", [3, added[0]])]
+    assert sorted(n["fields"]["Text"] for n in fake.notes.values()) == [
+        "edited a",
+        "new",
+    ]
+
+
+def test_failed_update_fails_its_file():
+    with FakeAnki() as fake:
+        anki.configure(host="127.0.0.1", port=fake.port)
+        try:
+            failed: list[tuple[str, list]] = []
+            batcher = batching.NoteBatcher(
+                lambda path, note_ids: None,
+                lambda path, cards, e: failed.append((path, e.result)),
+            )
+            batcher.add("0.md", [], [{"id": 99, "fields": {"Text": "x", "Extra": ""}}])
+            batcher.close()
+        finally:
+            anki.configure(host="localhost", port=8765)
+
+    assert failed == [("0.md", [None])]
+
+
+def cloze(text: str) -> dict:
+    return {
+        "deckName": "deck",
+        "modelName": "cloze",
+        "fields": {"Text": text, "Extra": ""},
+        "options": {"allowDuplicate": False, "duplicateScope": "deck"},
+    }
+
+
+def test_preflight_asks_anki_once_about_notes_not_known_locally(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    with FakeAnki() as fake:
+        anki.configure(host="127.0.0.1", port=fake.port)
+        try:
+            fake.action_addNotes([cloze("in anki")])
+            files = [
+                ("0.md", [cloze("new"), cloze("in anki")], [], []),
+                ("1.md", [cloze("new"), cloze("other")], [], []),
+            ]
+            refused = batching.preflight(files, index, chunk_notes=2)
+        finally:
+            anki.configure(host="localhost", port=8765)
+
+    assert fake.requests == 1
+    assert refused == {
+        "0.md": {1: "cannot create note because it is a duplicate"},
+        "1.md": {0: batching.LIKELY_DUPLICATE},
+    }
+
+
+def test_actions_of_multi_requests_are_versioned(monkeypatch):
+    sent: list[dict] = []
+
+    def invoke(action, actions):
+        assert action == "multi"
+        sent.extend(actions)
+        # an action without a version would be answered with its bare result
+        return [
+            (
+                {
+                    "result": None if a["action"] == "updateNoteFields" else [],
+                    "error": None,
+                }
+                if a.get("version") == 6
+                else None
+            )
+            for a in actions
+        ]
+
+    monkeypatch.setattr(anki, "invoke", invoke)
+    done: list[tuple[str, list]] = []
+    batcher = batching.NoteBatcher(
+        lambda path, note_ids: done.append((path, note_ids)),
+        lambda path, cards, e: None,
+    )
+    batcher.add("0.md", [], [{"id": 5, "fields": {"Text": "x", "Extra": ""}}], [6])
+    batcher.close()
+
+    assert [a["version"] for a in sent] == [6, 6]
+    assert done == [("0.md", [5])]
+
+
+def test_preflight_sends_versioned_actions(monkeypatch, tmp_path):
+    def invoke(action, actions):
+        assert action == "multi"
+        answers = []
+        for a in actions:
+            result = [
+                {"canAdd": n["fields"]["Text"] != "in anki", "error": "duplicate"}
+                for n in a["params"]["notes"]
+            ]
+            # AnkiConnect only wraps the answers of versioned actions
+            answers.append(
+                {"result": result, "error": None} if a.get("version") else result
+            )
+        return answers
+
+    monkeypatch.setattr(anki, "invoke", invoke)
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    files = [("0.md", [cloze("new"), cloze("in anki")], [], [])]
+    assert batching.preflight(files, index) == {"0.md": {1: "duplicate"}}
+
+
+def test_preflight_without_the_action_leaves_notes_to_add_notes(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        anki,
+        "invoke",
+        lambda action, actions: [
+            {"result": None, "error": "unsupported action"} for _ in actions
+        ],
+    )
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    files = [("0.md", [cloze("new"), cloze("new")], [], [])]
+    assert batching.preflight(files, index) == {"0.md": {1: batching.LIKELY_DUPLICATE}}
+
+
+def test_notes_added_by_a_failed_batch_are_not_failed(monkeypatch):
+    added: set[str] = set()
+
+    def invoke(action, notes=None, actions=None):
+        if action == "addNotes":
+            # AnkiConnect adds what it can, then answers null for the whole batch
+            added.update(
+                n["fields"]["Text"] for n in notes if n["fields"]["Text"] != "1b"
+            )
+            raise anki.AnkiError(str(["model was not found: cloze"]), None)
+        assert action == "multi" and all(a["version"] == 6 for a in actions)
+        answers = []
+        for a in actions:
+            text = a["params"]["note"]["fields"]["Text"]
+            if text in added:
+                answers.append({"result": None, "error": batching.DUPLICATE})
+            else:
+                answers.append({"result": None, "error": "model was not found: cloze"})
+        return answers
+
+    monkeypatch.setattr(anki, "invoke", invoke)
+    files = [(f"{i}.md", [note(f"{i}a"), note(f"{i}b")]) for i in range(3)]
+    done, failed = run(monkeypatch, files, invoke, max_notes=100)
+
+    assert done == [("0.md", [None, None]), ("2.md", [None, None])]
+    assert failed == [("1.md", [None, None])]
+
+
+def test_notes_of_removed_files_are_deleted(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    stat = os.stat(tmp_path)
+    for i, path in enumerate(["gone.md", "kept.md"]):
+        index.plan(str(tmp_path / path), stat, [(f"**{i}**", "", ())])
+        index.changes(str(tmp_path / path), [cloze(f"{{{{c1::{i}}}}}")])
+        index.done(str(tmp_path / path), [i + 1])
+
+    with FakeAnki() as fake:
+        anki.configure(host="127.0.0.1", port=fake.port)
+        try:
+            assert fake.action_addNotes([cloze("{{c1::0}}"), cloze("{{c1::1}}")]) == [
+                1,
+                2,
+            ]
+            assert batching.delete_files(index, [str(tmp_path / "gone.md")]) == 1
+        finally:
+            anki.configure(host="localhost", port=8765)
+
+    assert sorted(fake.notes) == [2]
+    assert index.paths() == [str(tmp_path / "kept.md")]
+    # its first field is free again
+    assert index.duplicates([cloze("{{c1::0}}"), cloze("{{c1::1}}")]) == [False, True]
@@ -0,0 +1,30 @@
+from parser import clozify
+
+
+def test_auto_and_explicit_numbering():
+    text, count = clozify(
+        "A <strong>vector</strong> has a <strong>domain</strong> and a <strong>2::rule</strong>"
+    )
+    assert text == "A {{c1::vector}} has a {{c2::domain}} and a {{c2::rule}}"
+    assert count == 3
+
+
+def test_repeated_phrase_gets_its_own_number():
+    text, _ = clozify("<strong>x</strong> then <strong>x</strong>")
+    assert text == "{{c1::x}} then {{c2::x}}"
+
+
+def test_leftover_asterisks_inside_mathjax():
+    text, count = clozify(r"\(a=**b** + <strong>c</strong>\) and **d**")
+    assert text == r"\(a={{c1::b}} + {{c2::c}}\) and {{c3::d}}"
+    assert count == 3
+
+
+def test_explicit_cloze_counts_without_consuming_numbers():
+    text, count = clozify("Hello<br/>\n{{c1::<br/>\ncloze<br/>\n}} <strong>x</strong>")
+    assert text == "Hello<br/>\n{{c1::<br/>\ncloze<br/>\n}} {{c1::x}}"
+    assert count == 2
+
+
+def test_unclozed_text():
+    assert clozify("no bold here") == ("no bold here", 0)
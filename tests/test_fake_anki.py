@@ -0,0 +1,125 @@
+import pytest
+
+from benchmarks.fake_anki import FakeAnki
+from utils import anki
+
+
+def note(text: str, deck: str = "deck", tags: tuple[str, ...] = ()) -> dict:
+    return {
+        "deckName": deck,
+        "modelName": "Cloze",
+        "fields": {"Text": text, "Extra": ""},
+        "tags": list(tags),
+        "options": {"duplicateScope": "deck"},
+    }
+
+
+def serve(**kwargs):
+    fake = FakeAnki(**kwargs).start()
+    anki.configure(host="127.0.0.1", port=fake.port, backoff=0.001)
+    return fake
+
+
+@pytest.fixture
+def fake():
+    fake = serve()
+    yield fake
+    fake.stop()
+    anki.configure(host="localhost", port=8765, backoff=0.2)
+
+
+def test_duplicates_are_rejected_within_a_deck(fake):
+    assert anki.invoke("addNotes", notes=[note("a"), note("a", deck="other")]) == [
+        1,
+        2,
+    ]
+
+    with pytest.raises(anki.AnkiError) as e:
+        anki.invoke("addNotes", notes=[note("b"), note("a ")])
+    # the other notes are added, but only the errors are answered
+    assert e.value.result is None
+    assert "duplicate" in e.value.e
+    assert sorted(fake.notes) == [1, 2, 3]
+    assert anki.invoke("canAddNotes", notes=[note("a"), note("c")]) == [False, True]
+
+    anki.invoke("updateNoteFields", note={"id": 1, "fields": {"Text": "d"}})
+    assert anki.invoke("canAddNotes", notes=[note("a"), note("d")]) == [True, False]
+    anki.invoke("deleteNotes", notes=[1])
+    assert anki.invoke("canAddNotes", notes=[note("d")]) == [True]
+
+
+def test_multi_answers_unversioned_actions_with_their_result(fake):
+    answers = anki.invoke(
+        "multi",
+        actions=[
+            {"action": "version"},
+            anki.request("version"),
+            {"action": "addNote", "params": {"note": note("a")}},
+            anki.request("addNote", note=note("a")),
+        ],
+    )
+    assert answers == [
+        6,
+        {"result": 6, "error": None},
+        1,
+        {"result": None, "error": "cannot create note because it is a duplicate"},
+    ]
+
+
+def test_find_notes(fake):
+    anki.invoke(
+        "addNotes",
+        notes=[
+            note("a", deck="math::linear", tags=("#math::vectors",)),
+            note("b", deck="math", tags=("#math",)),
+            note("c", deck="cs", tags=("#cs",)),
+        ],
+    )
+
+    assert anki.invoke("findNotes", query="deck:math") == [1, 2]
+    assert anki.invoke("findNotes", query='"deck:math::linear"') == [1]
+    assert anki.invoke("findNotes", query="tag:#math") == [1, 2]
+    assert anki.invoke("findNotes", query="deck:math tag:#math::vec*") == [1]
+    assert anki.invoke("findNotes", query="nid:2,3") == [2, 3]
+    assert anki.invoke("findNotes", query="*") == [1, 2, 3]
+
+
+def test_injected_errors():
+    fake = serve(errors={"storeMediaFile": "disk full"}, fail_rate=0.5, seed=3)
+    try:
+        failures = 0
+        for _ in range(20):
+            try:
+                anki.invoke("version")
+            except anki.AnkiError as e:
+                assert e.e == "injected failure"
+                failures += 1
+        assert 0 < failures < 20
+
+        fake.fail_rate = 0.0
+        results = anki.invoke(
+            "multi",
+            actions=[
+                anki.request("version"),
+                anki.request("storeMediaFile", filename="a.png", path="a.png"),
+            ],
+        )
+        assert results == [
+            {"result": 6, "error": None},
+            {"result": None, "error": "disk full"},
+        ]
+        assert fake.actions["storeMediaFile"] == 1
+    finally:
+        fake.stop()
+        anki.configure(host="localhost", port=8765, backoff=0.2)
+
+
+def test_dropped_requests_are_retried():
+    fake = serve(drop_rate=0.3, seed=1)
+    try:
+        for _ in range(10):
+            assert anki.invoke("version") == 6
+        assert fake.requests > 10
+    finally:
+        fake.stop()
+        anki.configure(host="localhost", port=8765, backoff=0.2)
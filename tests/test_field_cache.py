@@ -0,0 +1,76 @@
+import multiprocessing
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import field_cache
+import parser
+from utils import hash_cache
+
+IMAGE = Path(__file__).parent / "fixtures" / "full" / "z_attachments"
+
+
+def test_rendered_fields_are_reused(tmp_path):
+    cache = field_cache.FieldCache(tmp_path / "fields.sqlite3", "v1")
+    assert cache.get("**a**", tmp_path) is None
+
+    cache.put("**a**", tmp_path, "<strong>a</strong>", [])
+    assert cache.get("**a**", tmp_path) == ("<strong>a</strong>", [])
+    # images resolve against the root, so it is part of the key
+    assert cache.get("**a**", tmp_path / "other") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+    assert field_cache.FieldCache(tmp_path / "fields.sqlite3", "v1").get(
+        "**a**", tmp_path
+    )
+    # a different renderer drops everything
+    changed = field_cache.FieldCache(tmp_path / "fields.sqlite3", "v2")
+    assert changed.get("**a**", tmp_path) is None
+    changed.close()
+    assert (
+        field_cache.FieldCache(tmp_path / "fields.sqlite3", "v1").get("**a**", tmp_path)
+        is None
+    )
+
+
+def test_changed_image_renders_the_field_again(tmp_path):
+    shutil.copytree(IMAGE, tmp_path / "z_attachments")
+    image = tmp_path / "z_attachments" / "Pasted image 20240911120937.png"
+    field = "![|300](z_attachments/Pasted%20image%2020240911120937.png)"
+    cache = field_cache.FieldCache(tmp_path / "fields.sqlite3", "v1")
+
+    html, media = parser.process_field(field, tmp_path)
+    cache.put(field, tmp_path, html, media)
+    assert cache.get(field, tmp_path) == (html, media)
+
+    image.write_bytes(image.read_bytes() + b"\0")
+    hash_cache.get_hash_cache().forget(image)
+    assert cache.get(field, tmp_path) is None
+
+
+def test_eviction_keeps_the_most_recent_entries(tmp_path):
+    cache = field_cache.FieldCache(tmp_path / "fields.sqlite3", "v1", max_entries=2)
+    for i in range(3):
+        cache.run_started = i
+        cache.put(str(i), tmp_path, str(i), [])
+    cache.close()
+
+    assert cache.get("0", tmp_path) is None
+    assert cache.get("1", tmp_path) == ("1", [])
+    assert cache.get("2", tmp_path) == ("2", [])
+
+
+def cache_is_disabled() -> bool:
+    return field_cache.get_field_cache() is None
+
+
+def test_disabled_cache_stays_off_in_spawned_workers(monkeypatch):
+    monkeypatch.delenv(field_cache.DISABLE_ENV, raising=False)
+    monkeypatch.setattr(field_cache, "_default", None)
+    field_cache.disable()
+    assert cache_is_disabled()
+
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=spawn) as workers:
+        assert workers.submit(cache_is_disabled).result()
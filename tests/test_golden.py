@@ -0,0 +1,24 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import parser
+
+golden_path = Path(__file__).parent / "golden" / "fields.json"
+golden_cases = json.loads(golden_path.read_text(encoding="utf-8"))
+media_root = Path(__file__).parent / "fixtures" / "full"
+
+
+@pytest.mark.parametrize("case", golden_cases, ids=range(len(golden_cases)))
+def test_field_html_matches_golden(case):
+    html, media = parser.process_field(case["input"], media_root)
+
+    assert html == case["html"]
+    assert [
+        {
+            "filename": m["filename"],
+            "path": str(Path(m["path"]).relative_to(media_root)),
+        }
+        for m in media
+    ] == case["media"]
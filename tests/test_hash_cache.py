@@ -0,0 +1,88 @@
+import os
+
+from utils import hash_cache
+from utils import utils
+
+
+def counting_hash_file(monkeypatch) -> list[str]:
+    calls: list[str] = []
+    original = utils.hash_file
+
+    def hash_file(path):
+        calls.append(str(path))
+        return original(path)
+
+    monkeypatch.setattr(utils, "hash_file", hash_file)
+    return calls
+
+
+def test_unchanged_file_is_not_reread(tmp_path, monkeypatch):
+    calls = counting_hash_file(monkeypatch)
+    image = tmp_path / "image.png"
+    image.write_bytes(b"png")
+    db = tmp_path / "hashes.sqlite3"
+
+    cache = hash_cache.HashCache(db)
+    digest = cache.digest(image)
+    assert cache.digest(image) == digest
+    cache.close()
+
+    cache = hash_cache.HashCache(db)
+    assert cache.digest(image) == digest
+    assert cache.hits == 1
+    cache.close()
+
+    assert calls == [str(image)]
+
+
+def test_changed_file_is_rehashed(tmp_path):
+    image = tmp_path / "image.png"
+    image.write_bytes(b"old")
+    cache = hash_cache.HashCache(tmp_path / "hashes.sqlite3")
+    old = cache.digest(image)
+
+    image.write_bytes(b"new content")
+    cache.forget(image)
+
+    assert cache.digest(image) == utils.hash_file(image) != old
+
+
+def test_verify_and_rebuild(tmp_path):
+    image = tmp_path / "image.png"
+    image.write_bytes(b"old")
+    gone = tmp_path / "gone.png"
+    gone.write_bytes(b"gone")
+    cache = hash_cache.HashCache(tmp_path / "hashes.sqlite3")
+    cache.digest(image)
+    cache.digest(gone)
+
+    image.write_bytes(b"new content")
+    gone.unlink()
+
+    assert cache.verify() == {"ok": 0, "stale": 1, "corrupt": 0, "missing": 1}
+    cache.verify(rebuild=True)
+    assert cache.verify() == {"ok": 1, "stale": 0, "corrupt": 0, "missing": 0}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    db = tmp_path / "hashes.sqlite3"
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.png"
+        path.write_bytes(str(i).encode())
+        paths.append(path)
+
+    cache = hash_cache.HashCache(db)
+    for path in paths:
+        cache.digest(path)
+    cache.close()
+
+    cache = hash_cache.HashCache(db, max_entries=2)
+    cache.run_started += 10
+    cache.digest(paths[2])
+    cache.digest(paths[1])
+    cache.close()
+
+    cache = hash_cache.HashCache(db)
+    cached = {row[0] for row in cache.db.execute("SELECT path FROM hashes")}
+    assert cached == {os.path.abspath(paths[1]), os.path.abspath(paths[2])}
@@ -0,0 +1,70 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import markdown
+from markdown.extensions import codehilite, fenced_code
+
+import highlight
+
+FIELD = """Traversal:
+```python
+def visit(node):
+    for child in node.children:
+        visit(child)
+```
+and a guessed language:
+```
+int main() { return 0; }
+```
+```{.python hl_lines="1"}
+print("kept for fenced_code")
+```
+"""
+
+
+def render(fenced, field: str) -> str:
+    return markdown.markdown(
+        field, extensions=[codehilite.CodeHiliteExtension(), fenced, "nl2br"]
+    )
+
+
+def test_output_matches_fenced_code():
+    cache = highlight.HighlightCache()
+    expected = render(fenced_code.FencedCodeExtension(), FIELD)
+
+    assert render(highlight.CachedFencedCodeExtension(cache), FIELD) == expected
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert render(highlight.CachedFencedCodeExtension(cache), FIELD) == expected
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert "100% hit rate" not in cache.summary()
+
+
+def test_memory_is_bounded_and_disk_store_is_shared(tmp_path):
+    cache = highlight.HighlightCache(tmp_path / "highlight.sqlite3", max_memory=1)
+    first = cache.highlight("a = 1\n", "python", {"use_pygments": True})
+    cache.highlight("b = 2\n", "python", {"use_pygments": True})
+    assert len(cache.memory) == 1
+    cache.close()
+
+    other = highlight.HighlightCache(tmp_path / "highlight.sqlite3")
+    assert other.highlight("a = 1\n", "python", {"use_pygments": True}) == first
+    assert (other.disk_hits, other.misses) == (1, 0)
+    other.highlight("a = 1\n", "python", {"use_pygments": True, "linenums": True})
+    assert other.misses == 1
+
+
+def disk_store() -> Optional[Path]:
+    return highlight.get_highlight_cache().db_path
+
+
+def test_disk_store_is_used_by_spawned_workers(monkeypatch, tmp_path):
+    monkeypatch.delenv(highlight.DISK_STORE_ENV, raising=False)
+    monkeypatch.setattr(highlight, "_default", None)
+    highlight.use_disk_store(tmp_path / "highlight.sqlite3")
+
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=spawn) as workers:
+        assert workers.submit(disk_store).result() == tmp_path / "highlight.sqlite3"
+    highlight.get_highlight_cache().close()
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pytest
+
+import render
+import render_markdown_it
+from md_mathjax.md_mathjax import stash_math
+
+renderers = [render.MarkdownRenderer(), render_markdown_it.MarkdownItRenderer()]
+
+
+def field(renderer, raw_string):
+    html, _, needs_soup = renderer.render_field(raw_string, Path("."))
+    assert not needs_soup
+    return html
+
+
+@pytest.mark.parametrize("renderer", renderers, ids=lambda r: r.name)
+def test_display_math_keeps_its_latex(renderer):
+    assert field(renderer, "$$a_1 *b* c_1$$") == r"\[a_1 *b* c_1\]"
+    assert (
+        field(renderer, "$$\n\\begin{aligned} a &= b \\\\ c \\end{aligned}\n$$")
+        == "\\[\n\\begin{aligned}  a &amp;= b \\\\ c \\end{aligned} \n\\]"
+    )
+
+
+@pytest.mark.parametrize("renderer", renderers, ids=lambda r: r.name)
+def test_inline_and_display_math_in_one_paragraph(renderer):
+    assert (
+        field(renderer, "**$x_{1}$** and $$y$$, cost \\$5 or `$PATH`")
+        == r"<strong>\(x_{1} \)</strong> and \[y\], cost $5 or <code>$PATH</code>"
+    )
+
+
+@pytest.mark.parametrize("renderer", renderers, ids=lambda r: r.name)
+def test_code_and_list_items_are_not_math(renderer):
+    assert field(renderer, "* $a\n* b$") == "<ul>\n<li>$a</li>\n<li>b$</li>\n</ul>"
+    assert "$HOME" in field(renderer, "text\n\n    echo $HOME $PATH")
+    assert "\\(" not in field(renderer, "```\n$x$\n```")
+
+
+def test_escaped_dollars_and_unclosed_math():
+    stored = []
+
+    def store(html):
+        stored.append(html)
+        return f"<{len(stored) - 1}>"
+
+    text = r"$a\$b$ and \$5, or $6 and $$x$$"
+    assert stash_math(text, store) == "<0> and $5, or $6 and <1>"
+    assert stored == [r"\(a\$b\)", r"\[x\]"]
@@ -0,0 +1,97 @@
+import pytest
+
+import media
+from utils import anki
+
+
+def fake_invoke(monkeypatch, existing: list[str]) -> list[tuple[str, dict]]:
+    calls: list[tuple[str, dict]] = []
+
+    def invoke(action, **params):
+        calls.append((action, params))
+        if action == "getMediaFilesNames":
+            return existing
+        if action == "multi":
+            return [
+                {"result": a["params"]["filename"], "error": None}
+                for a in params["actions"]
+            ]
+        raise AssertionError(action)
+
+    monkeypatch.setattr(anki, "invoke", invoke)
+    return calls
+
+
+def make_images(tmp_path, names: list[str]) -> list[dict[str, str]]:
+    images = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(b"x" * 10)
+        images.append({"filename": name, "path": str(path)})
+    return images
+
+
+def test_duplicates_and_existing_media_are_skipped(tmp_path, monkeypatch):
+    calls = fake_invoke(monkeypatch, existing=["b.png"])
+    a, b, c = make_images(tmp_path, ["a.png", "b.png", "c.png"])
+
+    stats = media.sync_media([a, b, a, c, a, b])
+
+    assert [action for action, _ in calls] == ["getMediaFilesNames", "multi"]
+    uploaded = [act["params"]["filename"] for act in calls[1][1]["actions"]]
+    assert uploaded == ["a.png", "c.png"]
+    assert stats.references == 6
+    assert stats.unique == 3
+    assert stats.already_in_anki == 1
+    assert stats.uploaded == 2
+    assert stats.bytes_uploaded == 20
+    assert stats.bytes_saved == 40
+    assert stats.requests == 2
+    assert stats.requests_saved == 5
+
+
+def test_single_image_saves_no_requests(tmp_path, monkeypatch):
+    fake_invoke(monkeypatch, existing=[])
+
+    stats = media.sync_media(make_images(tmp_path, ["a.png"]))
+
+    assert stats.requests == 2
+    assert stats.requests_saved == 0
+    assert stats.summary().endswith("saved 0 bytes and 0 round-trips")
+
+
+def test_uploads_are_batched(tmp_path, monkeypatch):
+    calls = fake_invoke(monkeypatch, existing=[])
+    monkeypatch.setattr(media, "MEDIA_BATCH_BYTES", 25)
+    images = make_images(tmp_path, [f"{i}.png" for i in range(5)])
+
+    stats = media.sync_media(images)
+
+    batch_sizes = [
+        len(params["actions"]) for action, params in calls if action == "multi"
+    ]
+    assert batch_sizes == [2, 2, 1]
+    assert stats.requests == 4
+
+
+def test_no_images_makes_no_requests(monkeypatch):
+    calls = fake_invoke(monkeypatch, existing=[])
+    assert media.sync_media([]).requests == 0
+    assert calls == []
+
+
+def test_failed_uploads_are_tried_again(tmp_path, monkeypatch):
+    a, b = make_images(tmp_path, ["a.png", "b.png"])
+    sync = media.MediaSync()
+
+    def not_running(action, **params):
+        raise anki.AnkiError(anki.NOT_RUNNING, [])
+
+    monkeypatch.setattr(anki, "invoke", not_running)
+    with pytest.raises(anki.AnkiError):
+        sync.upload(sync.add([a, b]))
+
+    calls = fake_invoke(monkeypatch, existing=["b.png"])
+    sync.upload(sync.add([a, b]))
+    uploaded = [act["params"]["filename"] for act in calls[1][1]["actions"]]
+    assert uploaded == ["a.png"]
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import parallel
+import parser
+
+fixtures = Path(__file__).parent / "fixtures"
+
+
+def render_all(renderer: parallel.CardRenderer, files: list[tuple[str, str]]):
+    rendered = []
+    for key, content in files:
+        rendered.extend(
+            renderer.submit(key, parser.split_cards(content), fixtures / "full")
+        )
+    rendered.extend(renderer.drain())
+    renderer.close()
+    return rendered
+
+
+def test_pool_matches_serial_rendering_in_submission_order():
+    big = "\n\n".join(f"card **{i}**" for i in range(100))
+    files = [
+        ("full", (fixtures / "full" / "input.md").read_text(encoding="utf-8")),
+        ("big", big),
+        ("basic", (fixtures / "basic" / "input.md").read_text(encoding="utf-8")),
+    ]
+
+    serial = render_all(parallel.CardRenderer(), files)
+    pooled = render_all(parallel.PooledCardRenderer(2), files)
+
+    assert [key for key, _ in pooled] == ["full", "big", "basic"]
+    assert [[(c.text, c.extra, c.images) for c in cards] for _, cards in pooled] == [
+        [(c.text, c.extra, c.images) for c in cards] for _, cards in serial
+    ]
+
+
+def test_render_errors_stay_with_their_file(monkeypatch):
+    renderer = parallel.CardRenderer()
+    original = parser.render_cards
+
+    def render_cards(fields, root):
+        if fields[0][0].startswith("bad"):
+            raise ValueError("bad card")
+        return original(fields, root)
+
+    monkeypatch.setattr(parser, "render_cards", render_cards)
+    rendered = render_all(renderer, [("ok", "**a**"), ("bad", "bad **b**")])
+
+    assert [key for key, _ in rendered] == ["ok", "bad"]
+    assert isinstance(rendered[1][1], ValueError)
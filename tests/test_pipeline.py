@@ -0,0 +1,138 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from rich.console import Console
+
+from benchmarks.fake_anki import FakeAnki
+import parser
+import pipeline
+import sync_index
+from utils import anki
+
+
+def planner(index: sync_index.SyncIndex):
+    def plan(scanned, force):
+        fields = parser.split_cards(Path(scanned.path).read_text(encoding="utf-8"))
+        state = index.plan(scanned.path, scanned.stat, fields, force)
+        return "#tag", [fields[i] for i in state.new]
+
+    return plan
+
+
+def build(cards: list[parser.Card], deck_name: str, tag: str):
+    if any(not card.cloze_count for card in cards):
+        raise ValueError("Some cards are not clozed")
+    payload = [
+        {
+            "deckName": deck_name,
+            "fields": {"Text": c.text, "Extra": c.extra},
+            "tags": [tag],
+        }
+        for c in cards
+    ]
+    return payload, [image for c in cards for image in c.images or []]
+
+
+def test_pipeline_syncs_every_file(tmp_path):
+    image = Path(__file__).parent / "fixtures" / "full" / "z_attachments"
+    for i in range(20):
+        (tmp_path / f"{i}.md").write_text(
+            f"card **{i}**\n\nwith image **x** ![|10]({image.as_posix()}/Pasted%20image%2020240911120937.png)\n",
+            encoding="utf-8",
+        )
+    (tmp_path / "unclozed.md").write_text("no cloze\n", encoding="utf-8")
+    (tmp_path / "_private.md").write_text("**x**\n", encoding="utf-8")
+
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    with FakeAnki() as fake:
+        anki.configure(host="127.0.0.1", port=fake.port)
+        try:
+            pipeline.Pipeline(
+                Console(quiet=True),
+                {"deck": str(tmp_path)},
+                "discussion",
+                planner(index),
+                build,
+                index,
+                lambda console, cards, e: None,
+                lambda console, file_path, cards, refused: None,
+                anki_concurrency=1,
+                queue_size=1,
+                batch_notes=8,
+            ).run()
+        finally:
+            anki.configure(host="localhost", port=8765)
+
+    assert len(fake.notes) == 40
+    assert len(fake.media) == 1
+    for i in range(20):
+        path = tmp_path / f"{i}.md"
+        assert index.unchanged(str(path), path.stat())
+        assert len(index.cards(str(path))) == 2
+    unclozed = tmp_path / "unclozed.md"
+    assert not index.unchanged(str(unclozed), unclozed.stat())
+    assert index.cards(str(tmp_path / "_private.md")) == {}
+
+
+class Changes:
+    """Stands in for the sync index, every card is new"""
+
+    def changes(self, file_path, cards):
+        return cards, [], []
+
+
+def render_stage(tmp_path, build, files: int, consume: bool):
+    stage = pipeline.Pipeline(
+        Console(quiet=True),
+        {},
+        "discussion",
+        None,
+        build,
+        Changes(),
+        lambda console, cards, e: None,
+        lambda console, file_path, cards, refused: None,
+        queue_size=1,
+    )
+    stage.advance = lambda name: None
+
+    async def run() -> int:
+        inbox: asyncio.Queue = asyncio.Queue()
+        for i in range(files):
+            inbox.put_nowait((tmp_path, "deck", f"{i}.md", "#tag", [("**x**", "", ())]))
+        inbox.put_nowait(None)
+        out: asyncio.Queue = asyncio.Queue(1)
+        with ThreadPoolExecutor(1) as executor:
+            task = asyncio.create_task(stage.render(inbox, out, executor))
+            if consume:
+
+                async def drain() -> None:
+                    while await out.get() is not None:
+                        pass
+
+                consumer = asyncio.create_task(drain())
+                try:
+                    await task
+                finally:
+                    consumer.cancel()
+            else:
+                await asyncio.sleep(0.3)
+                task.cancel()
+        return inbox.qsize()
+
+    return asyncio.run(run())
+
+
+def test_full_queue_stops_rendering(tmp_path):
+    # one file waiting in the queue, and one blocked on it in each of the 2 slots
+    assert render_stage(tmp_path, build, 10, consume=False) >= 10 - 3
+
+
+def test_render_errors_are_raised(tmp_path):
+    def broken(cards, deck_name, tag):
+        raise RuntimeError("broken")
+
+    with pytest.raises(RuntimeError):
+        render_stage(tmp_path, broken, 3, consume=True)
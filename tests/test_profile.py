@@ -0,0 +1,41 @@
+import json
+
+from utils import profile
+
+
+def test_nothing_is_recorded_while_disabled():
+    assert profile.disable() is None
+    with profile.span("card", text="a"):
+        profile.count("anki bytes sent", 10)
+    assert profile.disable() is None
+
+
+def test_spans_and_counters_are_reported(tmp_path):
+    profiler = profile.enable()
+    try:
+        for name in ["a.md", "b.md"]:
+            with profile.span("file", file=name):
+                with profile.span("card", text=name):
+                    pass
+        profile.count("anki bytes sent", 10)
+        profile.count("anki bytes sent", 5)
+    finally:
+        assert profile.disable() is profiler
+
+    report = profiler.report()
+    assert {stage["name"]: stage["calls"] for stage in report["stages"]} == {
+        "file": 2,
+        "card": 2,
+    }
+    # a span includes the ones nested in it
+    assert report["stages"][0]["name"] == "file"
+    assert report["counters"] == {"anki bytes sent": 15}
+    assert sorted(span["file"] for span in report["slowest_files"]) == ["a.md", "b.md"]
+
+    profiler.write(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    spans = [e for e in events if e["ph"] == "X"]
+    assert [e["name"] for e in spans] == ["card", "file", "card", "file"]
+    assert spans[1]["ts"] <= spans[0]["ts"]
+    assert spans[0]["ts"] + spans[0]["dur"] <= spans[1]["ts"] + spans[1]["dur"]
+    assert [e["args"] for e in events if e["ph"] == "C"] == [{"anki bytes sent": 15}]
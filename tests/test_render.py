@@ -0,0 +1,133 @@
+import json
+import threading
+from pathlib import Path
+
+import markdown
+import pytest
+from markdown.extensions import codehilite, fenced_code
+
+from md_mathjax import Md4MathjaxExtension
+import render
+import render_markdown_it
+
+fixture_inputs = sorted(
+    (Path(__file__).parent / "fixtures").glob("*/input.md"), key=lambda p: p.parent.name
+)
+
+
+def fresh_markdown(raw_string: str) -> str:
+    return markdown.markdown(
+        raw_string.strip(),
+        extensions=[
+            codehilite.CodeHiliteExtension(),
+            fenced_code.FencedCodeExtension(),
+            Md4MathjaxExtension(),
+            "nl2br",
+        ],
+    ).strip("\n")
+
+
+def test_reused_renderer_matches_fresh_markdown():
+    renderer = render.MarkdownRenderer()
+    # render every input twice to catch state leaking between conversions
+    for path in fixture_inputs * 2:
+        content = path.read_text(encoding="utf-8")
+        assert renderer.render(content) == fresh_markdown(content)
+
+
+def test_renderer_is_per_thread():
+    main_renderer = render.get_renderer()
+    assert render.get_renderer() is main_renderer
+
+    other: list[render.MarkdownRenderer] = []
+    thread = threading.Thread(target=lambda: other.append(render.get_renderer()))
+    thread.start()
+    thread.join()
+
+    assert other[0] is not main_renderer
+
+
+golden_inputs = [
+    case["input"]
+    for case in json.loads(
+        (Path(__file__).parent / "golden" / "fields.json").read_text(encoding="utf-8")
+    )
+]
+fixture_blocks = [
+    block
+    for path in fixture_inputs
+    for block in path.read_text(encoding="utf-8").split("\n\n")
+    if block.strip()
+]
+media_root = Path(__file__).parent / "fixtures" / "full"
+
+# where CommonMark and Python-Markdown part ways: (markdown, markdown-it field HTML)
+KNOWN_DIFFERENCES = [
+    # nested lists may be indented by two spaces
+    ("* a\n  * b", "<ul>\n<li>a<ul>\n<li>b</li>\n</ul>\n</li>\n</ul>"),
+    # quotes end the link destination in Markdown and start a title
+    (
+        'First paragraph\n\nSecond paragraph with [a link](https://example.com/?a=1&b="2")',
+        "First paragraph\nSecond paragraph with "
+        "<a href='https://example.com/?a=1&amp;b=\"2\"'>a link</a>",
+    ),
+    # list items give up their indentation on continuation lines
+    ("* a\n    b", "<ul>\n<li>a<br/>\n  b</li>\n</ul>"),
+    # emphasis nests, where Markdown closes and reopens it
+    ("a *b **c** d* e", "a <em>b <strong>c</strong> d</em> e"),
+]
+
+# spaces Markdown keeps before a line break, or at the end of a paragraph
+line_break_inputs = ["a   \nb", "**a**    \nb", "a \t \nb", "a   \n\nb"]
+
+conformance_inputs = [
+    raw_string
+    for raw_string in golden_inputs
+    + fixture_blocks
+    + line_break_inputs
+    + [path.read_text(encoding="utf-8") for path in fixture_inputs]
+    if raw_string not in dict(KNOWN_DIFFERENCES)
+]
+
+
+@pytest.mark.parametrize("raw_string", conformance_inputs)
+def test_markdown_it_matches_python_markdown(raw_string):
+    expected = render.MarkdownRenderer()
+    renderer = render_markdown_it.MarkdownItRenderer()
+
+    assert renderer.render(raw_string) == expected.render(raw_string)
+    assert renderer.render_field(raw_string, media_root) == expected.render_field(
+        raw_string, media_root
+    )
+
+
+@pytest.mark.parametrize("raw_string,html", KNOWN_DIFFERENCES)
+def test_markdown_it_known_differences(raw_string, html):
+    renderer = render_markdown_it.MarkdownItRenderer()
+    assert renderer.render_field(raw_string, media_root) == (html, [], False)
+    assert render.MarkdownRenderer().render_field(raw_string, media_root)[0] != html
+
+
+def test_backend_is_chosen_by_environment(monkeypatch):
+    monkeypatch.delenv(render.BACKEND_ENV, raising=False)
+    assert isinstance(render.get_renderer(), render.MarkdownRenderer)
+
+    render.use_backend("markdown-it")
+    assert isinstance(render.get_renderer(), render_markdown_it.MarkdownItRenderer)
+    assert render.get_renderer().settings() != render.MarkdownRenderer().settings()
+
+    monkeypatch.setenv(render.BACKEND_ENV, "mistune")
+    with pytest.raises(ValueError):
+        render.get_renderer()
+
+
+def test_renderers_must_implement_every_method():
+    class NoSettings(render.Renderer):
+        def render(self, raw_string):
+            return raw_string
+
+        def render_field(self, raw_string, media_root):
+            return raw_string, [], False
+
+    with pytest.raises(TypeError):
+        NoSettings()
@@ -0,0 +1,76 @@
+import os
+
+import scanner
+import sync_index
+
+
+def touch(path, content="**x**\n"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+
+
+def test_scan_prunes_ignored_directories(tmp_path):
+    touch(tmp_path / "b.md")
+    touch(tmp_path / "a.md")
+    touch(tmp_path / "_draft.md")
+    touch(tmp_path / "image.png")
+    touch(tmp_path / "sub" / "c.md")
+    touch(tmp_path / "discussion" / "d.md")
+    touch(tmp_path / "discussion" / "nested" / "e.md")
+
+    files = scanner.scan({"deck": str(tmp_path)}, ["discussion"])
+
+    assert [os.path.relpath(f.path, tmp_path) for f in files] == [
+        "a.md",
+        "b.md",
+        os.path.join("sub", "c.md"),
+    ]
+    assert all(f.deck_path == "deck" for f in files)
+    assert files[2].root == str(tmp_path / "sub")
+
+
+def test_only_changed_files_are_listed(tmp_path):
+    touch(tmp_path / "a.md")
+    touch(tmp_path / "b.md")
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    for scanned in scanner.scan({"deck": str(tmp_path)}, []):
+        index.plan(scanned.path, scanned.stat, [])
+        index.done(scanned.path, [])
+
+    touch(tmp_path / "b.md", "**x**\n\n**y**\n")
+    touch(tmp_path / "c.md")
+
+    files = scanner.scan({"deck": str(tmp_path)}, [])
+    changed = scanner.changed(files, index.stats())
+    assert [os.path.basename(f.path) for f in changed] == ["b.md", "c.md"]
+
+
+def test_scan_paths_keeps_notes_of_the_decks(tmp_path):
+    touch(tmp_path / "a.md")
+    touch(tmp_path / "discussion" / "b.md")
+    touch(tmp_path / "image.png")
+    paths = [
+        str(tmp_path / "a.md"),
+        str(tmp_path / "discussion" / "b.md"),
+        str(tmp_path / "image.png"),
+        str(tmp_path / "deleted.md"),
+        str(tmp_path.parent / "elsewhere.md"),
+    ]
+
+    files = scanner.scan_paths({"deck": str(tmp_path)}, ["discussion"], paths)
+
+    assert [f.path for f in files] == [str(tmp_path / "a.md")]
+
+
+def test_removed_files_are_found_in_their_decks(tmp_path):
+    deck = tmp_path / "deck"
+    touch(deck / "kept.md")
+    touch(deck / "_ignored.md")
+    synced = [str(deck / name) for name in ["kept.md", "_ignored.md", "gone.md"]]
+    # another vault's notes are not ours to delete
+    synced.append(str(tmp_path / "other" / "gone.md"))
+
+    files = scanner.scan({"deck": str(deck)}, [])
+    assert scanner.removed({"deck": str(deck)}, files, synced) == [
+        str(deck / "gone.md")
+    ]
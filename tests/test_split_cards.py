@@ -0,0 +1,32 @@
+import io
+
+import parser
+
+
+def test_cards_keep_the_headings_they_were_written_under():
+    cards = parser.split_cards("# A\n**a**\n\n# B\n**b**\n\n## C\n**c**\n")
+
+    assert [tags for _, _, tags in cards] == [("A",), ("B",), ("B", "C")]
+
+
+def test_cards_are_yielded_before_the_rest_is_read():
+    read = []
+
+    def lines():
+        for line in ["**a**\n", "\n", "**b**\n", "\n", "**c**\n"]:
+            read.append(line)
+            yield line
+
+    cards = parser.iter_cards(lines())
+    assert next(cards)[0] == "**a**\n"
+    assert len(read) == 3
+    assert [text for text, _, _ in cards] == ["**b**\n", "**c**\n"]
+
+
+def test_file_handle_matches_split_cards():
+    content = "---\ntitle: x\n---\n# H\n**a**\n  extra\n\n```\n# code\n```\n"
+
+    streamed = list(parser.iter_cards(parser.skip_front_matter(io.StringIO(content))))
+
+    assert streamed == parser.split_cards(parser.remove_yaml(content))
+    assert streamed == [("**a**\n```\n# code\n```\n", "extra\n", ("H",))]
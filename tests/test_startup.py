@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import scanner
+import sync_index
+
+SRC = Path(__file__).parent.parent / "src"
+HEAVY = ["rich", "markdown", "bs4", "pygments", "asyncio", "http.client"]
+
+
+def run_main(directory: Path) -> list[str]:
+    # the working directory goes first, for its deckConsts.py
+    code = (
+        f"import sys; sys.path.insert(1, {str(SRC)!r}); import main; main.main(); "
+        f"print(*[name for name in {HEAVY!r} if name in sys.modules])"
+    )
+    env = dict(os.environ, MD_TO_ANKI_DATA_DIR=str(directory / "data"))
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=directory,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.splitlines()
+
+
+def test_nothing_to_sync_skips_the_rendering_stack(tmp_path):
+    vault = tmp_path / "vault"
+    vault.mkdir()
+    (vault / "note.md").write_text("**x**\n", encoding="utf-8")
+    decks = {"deck": str(vault)}
+    (tmp_path / "deckConsts.py").write_text(
+        f"DECKS = {decks!r}\nIGNORE_KEYWORDS = 'discussion'\n", encoding="utf-8"
+    )
+
+    (tmp_path / "data").mkdir()
+    index = sync_index.SyncIndex(tmp_path / "data" / "sync-index.sqlite3")
+    for scanned in scanner.scan(decks, "discussion"):
+        index.plan(scanned.path, scanned.stat, [])
+        index.done(scanned.path, [])
+    index.close()
+
+    assert run_main(tmp_path) == ["0 of 1 notes changed since the last sync", ""]
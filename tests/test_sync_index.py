@@ -0,0 +1,201 @@
+import os
+
+import parser
+import sync_index
+
+
+def split(content: str):
+    return parser.split_cards(sync_index.strip_markers(content))
+
+
+def test_unchanged_file_is_recognised_by_stat(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = tmp_path / "note.md"
+    note.write_text("**a**\n\n**b**\n", encoding="utf-8")
+
+    state = index.plan(str(note), note.stat(), split(note.read_text()))
+    assert state.new == [0, 1]
+    index.done(str(note), [11, 12])
+
+    assert index.unchanged(str(note), note.stat())
+    assert index.cards(str(note)) == {
+        sync_index.card_hash(f): i for f, i in zip(split("**a**\n\n**b**"), [11, 12])
+    }
+
+    note.write_text("**a**\n\n**b**\n\n**c**\n", encoding="utf-8")
+    assert not index.unchanged(str(note), note.stat())
+
+
+def test_only_new_cards_are_planned(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+
+    index.plan(note, stat, split("**a**\n\n**b**"))
+    index.done(note, [1, 2])
+
+    state = index.plan(note, stat, split("**new**\n\n**a**\n\n**b**"))
+    assert state.new == [0]
+    index.done(note, [3])
+    assert sorted(index.cards(note).values()) == [1, 2, 3]
+
+    # forcing sends everything again but keeps the IDs of rejected duplicates
+    state = index.plan(note, stat, split("**new**\n\n**a**\n\n**b**"), force=True)
+    assert state.new == [0, 1, 2]
+    index.failed(note, [None, None, None])
+    assert sorted(index.cards(note).values()) == [1, 2, 3]
+
+
+def test_failed_file_keeps_accepted_cards_and_is_read_again(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+
+    index.plan(note, stat, split("**a**\n\n**b**"))
+    index.failed(note, [7, None])
+
+    assert not index.unchanged(note, stat)
+    assert index.plan(note, stat, split("**a**\n\n**b**")).new == [1]
+
+
+def test_migration_reads_markers(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+    content = "**a**\n\n***\n**b**\n***\n\n**c**\n"
+
+    last = list(sync_index.MARKER_RE.finditer(content))[-1]
+    imported = len(split(content[: last.start()]))
+    index.migrate(note, stat, split(content), imported, complete=False)
+
+    assert imported == 2
+    assert not index.unchanged(note, stat)
+    assert index.plan(note, stat, split(content)).new == [2]
+
+
+def test_markers_keep_cards_apart():
+    assert [f[0] for f in split("**a**\n***\n**b**")] == ["**a**\n", "**b**\n"]
+    assert sync_index.strip_markers("***bold italic***") == "***bold italic***"
+
+
+def test_diff_updates_edited_cards_and_deletes_removed_ones(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+
+    index.plan(note, stat, split("**a**\n\n**b**\n\n**c**\n\n**d**"))
+    index.done(note, [1, 2, 3, 4])
+
+    content = "**a**\n\n**b edited**\n\n**d**\n\n**e**"
+    state = index.plan(note, stat, split(content), diff=True)
+    assert state.new == [3]
+    assert state.updates == [(1, 2)]
+    assert state.deletes == [3]
+
+    payload = [
+        {"deckName": "deck", "fields": {"Text": "e"}},
+        {"deckName": "deck", "fields": {"Text": "b edited"}},
+    ]
+    adds, updates, deletes = index.changes(note, payload)
+    assert adds == [payload[0]]
+    assert updates == [{"id": 2, "fields": {"Text": "b edited"}}]
+    assert deletes == [3]
+
+    index.done(note, [5, 2])
+    assert [note_id for _, note_id in index.rows(note)] == [1, 2, 4, 5]
+    assert index.plan(note, stat, split(content), diff=True).render == []
+
+
+def test_failed_diff_is_planned_again(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+
+    index.plan(note, stat, split("**a**\n\n**b**\n\n**c**"))
+    index.done(note, [1, 2, 3])
+
+    content = "**a edited**\n\n**b**"
+    index.plan(note, stat, split(content), diff=True)
+    index.failed(note, [None])
+
+    state = index.plan(note, stat, split(content), diff=True)
+    assert state.updates == [(0, 1)]
+    assert state.deletes == [3]
+
+
+def test_diff_keeps_moved_cards(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+
+    index.plan(note, stat, split("**a**\n\n**b**\n\n**c**"))
+    index.done(note, [1, 2, 3])
+
+    state = index.plan(note, stat, split("**c**\n\n**a**\n\n**b**\n\n**a**"), diff=True)
+    assert state.render == []
+    assert state.deletes == []
+    index.done(note, [])
+    assert [note_id for _, note_id in index.rows(note)] == [3, 1, 2, None]
+
+
+def cloze(text: str, deck: str = "deck", allow_duplicate: bool = False) -> dict:
+    return {
+        "deckName": deck,
+        "fields": {"Text": text, "Extra": ""},
+        "options": {"allowDuplicate": allow_duplicate},
+    }
+
+
+def test_first_fields_of_synced_notes_find_duplicates(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+
+    index.plan(note, stat, split("**a**\n\n**b**"))
+    index.changes(note, [cloze("{{c1::a}}"), cloze("{{c1::b}}")])
+    index.done(note, [1, 2])
+
+    assert index.duplicates(
+        [
+            cloze(" <b>{{c1::a}}</b>"),
+            cloze("{{c1::a}}", deck="other"),
+            cloze("{{c1::c}}"),
+            cloze("{{c1::c}}"),
+            cloze("{{c1::b}}", allow_duplicate=True),
+        ]
+    ) == [True, False, False, True, False]
+
+
+def test_skipped_notes_complete_their_file(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = tmp_path / "note.md"
+    note.write_text("**a**\n\n**b**\n\n**c**\n", encoding="utf-8")
+    cards = split(note.read_text())
+
+    index.plan(str(note), note.stat(), cards)
+    index.changes(str(note), [cloze("{{c1::a}}"), cloze("{{c1::b}}"), cloze("c")])
+    index.skip(str(note), [0, 2])
+    index.done(str(note), [7])
+
+    assert index.unchanged(str(note), note.stat())
+    assert index.rows(str(note)) == [
+        (sync_index.card_hash(cards[0]), None),
+        (sync_index.card_hash(cards[1]), 7),
+        (sync_index.card_hash(cards[2]), None),
+    ]
+    assert index.duplicates([cloze("{{c1::a}}"), cloze("{{c1::b}}")]) == [False, True]
+
+
+def test_notes_in_anki_without_an_id_are_recorded(tmp_path):
+    index = sync_index.SyncIndex(tmp_path / "index.sqlite3")
+    note = str(tmp_path / "note.md")
+    stat = os.stat(tmp_path)
+
+    cards = split("**a**\n\n**b**")
+    index.plan(note, stat, cards)
+    index.done(note, [1, None])
+    assert index.rows(note) == [
+        (sync_index.card_hash(cards[0]), 1),
+        (sync_index.card_hash(cards[1]), None),
+    ]
+    assert index.plan(note, stat, cards).render == []
@@ -0,0 +1,26 @@
+import parser
+from benchmarks import vault
+
+
+def test_vault_is_reproducible(tmp_path):
+    spec = vault.VaultSpec(files=3, cards=10, seed=4)
+    first = vault.make_vault(tmp_path / "a", spec)
+    second = vault.make_vault(tmp_path / "b", spec)
+
+    assert [p.read_bytes() for p in first] == [p.read_bytes() for p in second]
+    other = vault.make_vault(tmp_path / "c", vault.VaultSpec(files=3, cards=10))
+    assert first[0].read_bytes() != other[0].read_bytes()
+
+
+def test_every_generated_card_is_parsed(tmp_path):
+    spec = vault.VaultSpec(files=2, cards=30, code=0.5, separated=0.5, images=0.5)
+    paths = vault.make_vault(tmp_path, spec)
+
+    for path in paths:
+        fields = parser.split_cards(path.read_text(encoding="utf-8"))
+        assert len(fields) == spec.cards
+        assert any("---" not in e and e for _, e, _ in fields)
+
+        cards = parser.render_cards(fields, path.parent)
+        assert all(card.cloze_count for card in cards)
+        assert any(card.images for card in cards)
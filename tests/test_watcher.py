@@ -0,0 +1,62 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import watcher
+
+WATCHERS = [watcher.PollingWatcher]
+if sys.platform.startswith("linux"):
+    WATCHERS.append(watcher.InotifyWatcher)
+
+
+def save_later(path, content, delay=0.05):
+    def save():
+        time.sleep(delay)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+
+    thread = threading.Thread(target=save)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize("kind", WATCHERS, ids=lambda k: k.name)
+def test_saved_notes_are_reported(tmp_path, kind):
+    (tmp_path / "discussion").mkdir()
+    (tmp_path / "a.md").write_text("**a**\n", encoding="utf-8")
+    events = (
+        kind({"deck": str(tmp_path)}, ["discussion"], interval=0.01)
+        if kind is watcher.PollingWatcher
+        else kind({"deck": str(tmp_path)}, ["discussion"])
+    )
+    try:
+        thread = save_later(tmp_path / "a.md", "**a**\n\n**b**\n")
+        assert events.wait(debounce=0.1) == {str(tmp_path / "a.md")}
+        thread.join()
+
+        thread = save_later(tmp_path / "sub" / "c.md", "**c**\n")
+        assert str(tmp_path / "sub" / "c.md") in events.wait(debounce=0.1)
+        thread.join()
+    finally:
+        events.close()
+
+
+def test_rapid_saves_are_debounced(tmp_path):
+    events = watcher.PollingWatcher({"deck": str(tmp_path)}, [], interval=0.01)
+    saves = [
+        save_later(tmp_path / f"{i}.md", "**x**\n", delay=0.02 * i) for i in range(4)
+    ]
+    paths = events.wait(debounce=0.1)
+    for thread in saves:
+        thread.join()
+    assert paths == {str(tmp_path / f"{i}.md") for i in range(4)}
+
+
+def test_watchers_must_report_changes():
+    class Silent(watcher.Watcher):
+        pass
+
+    with pytest.raises(TypeError):
+        Silent()